@@ -0,0 +1,238 @@
+import threading
+from array import array
+from datetime import date, timedelta
+
+from availability import hour_to_minute
+from data_structures import building, organizations, users
+from records import booking_key
+from repository import add_mutation_listener, get_user
+
+# Columnar copy of every one-off booking for the reports: one row per booking, one typed array per column.
+# The columns are plain arrays so that keeping them up to date needs nothing beyond the standard library;
+# queries view them as NumPy arrays (imported on first use) and aggregate them without a Python loop,
+# which keeps a report over ten million bookings well under a second.
+booking_table = {
+    "room": array("i"),  # index into table_rooms
+    "organization": array("i"),  # index into table_organizations
+    "user": array("i"),  # index into table_users
+    "date": array("i"),  # date ordinal
+    "start": array("h"),  # start minute
+    "end": array("h"),  # end minute
+}
+# Booking key of every row, and the row of every booking key, used to delete a row in O(1)
+row_keys = []
+rows_by_key = {}
+# Room/Organization/User ID -> index stored in the columns, indexes are given in insertion order
+table_rooms = {}
+table_organizations = {}
+table_users = {}
+booking_table_lock = threading.Lock()
+
+NUMPY_TYPES = {"i": "int32", "h": "int16"}
+
+
+# Function to import NumPy, only the reports and the free slot search (see free_slots.py) need it
+def load_numpy():
+    import numpy
+    return numpy
+
+
+def _table_index(table, value):
+    index = table.get(value)
+    if index is None:
+        index = table[value] = len(table)
+    return index
+
+
+# Function to add a booking as a row of the table, bookings already in the table are skipped
+def add_booking_row(booking, organization_id):
+    with booking_table_lock:
+        if booking.key in rows_by_key:
+            return
+        rows_by_key[booking.key] = len(row_keys)
+        row_keys.append(booking.key)
+        booking_table["room"].append(_table_index(table_rooms, booking.room_id))
+        booking_table["organization"].append(_table_index(table_organizations, organization_id))
+        booking_table["user"].append(_table_index(table_users, booking.user_id))
+        booking_table["date"].append(date.fromisoformat(booking.date).toordinal())
+        booking_table["start"].append(hour_to_minute(booking.start_hour))
+        booking_table["end"].append(hour_to_minute(booking.end_hour))
+
+
+# Function to delete the row of a booking by moving the last row into its place
+def remove_booking_row(key):
+    with booking_table_lock:
+        row = rows_by_key.pop(key, None)
+        if row is None:
+            return
+        last_key = row_keys.pop()
+        for column in booking_table.values():
+            last_value = column.pop()
+            if row < len(column):
+                column[row] = last_value
+        if last_key != key:
+            row_keys[row] = last_key
+            rows_by_key[last_key] = row
+
+
+# Mutation listener keeping the table in line with the repository
+def record_mutation(operation, record):
+    if operation == "add_booking":
+        user = get_user(record["User ID"])
+        if user:
+            add_booking_row(record, user["Organization ID"])
+    elif operation == "remove_booking":
+        remove_booking_row(booking_key(record))
+    elif operation == "remove_user":
+        user_index = table_users.get(record)
+        if user_index is not None:
+            keys = [row_keys[row] for row, value in enumerate(booking_table["user"]) if value == user_index]
+            for key in keys:
+                remove_booking_row(key)
+
+
+# Function to rebuild the table from the users' bookings, one column at a time
+def rebuild_booking_table():
+    rows = [(booking, user["Organization ID"]) for user in users for booking in user.get("Bookings", [])]
+    with booking_table_lock:
+        row_keys[:] = [booking.key for booking, _ in rows]
+        rows_by_key.clear()
+        rows_by_key.update((key, row) for row, key in enumerate(row_keys))
+        columns = {
+            "room": [_table_index(table_rooms, booking.room_id) for booking, _ in rows],
+            "organization": [_table_index(table_organizations, organization_id) for _, organization_id in rows],
+            "user": [_table_index(table_users, booking.user_id) for booking, _ in rows],
+            "date": [date.fromisoformat(booking.date).toordinal() for booking, _ in rows],
+            "start": [hour_to_minute(booking.start_hour) for booking, _ in rows],
+            "end": [hour_to_minute(booking.end_hour) for booking, _ in rows],
+        }
+        for name, values in columns.items():
+            booking_table[name] = array(booking_table[name].typecode, values)
+
+
+# Function to get a copy of some columns as NumPy arrays, for the rows between two dates (both inclusive)
+def get_columns(start_date, end_date, names):
+    numpy = load_numpy()
+    with booking_table_lock:
+        # Copied while locked: a column cannot grow while a view of its buffer exists
+        columns = {
+            name: numpy.frombuffer(booking_table[name], dtype=NUMPY_TYPES[booking_table[name].typecode]).copy()
+            for name in set(names) | {"date"}
+        }
+    dates = columns["date"]
+    selected = (dates >= start_date.toordinal()) & (dates <= end_date.toordinal())
+    if selected.all():
+        return columns
+    return {name: column[selected] for name, column in columns.items()}
+
+
+# Function to get the room utilization of every floor per week, as the fraction of booked room-minutes
+# Weeks start on Monday, only the days between start_date and end_date count towards a week
+# Returns {floor number: {week start date (iso): utilization}}
+def get_floor_utilization(start_date, end_date):
+    numpy = load_numpy()
+    columns = get_columns(start_date, end_date, ("room", "start", "end"))
+    floor_numbers = [floor["Floor Number"] for floor in building["Floors"]]
+    floor_indexes = {floor["Floor ID"]: index for index, floor in enumerate(building["Floors"])}
+    first_monday = start_date - timedelta(days=start_date.weekday())
+    weeks = (end_date - first_monday).days // 7 + 1
+
+    # Floor of every room in the table, -1 for rooms no longer in the building
+    room_floors = numpy.full(len(table_rooms) + 1, -1, dtype=numpy.int64)
+    rooms_per_floor = numpy.zeros(len(floor_numbers), dtype=numpy.int64)
+    for room in building["Rooms"]:
+        floor_index = floor_indexes.get(room["Floor ID"])
+        if floor_index is None:
+            continue
+        rooms_per_floor[floor_index] += 1
+        room_index = table_rooms.get(room["Room ID"])
+        if room_index is not None:
+            room_floors[room_index] = floor_index
+
+    floors = room_floors[columns["room"]]
+    in_building = floors >= 0
+    week_indexes = (columns["date"][in_building] - first_monday.toordinal()) // 7
+    booked_minutes = (columns["end"][in_building].astype(numpy.int64) - columns["start"][in_building])
+    booked = numpy.bincount(
+        floors[in_building] * weeks + week_indexes, weights=booked_minutes, minlength=len(floor_numbers) * weeks
+    ).reshape(len(floor_numbers), weeks)
+
+    utilization = {}
+    for week in range(weeks):
+        week_start = first_monday + timedelta(weeks=week)
+        days = (min(week_start + timedelta(days=6), end_date) - max(week_start, start_date)).days + 1
+        for floor_index, floor_number in enumerate(floor_numbers):
+            available = rooms_per_floor[floor_index] * days * 24 * 60
+            utilization.setdefault(floor_number, {})[week_start.isoformat()] = (
+                float(booked[floor_index, week] / available) if available else 0.0
+            )
+    return utilization
+
+
+# Function to get the number of months since year 0 of a date
+def month_number(day):
+    return day.year * 12 + day.month - 1
+
+
+# Function to get the booked hours of every organization per month
+# Returns {organization name: {"YYYY-MM": hours}}, with only the months having bookings
+def get_organization_monthly_hours(start_date, end_date):
+    numpy = load_numpy()
+    columns = get_columns(start_date, end_date, ("organization", "start", "end"))
+    # Month of every day of the range, looked up by the booking's day offset instead of converting every date
+    first_month = month_number(start_date)
+    months = month_number(end_date) - first_month + 1
+    month_of_day = numpy.array([
+        month_number(start_date + timedelta(days=day)) - first_month for day in range((end_date - start_date).days + 1)
+    ], dtype=numpy.int64)
+    month_indexes = month_of_day[columns["date"] - start_date.toordinal()]
+    booked_minutes = columns["end"].astype(numpy.int64) - columns["start"]
+    totals = numpy.bincount(
+        columns["organization"].astype(numpy.int64) * months + month_indexes, weights=booked_minutes,
+        minlength=len(table_organizations) * months
+    ).reshape(len(table_organizations), months) / 60
+
+    names = {org["Organization ID"]: org["Name"] for org in organizations}
+    monthly_hours = {}
+    for organization_id, organization_index in table_organizations.items():
+        row = totals[organization_index]
+        hours = {
+            f"{(first_month + month) // 12}-{(first_month + month) % 12 + 1:02d}": float(row[month])
+            for month in range(months) if row[month]
+        }
+        if hours:
+            monthly_hours[names.get(organization_id, organization_id)] = hours
+    return monthly_hours
+
+
+# Function to get the organizations with the most booked hours, as a list of (organization name, hours)
+def get_top_organizations(start_date, end_date, limit=10):
+    numpy = load_numpy()
+    columns = get_columns(start_date, end_date, ("organization", "start", "end"))
+    booked_minutes = columns["end"].astype(numpy.int64) - columns["start"]
+    totals = numpy.bincount(columns["organization"], weights=booked_minutes, minlength=len(table_organizations)) / 60
+    names = {org["Organization ID"]: org["Name"] for org in organizations}
+    organization_ids = list(table_organizations)
+    top = numpy.argsort(-totals, kind="stable")[:limit]
+    return [(names.get(organization_ids[index], organization_ids[index]), float(totals[index]))
+            for index in top if totals[index]]
+
+
+# Function to get the booked hours per hour of the day, a list of 24 values
+# Only the bookings of one organization are counted when organization_id is given
+def get_peak_hours(start_date, end_date, organization_id=None):
+    numpy = load_numpy()
+    columns = get_columns(start_date, end_date, ("organization", "start", "end"))
+    starts, ends = columns["start"], columns["end"]
+    if organization_id is not None:
+        selected = columns["organization"] == table_organizations.get(organization_id, -1)
+        starts, ends = starts[selected], ends[selected]
+    # Number of bookings running at every minute of the day: +1 where a booking starts, -1 where it ends
+    running = numpy.cumsum(
+        numpy.bincount(starts, minlength=24 * 60 + 1) - numpy.bincount(ends, minlength=24 * 60 + 1)
+    )[:24 * 60]
+    return (running.reshape(24, 60).sum(axis=1) / 60).tolist()
+
+
+add_mutation_listener(record_mutation)
+rebuild_booking_table()
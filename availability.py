@@ -0,0 +1,260 @@
+import itertools
+from bisect import bisect_left, insort
+from datetime import datetime as dt
+
+from calendar_file import (
+    close_availability_calendar, get_day_location, has_busy_minute, read_day, set_minutes, write_day
+)
+from data_structures import room_availability, room_booked_dates, room_busy_bitmaps
+from locks import get_room_locks
+from recurrence import occurs_on, series_share_a_date
+from repository import get_room_series
+
+MINUTES_PER_DAY = 24 * 60
+
+# The busy bitmaps of the dates within the horizon of the availability calendar (see calendar_file.py), when
+# one is open, are kept in its file and read and changed there; room_busy_bitmaps keeps the other dates.
+# Open the calendar before the state is loaded, the rebuild after loading fills it.
+
+# Date -> version of the one-off bookings on that date, changed by every reserve/release, so that
+# anything derived from a date's bookings (e.g. the free slot matrix) can tell when it is stale
+availability_versions = {}
+_versions = itertools.count(1)
+
+
+# Convert an hour of the day (int or float, e.g. 9.5 for 09:30) into minutes since midnight
+def hour_to_minute(hour):
+    return int(round(hour * 60))
+
+
+# Function to get the bitmap of the minutes between start_minute and end_minute
+def minutes_bitmap(start_minute, end_minute):
+    return ((1 << (end_minute - start_minute)) - 1) << start_minute
+
+
+# Function to get the bitmap of booked minutes of a room on a date, series occurrences included
+def get_busy_bitmap(room_id, date):
+    calendar_map, offset = get_day_location(room_id, date)
+    busy_bitmap = read_day(calendar_map, offset) if calendar_map is not None else room_busy_bitmaps.get(
+        (room_id, date), 0
+    )
+    for series in get_room_series(room_id):
+        if occurs_on(series, date):
+            busy_bitmap |= minutes_bitmap(hour_to_minute(series["Start Hour"]), hour_to_minute(series["End Hour"]))
+    return busy_bitmap
+
+
+# Function to get the sorted list of booked intervals of a room on a date
+# Every entry is a (start_minute, end_minute, booking key) tuple, with the integer key of the Booking ID,
+# and entries never overlap. Occurrences of recurring series are included with their Series ID as key.
+def get_booked_intervals(room_id, date):
+    intervals = room_availability.get((room_id, date), [])
+    occurrences = [
+        (hour_to_minute(series["Start Hour"]), hour_to_minute(series["End Hour"]), series["Series ID"])
+        for series in get_room_series(room_id) if occurs_on(series, date)
+    ]
+    return sorted(intervals + occurrences) if occurrences else intervals
+
+
+# Function to check if a one-off booking of a room overlaps the slot between start_minute and end_minute
+def has_booking_conflict(room_id, date, start_minute, end_minute):
+    calendar_map, offset = get_day_location(room_id, date)
+    if calendar_map is not None:
+        return has_busy_minute(calendar_map, offset, start_minute, end_minute)
+    intervals = room_availability.get((room_id, date))
+    if not intervals:
+        return False
+    # Index of the first interval starting at or after end_minute; only the one
+    # before it can overlap the requested slot because intervals never overlap.
+    index = bisect_left(intervals, (end_minute,))
+    return index > 0 and intervals[index - 1][1] > start_minute
+
+
+# Function to check if a room is free between start_minute and end_minute on a date
+def is_room_available(room_id, date, start_minute, end_minute):
+    if has_booking_conflict(room_id, date, start_minute, end_minute):
+        return False
+    for series in get_room_series(room_id):
+        series_start, series_end = hour_to_minute(series["Start Hour"]), hour_to_minute(series["End Hour"])
+        if series_start < end_minute and start_minute < series_end and occurs_on(series, date):
+            return False
+    return True
+
+
+# Function to reserve a slot of a room on a date, returns False if the slot is taken
+def reserve_slot(room_id, date, start_minute, end_minute, booking_id):
+    if not is_room_available(room_id, date, start_minute, end_minute):
+        return False
+    record_slot(room_id, date, start_minute, end_minute, booking_id)
+    return True
+
+
+# Function to record a slot that is known to be free, e.g. one a shard has already reserved, without checking
+def record_slot(room_id, date, start_minute, end_minute, booking_id):
+    intervals = room_availability.setdefault((room_id, date), [])
+    if not intervals:
+        insort(room_booked_dates.setdefault(room_id, []), date)
+    insort(intervals, (start_minute, end_minute, booking_id))
+    calendar_map, offset = get_day_location(room_id, date, create=True)
+    if calendar_map is not None:
+        set_minutes(calendar_map, offset, start_minute, end_minute)
+    else:
+        room_busy_bitmaps[(room_id, date)] = room_busy_bitmaps.get((room_id, date), 0) | minutes_bitmap(
+            start_minute, end_minute
+        )
+    availability_versions[date] = next(_versions)
+
+
+# Function to release a previously reserved slot of a room on a date
+def release_slot(room_id, date, start_minute, booking_id):
+    intervals = room_availability.get((room_id, date))
+    if not intervals:
+        return False
+    index = bisect_left(intervals, (start_minute,))
+    while index < len(intervals) and intervals[index][0] == start_minute:
+        if intervals[index][2] == booking_id:
+            calendar_map, offset = get_day_location(room_id, date)
+            if calendar_map is not None:
+                set_minutes(calendar_map, offset, start_minute, intervals[index][1], busy=False)
+            else:
+                room_busy_bitmaps[(room_id, date)] &= ~minutes_bitmap(start_minute, intervals[index][1])
+            del intervals[index]
+            if not intervals:
+                del room_availability[(room_id, date)]
+                room_busy_bitmaps.pop((room_id, date), None)
+                booked_dates = room_booked_dates[room_id]
+                del booked_dates[bisect_left(booked_dates, date)]
+            availability_versions[date] = next(_versions)
+            return True
+        index += 1
+    return False
+
+
+# Function to reserve several slots under their rooms' locks, either every slot is reserved or none is
+# Every slot is a (room_id, date, start_minute, end_minute, booking key) tuple; returns the indexes of the
+# slots that are taken, an empty list when every slot was reserved
+def reserve_slots(slots):
+    room_locks = get_room_locks({slot[0] for slot in slots})
+    for lock in room_locks:
+        lock.acquire()
+    try:
+        taken = [index for index, (room_id, date, start_minute, end_minute, _) in enumerate(slots)
+                 if not is_room_available(room_id, date, start_minute, end_minute)]
+        if not taken:
+            for slot in slots:
+                reserve_slot(*slot)
+        return taken
+    finally:
+        for lock in reversed(room_locks):
+            lock.release()
+
+
+# Function to release slots reserved by reserve_slots, under their rooms' locks
+def release_slots(slots):
+    room_locks = get_room_locks({slot[0] for slot in slots})
+    for lock in room_locks:
+        lock.acquire()
+    try:
+        for room_id, date, start_minute, _, booking_id in slots:
+            release_slot(room_id, date, start_minute, booking_id)
+    finally:
+        for lock in reversed(room_locks):
+            lock.release()
+
+
+# Function to list the dates from start_date (inclusive) on which a room has one-off bookings
+def get_booked_dates(room_id, start_date, end_date=None):
+    booked_dates = room_booked_dates.get(room_id, [])
+    for date in booked_dates[bisect_left(booked_dates, start_date):]:
+        if end_date and date > end_date:
+            break
+        yield date
+
+
+# Function to check if a recurring series overlaps a one-off booking of its room
+# Only dates that actually have bookings are visited, so open-ended series stay cheap
+def has_series_conflict(series, start_date, end_date=None):
+    start_minute = hour_to_minute(series["Start Hour"])
+    end_minute = hour_to_minute(series["End Hour"])
+    return any(
+        occurs_on(series, date) and has_booking_conflict(series["Room ID"], date, start_minute, end_minute)
+        for date in get_booked_dates(series["Room ID"], start_date, end_date)
+    )
+
+
+# Function to check if a recurring series overlaps another series of its room
+def has_recurring_conflict(series):
+    start_minute = hour_to_minute(series["Start Hour"])
+    end_minute = hour_to_minute(series["End Hour"])
+    return any(
+        hour_to_minute(other["Start Hour"]) < end_minute and start_minute < hour_to_minute(other["End Hour"])
+        and series_share_a_date(series, other)
+        for other in get_room_series(series["Room ID"]) if other["Series ID"] != series["Series ID"]
+    )
+
+
+# Function to list the free (start_minute, end_minute) gaps of a room on a date
+def get_free_intervals(room_id, date, day_start=0, day_end=MINUTES_PER_DAY):
+    free_intervals = []
+    cursor = day_start
+    for start_minute, end_minute, _ in get_booked_intervals(room_id, date):
+        if end_minute <= cursor:
+            continue
+        if start_minute >= day_end:
+            break
+        if start_minute > cursor:
+            free_intervals.append((cursor, start_minute))
+        cursor = max(cursor, end_minute)
+    if cursor < day_end:
+        free_intervals.append((cursor, day_end))
+    return free_intervals
+
+
+# Function to rebuild the availability of every room from the users' bookings
+# The intervals of every room and date are gathered and sorted once, the saved bookings never overlap
+def rebuild_availability(users):
+    intervals_by_day = {}
+    # Many bookings share a date, each one is parsed once
+    days = {}
+    for user in users:
+        for booking in user.get("Bookings", []):
+            day = days.get(booking.date)
+            if day is None:
+                day = days[booking.date] = dt.fromisoformat(booking.date).date()
+            intervals_by_day.setdefault((booking.room_id, day), []).append(
+                (hour_to_minute(booking.start_hour), hour_to_minute(booking.end_hour), booking.key)
+            )
+
+    # Every day of the calendar with bookings has an entry in room_availability
+    for room_id, day in room_availability:
+        calendar_map, offset = get_day_location(room_id, day)
+        if calendar_map is not None:
+            write_day(calendar_map, offset, 0)
+    room_availability.clear()
+    room_busy_bitmaps.clear()
+    room_booked_dates.clear()
+    availability_versions.clear()
+    for (room_id, day), intervals in intervals_by_day.items():
+        intervals.sort()
+        busy_bitmap = 0
+        for start_minute, end_minute, _ in intervals:
+            busy_bitmap |= minutes_bitmap(start_minute, end_minute)
+        room_availability[(room_id, day)] = intervals
+        calendar_map, offset = get_day_location(room_id, day, create=True)
+        if calendar_map is not None:
+            write_day(calendar_map, offset, busy_bitmap)
+        else:
+            room_busy_bitmaps[(room_id, day)] = busy_bitmap
+        room_booked_dates.setdefault(room_id, []).append(day)
+    for booked_dates in room_booked_dates.values():
+        booked_dates.sort()
+
+
+# Function to move the busy bitmaps held by the availability calendar back into memory and close it, for a
+# process forked from the one writing the calendar that keeps its own availability (e.g. a shard)
+def detach_availability_calendar():
+    for room_id, date in room_availability:
+        calendar_map, offset = get_day_location(room_id, date)
+        if calendar_map is not None:
+            room_busy_bitmaps[(room_id, date)] = read_day(calendar_map, offset)
+    close_availability_calendar()
@@ -0,0 +1,615 @@
+import argparse
+import gc
+import json
+import os
+import pickle
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from datetime import date, timedelta
+
+from conference_rooms import (
+    book_room, book_rooms_batch, cancel_booking, list_organization_bookings_in_date_range, search_suitable_rooms,
+    view_user_bookings
+)
+from data_structures import room_availability
+from journal import SNAPSHOT_FILE_NAME
+from locks import ROOM_LOCK_STRIPES, configure_room_locks
+from metrics import enable_metrics, get_metrics
+from passwords import hash_password, shutdown_password_executor
+from records import as_booking
+from repository import add_floor, add_organization, add_room, add_user
+from room_search import index_room
+from sessions import create_session
+from sharding import get_shard_cpu_times, start_shards, stop_shards
+from users import authenticate
+
+BENCHMARK_MONTHS = 120
+BENCHMARK_START_DATE = date(2030, 1, 1)
+BENCHMARK_PASSWORD = "benchmark"
+BENCHMARK_AMENITIES = ["Projector", "Whiteboard", "Video Conference", "Phone"]
+# Longest time a fresh process may take to import the application and recover the startup benchmark's snapshot
+STARTUP_BUDGET_SECONDS = 2.0
+OPERATIONS = ["book_room", "cancel_booking", "search_suitable_rooms", "list_organization_bookings_in_date_range",
+              "view_user_bookings", "login"]
+
+
+# Function to create a synthetic building with one organization, user and session per thread
+def create_stress_fixture(floors, rooms_per_floor, threads):
+    room_ids = []
+    for floor_number in range(floors):
+        floor = {"Floor ID": str(uuid.uuid4()), "Floor Number": f"bench-{uuid.uuid4()}", "Room IDs": []}
+        add_floor(floor)
+        for room_number in range(rooms_per_floor):
+            room = {
+                "Room ID": str(uuid.uuid4()),
+                "Room Name": f"bench-{floor_number}-{room_number}-{uuid.uuid4()}",
+                "Floor ID": floor["Floor ID"],
+                "Capacity": random.randint(2, 20),
+                "Additional Details": {},
+                "Room Settings": {}
+            }
+            add_room(floor, room)
+            index_room(room)
+            room_ids.append(room["Room ID"])
+
+    session_tokens = []
+    for _ in range(threads):
+        org_id = str(uuid.uuid4())
+        add_organization({
+            "Organization ID": org_id, "Name": f"bench-{org_id}",
+            "Contact Information": {}, "Address": {}, "Users": []
+        })
+        user = {
+            "User ID": str(uuid.uuid4()), "Organization ID": org_id, "User Name": f"bench-{org_id}",
+            "Email": "", "Role": "user", "Permissions": ["book"], "Password": "", "Bookings": []
+        }
+        add_user(user)
+        session_tokens.append(create_session(user))
+    return room_ids, session_tokens
+
+
+# Function to check that no two bookings of a room overlap on any date
+def count_double_bookings(room_ids):
+    room_ids = set(room_ids)
+    double_bookings = 0
+    for (room_id, _), intervals in list(room_availability.items()):
+        if room_id not in room_ids:
+            continue
+        for previous, current in zip(intervals, intervals[1:]):
+            if current[0] < previous[1]:
+                double_bookings += 1
+    return double_bookings
+
+
+# Multithreaded stress benchmark: every thread books random one hour slots on a shared pool of rooms
+def run_lock_stress_benchmark(threads=8, floors=4, rooms_per_floor=25, bookings_per_thread=1000,
+                              stripes=ROOM_LOCK_STRIPES, seed=0):
+    random.seed(seed)
+    configure_room_locks(stripes)
+    room_ids, session_tokens = create_stress_fixture(floors, rooms_per_floor, threads)
+    results = [dict() for _ in range(threads)]
+    start_barrier = threading.Barrier(threads + 1)
+
+    def worker(thread_index):
+        rng = random.Random(seed + thread_index)
+        # Spread every thread's bookings evenly over the months so the quota never gets in the way
+        attempts = []
+        for attempt in range(bookings_per_thread):
+            month = attempt % BENCHMARK_MONTHS
+            date = f"{2030 + month // 12}-{month % 12 + 1:02d}-{rng.randint(1, 28):02d}"
+            attempts.append((rng.choice(room_ids), rng.randrange(23), date))
+        outcome = results[thread_index]
+        start_barrier.wait()
+        for room_id, start_hour, date in attempts:
+            response = book_room(session_tokens[thread_index], room_id, start_hour, start_hour + 1, date)
+            outcome[response] = outcome.get(response, 0) + 1
+
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    for thread in workers:
+        thread.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    configure_room_locks(ROOM_LOCK_STRIPES)
+    responses = {}
+    for outcome in results:
+        for response, count in outcome.items():
+            responses[response] = responses.get(response, 0) + count
+    return {
+        "threads": threads,
+        "stripes": stripes,
+        "attempts": threads * bookings_per_thread,
+        "seconds": elapsed,
+        "throughput": threads * bookings_per_thread / elapsed,
+        "responses": responses,
+        "double_bookings": count_double_bookings(room_ids),
+    }
+
+
+# Benchmark booking weekly series one book_room call at a time against book_rooms_batch
+def run_batch_benchmark(series=50, weeks=52, seed=0):
+    random.seed(seed)
+    # Every series gets its own room and organization so the monthly quota is never reached
+    room_ids, session_tokens = create_stress_fixture(1, series * 2, series * 2)
+    timings = {}
+    confirmed = {}
+    for mode, offset in (("individual", 0), ("batch", series)):
+        started = time.perf_counter()
+        responses = []
+        for room_id, session_token in zip(room_ids[offset:offset + series], session_tokens[offset:offset + series]):
+            requests = [
+                {"room_id": room_id, "start_hour": 10, "end_hour": 11,
+                 "date": (date(2030, 1, 1) + timedelta(weeks=week)).isoformat()}
+                for week in range(weeks)
+            ]
+            if mode == "batch":
+                responses.extend(result["Status"] for result in book_rooms_batch(session_token, requests))
+            else:
+                responses.extend(book_room(session_token, **request) for request in requests)
+        timings[mode] = time.perf_counter() - started
+        confirmed[mode] = responses.count("Booking confirmed.")
+    return {"series": series, "weeks": weeks, "seconds": timings, "confirmed": confirmed,
+            "speedup": timings["individual"] / timings["batch"]}
+
+
+# Function to create a synthetic building, organizations and users with a booking history
+# Every user gets the password BENCHMARK_PASSWORD and a session, the first user of every organization is an admin
+def create_benchmark_fixture(floors=10, rooms_per_floor=50, organizations=20, users_per_organization=10,
+                             history_per_user=20, seed=0):
+    rng = random.Random(seed)
+    room_ids = []
+    for floor_number in range(floors):
+        floor = {"Floor ID": str(uuid.uuid4()), "Floor Number": f"bench-{uuid.uuid4()}", "Room IDs": []}
+        add_floor(floor)
+        for room_number in range(rooms_per_floor):
+            amenities = rng.sample(BENCHMARK_AMENITIES, rng.randint(1, len(BENCHMARK_AMENITIES)))
+            room = {
+                "Room ID": str(uuid.uuid4()),
+                "Room Name": f"bench-{floor_number}-{room_number}-{uuid.uuid4()}",
+                "Floor ID": floor["Floor ID"],
+                "Capacity": rng.randint(2, 20),
+                "Additional Details": {},
+                "Room Settings": ", ".join(amenities)
+            }
+            add_room(floor, room)
+            index_room(room)
+            room_ids.append(room["Room ID"])
+
+    # Hashing is slow on purpose, every user shares one hash of the same password
+    password_hash = hash_password(BENCHMARK_PASSWORD)
+    benchmark_users = []
+    session_tokens = []
+    for _ in range(organizations):
+        org_id = str(uuid.uuid4())
+        add_organization({
+            "Organization ID": org_id, "Name": f"bench-{org_id}",
+            "Contact Information": {}, "Address": {}, "Users": []
+        })
+        for user_number in range(users_per_organization):
+            user = {
+                "User ID": str(uuid.uuid4()), "Organization ID": org_id, "User Name": f"bench-{uuid.uuid4()}",
+                "Email": "", "Role": "admin" if user_number == 0 else "user", "Permissions": ["book"],
+                "Password": password_hash, "Bookings": []
+            }
+            add_user(user)
+            benchmark_users.append(user)
+            session_tokens.append(create_session(user))
+
+    for session_token in session_tokens:
+        for _ in range(history_per_user):
+            start_hour, booking_date = random_benchmark_slot(rng)
+            book_room(session_token, rng.choice(room_ids), start_hour, start_hour + 1, booking_date)
+    return {"room_ids": room_ids, "users": benchmark_users, "session_tokens": session_tokens}
+
+
+# Function to pick a random one hour slot during office hours within the benchmark months
+def random_benchmark_slot(rng):
+    booking_date = BENCHMARK_START_DATE + timedelta(days=rng.randrange(BENCHMARK_MONTHS * 30))
+    return rng.randrange(8, 18), booking_date.isoformat()
+
+
+# Each operation takes the fixture, the index of the user to act as and a random generator,
+# and returns a label counted in the results, e.g. the response message
+def benchmark_book_room(fixture, user_index, rng):
+    start_hour, booking_date = random_benchmark_slot(rng)
+    return book_room(fixture["session_tokens"][user_index], rng.choice(fixture["room_ids"]), start_hour,
+                     start_hour + 1, booking_date)
+
+
+def benchmark_cancel_booking(fixture, user_index, rng):
+    bookings = fixture["users"][user_index]["Bookings"]
+    if not bookings:
+        return "No booking left to cancel."
+    return cancel_booking(fixture["session_tokens"][user_index], bookings[-1]["Booking ID"])
+
+
+def benchmark_search_suitable_rooms(fixture, user_index, rng):
+    start_hour, booking_date = random_benchmark_slot(rng)
+    amenities = rng.sample(BENCHMARK_AMENITIES, rng.randint(0, 2))
+    response = search_suitable_rooms(fixture["session_tokens"][user_index], rng.randint(2, 12), start_hour,
+                                     start_hour + 1, booking_date, amenities)
+    return response if isinstance(response, str) else "ok"
+
+
+def benchmark_list_organization_bookings(fixture, user_index, rng):
+    start_date = BENCHMARK_START_DATE + timedelta(days=rng.randrange(BENCHMARK_MONTHS * 30))
+    response = list_organization_bookings_in_date_range(
+        fixture["session_tokens"][user_index], start_date.isoformat(), (start_date + timedelta(days=30)).isoformat()
+    )
+    return response if isinstance(response, str) else "ok"
+
+
+def benchmark_view_user_bookings(fixture, user_index, rng):
+    response = view_user_bookings(fixture["session_tokens"][user_index])
+    return response if isinstance(response, str) else "ok"
+
+
+def benchmark_login(fixture, user_index, rng):
+    session_token = authenticate(fixture["users"][user_index]["User Name"], BENCHMARK_PASSWORD)
+    return "ok" if session_token else "rejected"
+
+
+benchmark_operations = {
+    "book_room": benchmark_book_room,
+    "cancel_booking": benchmark_cancel_booking,
+    "search_suitable_rooms": benchmark_search_suitable_rooms,
+    "list_organization_bookings_in_date_range": benchmark_list_organization_bookings,
+    "view_user_bookings": benchmark_view_user_bookings,
+    "login": benchmark_login,
+}
+
+
+# Function to get a percentile of a sorted list of values
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+# Function to call one operation from several threads at once and measure its throughput and latency
+# Every thread acts as a different user, exceptions are counted as outcomes instead of stopping the run
+def measure_operation(fixture, operation, threads=1, calls_per_thread=1000, seed=0):
+    function = benchmark_operations[operation]
+    latencies = [[] for _ in range(threads)]
+    outcomes = [dict() for _ in range(threads)]
+    start_barrier = threading.Barrier(threads + 1)
+
+    def worker(thread_index):
+        rng = random.Random(seed + thread_index)
+        user_index = thread_index % len(fixture["users"])
+        thread_latencies = latencies[thread_index]
+        thread_outcomes = outcomes[thread_index]
+        start_barrier.wait()
+        for _ in range(calls_per_thread):
+            started = time.perf_counter()
+            try:
+                outcome = function(fixture, user_index, rng)
+            except Exception as e:
+                outcome = f"error: {type(e).__name__}"
+            thread_latencies.append(time.perf_counter() - started)
+            thread_outcomes[outcome] = thread_outcomes.get(outcome, 0) + 1
+
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    for thread in workers:
+        thread.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    all_latencies = sorted(latency for thread_latencies in latencies for latency in thread_latencies)
+    merged_outcomes = {}
+    for thread_outcomes in outcomes:
+        for outcome, count in thread_outcomes.items():
+            merged_outcomes[outcome] = merged_outcomes.get(outcome, 0) + count
+    return {
+        "operation": operation,
+        "threads": threads,
+        "calls": len(all_latencies),
+        "seconds": elapsed,
+        "throughput": len(all_latencies) / elapsed,
+        "p50_ms": percentile(all_latencies, 0.50) * 1000,
+        "p99_ms": percentile(all_latencies, 0.99) * 1000,
+        "outcomes": merged_outcomes,
+    }
+
+
+# Benchmark every core operation, single threaded and with each of the thread counts
+# Logins are far slower than the rest on purpose, so they get their own, smaller, number of calls
+def run_operation_benchmarks(thread_counts=(1, 8), calls_per_thread=1000, login_calls_per_thread=10,
+                             operations=OPERATIONS, seed=0, **fixture_options):
+    fixture = create_benchmark_fixture(seed=seed, **fixture_options)
+    results = []
+    for threads in thread_counts:
+        for operation in operations:
+            calls = login_calls_per_thread if operation == "login" else calls_per_thread
+            results.append(measure_operation(fixture, operation, threads, calls, seed))
+    return results
+
+
+# Benchmark booking and searching in one process (0 shards) and split across each number of shards
+# Besides the measured throughput and latency, the CPU time used per call by this process (the router, which
+# also runs the benchmark's threads) and by the busiest shard is recorded. Everything but the availability and
+# the room search stays in the router and runs under its GIL, so whatever the number of cores, throughput can
+# never pass router_bound_throughput: one call per router CPU time per call.
+def run_shard_benchmarks(shard_counts=(0, 2, 4), threads=8, calls_per_thread=1000,
+                         operations=("book_room", "search_suitable_rooms"), seed=0, **fixture_options):
+    fixture = create_benchmark_fixture(seed=seed, **fixture_options)
+    # The shards are forked with no other thread running, the password pool has one
+    shutdown_password_executor()
+    results = []
+    for shard_count in shard_counts:
+        start_shards(shard_count)
+        try:
+            for operation in operations:
+                router_cpu, shard_cpu = time.process_time(), get_shard_cpu_times()
+                result = measure_operation(fixture, operation, threads, calls_per_thread, seed)
+                router_cpu = time.process_time() - router_cpu
+                busiest_shard_cpu = max(
+                    (after - before for before, after in zip(shard_cpu, get_shard_cpu_times())), default=0
+                )
+                result.update({
+                    "shards": shard_count,
+                    "router_cpu_ms": router_cpu / result["calls"] * 1000,
+                    "busiest_shard_cpu_ms": busiest_shard_cpu / result["calls"] * 1000,
+                    "router_bound_throughput": result["calls"] / router_cpu,
+                })
+                results.append(result)
+        finally:
+            stop_shards()
+    return results
+
+
+# Function to measure the memory held by bookings stored as dicts, the way book_room built them
+# before, against the same bookings stored as Booking records. Only the records themselves are counted.
+def run_record_memory_benchmark(bookings=100000, rooms=500, users=1000, seed=0):
+    rng = random.Random(seed)
+    room_ids = [str(uuid.uuid4()) for _ in range(rooms)]
+    user_ids = [str(uuid.uuid4()) for _ in range(users)]
+
+    def booking_dicts():
+        for _ in range(bookings):
+            start_hour, booking_date = random_benchmark_slot(rng)
+            # Every booking gets its own strings, as it does when built from a request
+            yield {
+                "Booking ID": str(uuid.uuid4()),
+                "User ID": "".join(rng.choice(user_ids)),
+                "Date": date.fromisoformat(booking_date).isoformat(),
+                "Room ID": "".join(rng.choice(room_ids)),
+                "Start Hour": start_hour,
+                "End Hour": start_hour + 1
+            }
+
+    sizes = {}
+    for mode in ("dict", "record"):
+        tracemalloc.start()
+        stored = [booking if mode == "dict" else as_booking(booking) for booking in booking_dicts()]
+        sizes[mode] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del stored
+    return {
+        "bookings": bookings,
+        "bytes_per_booking": {mode: size / bookings for mode, size in sizes.items()},
+        "reduction": sizes["dict"] / sizes["record"],
+    }
+
+
+# Function to measure the memory a confirmed booking takes in the whole application: the memory still
+# allocated after `bookings` book_room calls, divided by the bookings confirmed. It counts the record and every
+# index kept for it: the repository's booking, organization and user indexes, availability, usage counters,
+# the search bitmaps and the analytics table.
+def run_booked_memory_benchmark(bookings=20000, floors=4, rooms_per_floor=25, organizations=200, seed=0):
+    rng = random.Random(seed)
+    # One user per organization, spread enough that the monthly limit turns no booking away
+    room_ids, session_tokens = create_stress_fixture(floors, rooms_per_floor, organizations)
+    gc.collect()
+    tracemalloc.start()
+    confirmed = 0
+    for _ in range(bookings):
+        start_hour, booking_date = random_benchmark_slot(rng)
+        response = book_room(rng.choice(session_tokens), rng.choice(room_ids), start_hour, start_hour + 1,
+                             booking_date)
+        confirmed += response == "Booking confirmed."
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return {"bookings": confirmed, "bytes_per_booking": size / confirmed}
+
+
+# Function to measure the memory of bookings, the records alone and with every index of the application
+def run_memory_benchmark(seed=0):
+    return {"records": run_record_memory_benchmark(seed=seed), "booked": run_booked_memory_benchmark(seed=seed)}
+
+
+# Script run in a fresh interpreter by the startup benchmark, prints its timings as JSON
+STARTUP_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import run
+imported = time.perf_counter()
+from journal import close_journal, open_journal
+open_journal(sys.argv[1])
+recovered = time.perf_counter()
+close_journal()
+print(json.dumps({"import_seconds": imported - started, "recover_seconds": recovered - imported,
+                  "seconds": recovered - started}))
+"""
+
+
+# Function to measure a cold start: a new process importing the application and recovering a snapshot of
+# `bookings` bookings, the way run.py starts, against STARTUP_BUDGET_SECONDS
+def run_startup_benchmark(bookings=100000, rooms=500, users=1000, budget=STARTUP_BUDGET_SECONDS, seed=0):
+    rng = random.Random(seed)
+    floor = {"Floor ID": str(uuid.uuid4()), "Floor Number": 1, "Room IDs": []}
+    room_records = []
+    for room_number in range(rooms):
+        room_records.append({
+            "Room ID": str(uuid.uuid4()),
+            "Room Name": f"Room {room_number}",
+            "Floor ID": floor["Floor ID"],
+            "Capacity": rng.randint(2, 20),
+            "Additional Details": {},
+            "Room Settings": ", ".join(rng.sample(BENCHMARK_AMENITIES, rng.randint(1, len(BENCHMARK_AMENITIES))))
+        })
+        floor["Room IDs"].append(room_records[-1]["Room ID"])
+    organization = {"Organization ID": str(uuid.uuid4()), "Name": "Startup Benchmark", "Contact Information": {},
+                    "Address": {}, "Users": []}
+    user_records = []
+    for user_number in range(users):
+        user_records.append({
+            "User ID": str(uuid.uuid4()),
+            "Organization ID": organization["Organization ID"],
+            "User Name": f"startup-user-{user_number}",
+            "Email": "",
+            "Role": "user",
+            "Permissions": ["book"],
+            "Password": "",
+            "Bookings": []
+        })
+        organization["Users"].append(user_records[-1]["User ID"])
+    for _ in range(bookings):
+        user = rng.choice(user_records)
+        start_hour, booking_date = random_benchmark_slot(rng)
+        user["Bookings"].append(as_booking({
+            "Booking ID": str(uuid.uuid4()),
+            "User ID": user["User ID"],
+            "Date": booking_date,
+            "Room ID": rng.choice(room_records)["Room ID"],
+            "Start Hour": start_hour,
+            "End Hour": start_hour + 1
+        }))
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Same format as journal.write_snapshot
+        with open(os.path.join(directory, SNAPSHOT_FILE_NAME), "wb") as snapshot_file:
+            pickle.dump({
+                "organizations": [organization],
+                "users": user_records,
+                "floors": [floor],
+                "rooms": room_records,
+                "booking_series": [],
+            }, snapshot_file, protocol=5)
+        output = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT, directory], cwd=os.path.dirname(os.path.abspath(__file__)),
+            check=True, capture_output=True, text=True
+        ).stdout
+    result = json.loads(output.splitlines()[-1])
+    result.update({"bookings": bookings, "budget_seconds": budget, "within_budget": result["seconds"] <= budget})
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Conference room booking benchmarks")
+    parser.add_argument("--suite", choices=["operations", "locks", "batch", "memory", "shards", "startup", "all"],
+                        default="all")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--metrics", action="store_true", help="record metrics during the run and add them to the output")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--floors", type=int, default=4)
+    parser.add_argument("--rooms-per-floor", type=int, default=25)
+    parser.add_argument("--bookings-per-thread", type=int, default=1000)
+    parser.add_argument("--operation-threads", default="1,8", help="comma separated thread counts")
+    parser.add_argument("--operations", default=",".join(OPERATIONS), help="comma separated operations")
+    parser.add_argument("--calls-per-thread", type=int, default=1000)
+    parser.add_argument("--login-calls-per-thread", type=int, default=10)
+    parser.add_argument("--organizations", type=int, default=20)
+    parser.add_argument("--users-per-organization", type=int, default=10)
+    parser.add_argument("--history-per-user", type=int, default=20)
+    parser.add_argument("--shard-counts", default="0,2,4", help="comma separated numbers of shards, 0 for none")
+    parser.add_argument("--startup-bookings", type=int, default=100000)
+    args = parser.parse_args()
+    results = {}
+    if args.metrics:
+        enable_metrics()
+
+    if args.suite in ("operations", "all"):
+        results["operations"] = run_operation_benchmarks(
+            thread_counts=[int(threads) for threads in args.operation_threads.split(",")],
+            calls_per_thread=args.calls_per_thread, login_calls_per_thread=args.login_calls_per_thread,
+            operations=args.operations.split(","), seed=args.seed, floors=args.floors,
+            rooms_per_floor=args.rooms_per_floor, organizations=args.organizations,
+            users_per_organization=args.users_per_organization, history_per_user=args.history_per_user
+        )
+        for result in results["operations"]:
+            print(f"{result['operation']:<42} threads={result['threads']:<3} calls={result['calls']:<6} "
+                  f"throughput={result['throughput']:.0f}/s p50={result['p50_ms']:.3f}ms "
+                  f"p99={result['p99_ms']:.3f}ms outcomes={result['outcomes']}")
+
+    if args.suite in ("locks", "all"):
+        results["locks"] = []
+        # A single stripe is equivalent to the old building-wide lock
+        for stripes in (1, ROOM_LOCK_STRIPES):
+            result = run_lock_stress_benchmark(
+                threads=args.threads, floors=args.floors, rooms_per_floor=args.rooms_per_floor,
+                bookings_per_thread=args.bookings_per_thread, stripes=stripes, seed=args.seed
+            )
+            results["locks"].append(result)
+            print(f"stripes={result['stripes']:<4} attempts={result['attempts']} "
+                  f"throughput={result['throughput']:.0f}/s double_bookings={result['double_bookings']} "
+                  f"responses={result['responses']}")
+            if result["double_bookings"]:
+                raise SystemExit("Double booking detected.")
+
+    if args.suite in ("batch", "all"):
+        result = results["batch"] = run_batch_benchmark(seed=args.seed)
+        print(f"batch series={result['series']} weeks={result['weeks']} "
+              f"individual={result['seconds']['individual']:.3f}s batch={result['seconds']['batch']:.3f}s "
+              f"speedup={result['speedup']:.1f}x confirmed={result['confirmed']}")
+
+    if args.suite in ("memory", "all"):
+        result = results["memory"] = run_memory_benchmark(seed=args.seed)
+        records, booked = result["records"], result["booked"]
+        print(f"memory records only: bookings={records['bookings']} dict={records['bytes_per_booking']['dict']:.0f}B "
+              f"record={records['bytes_per_booking']['record']:.0f}B reduction={records['reduction']:.1f}x")
+        print(f"memory with every index: bookings={booked['bookings']} "
+              f"per_booking={booked['bytes_per_booking']:.0f}B")
+
+    if args.suite in ("shards", "all"):
+        results["shards"] = run_shard_benchmarks(
+            shard_counts=[int(shards) for shards in args.shard_counts.split(",")], threads=args.threads,
+            calls_per_thread=args.calls_per_thread, seed=args.seed, floors=args.floors,
+            rooms_per_floor=args.rooms_per_floor, organizations=args.organizations,
+            users_per_organization=args.users_per_organization, history_per_user=args.history_per_user
+        )
+        for result in results["shards"]:
+            print(f"shards={result['shards']:<3} {result['operation']:<24} threads={result['threads']:<3} "
+                  f"throughput={result['throughput']:.0f}/s p50={result['p50_ms']:.3f}ms "
+                  f"p99={result['p99_ms']:.3f}ms router_cpu={result['router_cpu_ms']:.3f}ms "
+                  f"shard_cpu={result['busiest_shard_cpu_ms']:.3f}ms "
+                  f"router_bound_throughput={result['router_bound_throughput']:.0f}/s")
+
+    if args.suite in ("startup", "all"):
+        result = results["startup"] = run_startup_benchmark(bookings=args.startup_bookings, seed=args.seed)
+        print(f"startup bookings={result['bookings']} import={result['import_seconds']:.3f}s "
+              f"recover={result['recover_seconds']:.3f}s total={result['seconds']:.3f}s "
+              f"budget={result['budget_seconds']:.1f}s")
+        if not result["within_budget"]:
+            raise SystemExit("Startup over budget.")
+
+    if args.metrics:
+        results["metrics"] = get_metrics()
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "arguments": vars(args),
+                "results": results,
+            }, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
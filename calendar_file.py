@@ -0,0 +1,251 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import date as calendar_date
+
+from constants import AVAILABILITY_CALENDAR_DAYS
+from repository import add_mutation_listener, remove_mutation_listener
+
+# Memory-mapped availability calendar: the booked minutes of every room on every day of a fixed horizon,
+# kept in a file instead of one Python int per (room, date). Bit m of a day is minute m, the same layout as
+# the busy bitmaps of availability.py written with to_bytes(BYTES_PER_DAY, "little").
+# Layout of the file:
+#   - a header of HEADER_SIZE bytes: magic, version, first day (date ordinal), number of days, number of rooms,
+#     generation, and a flag set once the file has been replaced by a newer calendar
+#   - one block of days * BYTES_PER_DAY bytes per room index, in the order the rooms were added
+# The file at `path` + ROOM_IDS_SUFFIX holds the generation on its first line, then the Room ID of every room
+# index, one per line, written before the header counts the room, so other processes can open the calendar
+# read-only and map Room IDs themselves.
+# The file is grown ROOM_GROWTH rooms at a time and stays sparse until bits are set. It is never truncated:
+# a restarted writer builds a new calendar under another name, moves it over `path` and then flags the old
+# one as replaced, so read-only processes keep a valid map and open the new calendar when they see the flag.
+MAGIC = b"RCAL"
+VERSION = 2
+HEADER = struct.Struct("<4sIIIIQB")
+HEADER_SIZE = 64
+REPLACED_OFFSET = HEADER.size - 1
+BYTES_PER_DAY = 24 * 60 // 8
+ROOM_IDS_SUFFIX = ".rooms"
+ROOM_GROWTH = 64
+
+calendar_state = {
+    "path": None,
+    "file": None,
+    "map": None,
+    "read_only": False,
+    "first_day": 0,
+    "days": 0,
+    "generation": 0,
+    "room_indexes": {},
+    "room_ids_file": None,
+}
+# Guards growing and mapping the file again, bits are set under the rooms' locks like the rest of availability
+calendar_lock = threading.Lock()
+
+
+def _block_size():
+    return calendar_state["days"] * BYTES_PER_DAY
+
+
+def _room_capacity(calendar_map):
+    return (len(calendar_map) - HEADER_SIZE) // _block_size()
+
+
+# Mutation listener: every added room gets its block of the file
+def record_mutation(operation, record):
+    if operation == "add_room":
+        get_room_index(record["Room ID"], create=True)
+
+
+def _write_header(calendar_map, room_count, replaced=False):
+    HEADER.pack_into(calendar_map, 0, MAGIC, VERSION, calendar_state["first_day"], calendar_state["days"],
+                     room_count, calendar_state["generation"], replaced)
+
+
+# Function to map the calendar at `path` read-only, with no room known yet
+def _map_read_only(path):
+    calendar_file = open(path, "rb")
+    magic, version, first_ordinal, days, _, generation, _ = HEADER.unpack_from(calendar_file.read(HEADER.size))
+    if magic != MAGIC or version != VERSION:
+        calendar_file.close()
+        raise ValueError(f"{path} is not an availability calendar.")
+    calendar_state.update({
+        "path": path,
+        "file": calendar_file,
+        "map": mmap.mmap(calendar_file.fileno(), 0, access=mmap.ACCESS_READ),
+        "read_only": True,
+        "first_day": first_ordinal,
+        "days": days,
+        "generation": generation,
+        "room_indexes": {},
+    })
+
+
+# Function to open the calendar at `path`. The process writing it starts a new, empty calendar of `days` days
+# from first_day (today by default); read-only processes map the calendar another process is writing.
+def open_availability_calendar(path, days=AVAILABILITY_CALENDAR_DAYS, first_day=None, read_only=False):
+    close_availability_calendar()
+    if read_only:
+        _map_read_only(path)
+        return
+    calendar_state.update({
+        "path": path,
+        "read_only": False,
+        "first_day": (first_day or calendar_date.today()).toordinal(),
+        "days": days,
+        "generation": time.time_ns(),
+        "room_indexes": {},
+    })
+    with open(path + ROOM_IDS_SUFFIX + ".tmp", "w") as room_ids_file:
+        room_ids_file.write(f"{calendar_state['generation']}\n")
+    calendar_file = open(path + ".tmp", "w+b")
+    calendar_file.truncate(HEADER_SIZE + ROOM_GROWTH * days * BYTES_PER_DAY)
+    calendar_map = mmap.mmap(calendar_file.fileno(), 0)
+    _write_header(calendar_map, 0)
+
+    # The calendar being replaced stays mapped by the readers, it is flagged once the new one is in place
+    try:
+        replaced_file = open(path, "r+b")
+    except FileNotFoundError:
+        replaced_file = None
+    os.replace(path + ROOM_IDS_SUFFIX + ".tmp", path + ROOM_IDS_SUFFIX)
+    os.replace(path + ".tmp", path)
+    if replaced_file:
+        with replaced_file:
+            if replaced_file.read(4) == MAGIC:
+                replaced_file.seek(REPLACED_OFFSET)
+                replaced_file.write(b"\x01")
+
+    calendar_state.update({
+        "file": calendar_file,
+        "map": calendar_map,
+        "room_ids_file": open(path + ROOM_IDS_SUFFIX, "a"),
+    })
+    add_mutation_listener(record_mutation)
+
+
+# Function to close the calendar, availability falls back to keeping every date in memory
+def close_availability_calendar():
+    with calendar_lock:
+        if calendar_state["file"] is None:
+            return
+        if not calendar_state["read_only"]:
+            remove_mutation_listener(record_mutation)
+            calendar_state["map"].flush()
+            calendar_state["room_ids_file"].close()
+        # The map is not closed here: a thread may still be reading it, it is freed with its last reference
+        calendar_state["file"].close()
+        calendar_state.update({"path": None, "file": None, "map": None, "room_ids_file": None, "room_indexes": {}})
+
+
+# Function to map the file again once it has grown past the current map
+def _remap():
+    calendar_map = calendar_state["map"]
+    if os.fstat(calendar_state["file"].fileno()).st_size > len(calendar_map):
+        access = mmap.ACCESS_READ if calendar_state["read_only"] else mmap.ACCESS_WRITE
+        calendar_state["map"] = mmap.mmap(calendar_state["file"].fileno(), 0, access=access)
+
+
+# Function to open the calendar again in a read-only process once the writer has replaced it
+def _reopen_if_replaced():
+    if not calendar_state["map"][REPLACED_OFFSET]:
+        return
+    with calendar_lock:
+        if calendar_state["file"] is not None and calendar_state["map"][REPLACED_OFFSET]:
+            calendar_state["file"].close()
+            _map_read_only(calendar_state["path"])
+
+
+# Function to read the Room IDs another process added since the last look, in a read-only calendar
+def _load_room_ids():
+    room_indexes = calendar_state["room_indexes"]
+    room_count = HEADER.unpack_from(calendar_state["map"], 0)[4]
+    if room_count <= len(room_indexes):
+        return
+    with open(calendar_state["path"] + ROOM_IDS_SUFFIX) as room_ids_file:
+        # The Room IDs of a newer calendar, this one is about to be flagged as replaced
+        if room_ids_file.readline().rstrip("\n") != str(calendar_state["generation"]):
+            return
+        for index, line in enumerate(room_ids_file):
+            if index >= room_count:
+                break
+            room_indexes.setdefault(line.rstrip("\n"), index)
+    _remap()
+
+
+# Function to get the index of a room's block, None when the room has none
+# With `create`, a room without a block gets the next one, growing the file when it is full
+def get_room_index(room_id, create=False):
+    index = calendar_state["room_indexes"].get(room_id)
+    if index is not None or calendar_state["file"] is None or (not create and not calendar_state["read_only"]):
+        return index
+    with calendar_lock:
+        if calendar_state["file"] is None:
+            return None
+        room_indexes = calendar_state["room_indexes"]
+        if calendar_state["read_only"]:
+            _load_room_ids()
+            return room_indexes.get(room_id)
+        if room_id in room_indexes:
+            return room_indexes[room_id]
+        index = len(room_indexes)
+        if index >= _room_capacity(calendar_state["map"]):
+            calendar_state["file"].truncate(HEADER_SIZE + (index + ROOM_GROWTH) * _block_size())
+            _remap()
+        calendar_state["room_ids_file"].write(room_id + "\n")
+        calendar_state["room_ids_file"].flush()
+        room_indexes[room_id] = index
+        _write_header(calendar_state["map"], len(room_indexes))
+        return index
+
+
+# Function to get the map holding a room's date and the offset of that day in it
+# Returns (None, None) when the calendar is closed, the date is outside its horizon or the room has no block
+def get_day_location(room_id, date, create=False):
+    if calendar_state["file"] is None:
+        return None, None
+    if calendar_state["read_only"]:
+        _reopen_if_replaced()
+    day = date.toordinal() - calendar_state["first_day"]
+    if not 0 <= day < calendar_state["days"]:
+        return None, None
+    index = get_room_index(room_id, create)
+    if index is None:
+        return None, None
+    calendar_map = calendar_state["map"]
+    if HEADER_SIZE + (index + 1) * _block_size() > len(calendar_map):
+        with calendar_lock:
+            _remap()
+        calendar_map = calendar_state["map"]
+    return calendar_map, HEADER_SIZE + index * _block_size() + day * BYTES_PER_DAY
+
+
+# Function to read the busy bitmap of a day
+def read_day(calendar_map, offset):
+    return int.from_bytes(calendar_map[offset:offset + BYTES_PER_DAY], "little")
+
+
+# Function to overwrite the busy bitmap of a day
+def write_day(calendar_map, offset, busy_bitmap):
+    calendar_map[offset:offset + BYTES_PER_DAY] = busy_bitmap.to_bytes(BYTES_PER_DAY, "little")
+
+
+# Function to check if any minute between start_minute and end_minute of a day is busy
+# Only the bytes holding those minutes are read
+def has_busy_minute(calendar_map, offset, start_minute, end_minute):
+    first_byte, last_byte = start_minute // 8, (end_minute - 1) // 8 + 1
+    busy = int.from_bytes(calendar_map[offset + first_byte:offset + last_byte], "little")
+    return bool(busy >> (start_minute - first_byte * 8) & ((1 << (end_minute - start_minute)) - 1))
+
+
+# Function to set (busy=True) or clear the minutes between start_minute and end_minute of a day
+# Only the bytes holding those minutes are rewritten
+def set_minutes(calendar_map, offset, start_minute, end_minute, busy=True):
+    first_byte, last_byte = start_minute // 8, (end_minute - 1) // 8 + 1
+    span = slice(offset + first_byte, offset + last_byte)
+    mask = ((1 << (end_minute - start_minute)) - 1) << (start_minute - first_byte * 8)
+    bits = int.from_bytes(calendar_map[span], "little")
+    bits = bits | mask if busy else bits & ~mask
+    calendar_map[span] = bits.to_bytes(last_byte - first_byte, "little")
@@ -1,14 +1,36 @@
-import threading
+import heapq
+import itertools
 import uuid
-from datetime import datetime as dt
-
-from data_structures import building, global_room_settings, organizations, users
+from datetime import date, datetime as dt, timedelta
+
+from analytics import get_floor_utilization, get_organization_monthly_hours, get_peak_hours, get_top_organizations
+from availability import has_recurring_conflict, has_series_conflict, hour_to_minute, release_slots, reserve_slots
+from constants import MONTHLY_BOOKING_LIMIT, RECURRING_QUOTA_HORIZON_MONTHS
+from data_structures import global_room_settings
+from free_slots import find_free_rooms
+from locks import get_room_lock
+from metrics import increment, observe_since, start_timer, timed
 from organizations import notify_admins_limit_approaching, notify_admins_limit_exceeding
+from recurrence import FREQUENCY_DAYS, iter_occurrences, occurrence_as_booking, occurs_on, series_hours_in_month
+from repository import (
+    add_booking, add_floor as add_floor_record, add_room as add_room_record, add_series, get_booking, get_floor,
+    get_floor_by_number, get_organization, get_organization_bookings, get_organization_series, get_room,
+    get_room_by_name, get_series, get_user, iter_organization_bookings, iter_user_bookings, remove_booking, remove_series, update_series
+)
+from records import minute_timestamp
+from room_search import find_room_rows, index_room
+from scheduler import suggest_alternatives
+from usage import get_monthly_usage, get_usage_lock, remove_usage, try_reserve_usage, try_reserve_usage_batch
 from utilities import get_admin_emails
-from validations import is_admin, is_logged_in, is_organization_registered
+from validations import is_logged_in, is_session_admin, session_has_permission
 
-# Create a lock for concurrent access to the 'building' data structure
-building_lock = threading.Lock()
+# The steps of a booking that read or change the availability of rooms. The sharded engine (sharding.py)
+# replaces them with calls to the worker processes owning the rooms.
+room_engine = {
+    "reserve_slots": reserve_slots,
+    "release_slots": release_slots,
+    "find_room_rows": find_room_rows,
+}
 
 
 # Function to add a new floor with admin and logged-in user checks
@@ -17,14 +39,13 @@ def add_floor(session_token, floor_number):
     user = is_logged_in(session_token)
     if not user:
         return "User is not logged in."
-    user_id = user['User ID']
-    if not is_admin(user_id):
+    if not is_session_admin(session_token):
         return "Permission denied. You are not an admin."
 
     floor_id = str(uuid.uuid4())
 
     # Check if the floor number is already taken
-    if any(floor["Floor Number"] == floor_number for floor in building["Floors"]):
+    if get_floor_by_number(floor_number):
         return "Floor number already exists."
 
     # Create a new floor
@@ -34,7 +55,7 @@ def add_floor(session_token, floor_number):
         "Room IDs": []
     }
 
-    building["Floors"].append(new_floor)
+    add_floor_record(new_floor)
 
     return f"Floor '{floor_number}' added with Floor ID: {floor_id} successfully."
 
@@ -45,197 +66,427 @@ def add_room(session_token, floor_id, room_name, capacity, additional_details=No
     user = is_logged_in(session_token)
     if not user:
         return "User is not logged in."
-    user_id = user['User ID']
     # check if user is admin
-    if not is_admin(user_id):
+    if not is_session_admin(session_token):
         return "Permission denied. You are not an admin."
 
     # Check if the floor exists
-    floor = next((f for f in building["Floors"] if f["Floor ID"] == floor_id), None)
+    floor = get_floor(floor_id)
     if not floor:
         return "Floor not found."
 
+    # Check that the capacity is a whole number of seats, it may be typed in as text
+    try:
+        capacity = int(capacity)
+    except (TypeError, ValueError):
+        return "Invalid capacity."
+    if capacity < 1:
+        return "Invalid capacity."
+
     # Generate a unique room ID
     room_id = str(uuid.uuid4())
     # Check if the room name is already taken on this floor
-    if any(room["Room Name"] == room_name for room in building["Rooms"]):
+    if get_room_by_name(room_name):
         return "Room name already exists on this floor."
 
     # Create a new room
     new_room = {
         "Room ID": room_id,
         "Room Name": room_name,
+        "Floor ID": floor_id,
         "Capacity": capacity,
         "Additional Details": additional_details or {},
-        "Availability": [0] * 24,  # Initialize availability for all hours,
         "Room Settings": room_settings or global_room_settings
     }
 
-    building["Rooms"].append(new_room)
-    floor['Room IDs'].append(room_id)
+    add_room_record(floor, new_room)
+    index_room(new_room)
     return f"Room '{room_name}' added with Room ID: {room_id} to Floor with Floor ID: {floor_id} successfully."
 
 
 # 6. Book Room
+@timed("book_room_seconds")
 def book_room(session_token, room_id, start_hour, end_hour, date):
+    stage = start_timer()
     # Check if the user is logged in
     user = is_logged_in(session_token)
     if not user:
         return "User is not logged in."
+    stage = observe_since("book_room_session_check_seconds", stage)
 
     # Parse the date string into a datetime object
     date_obj = dt.strptime(date, "%Y-%m-%d")
-    room = None
-    for room in building['Rooms']:
-        if room['Room ID'] == room_id:
-            break
-
+    if not 0 <= start_hour < end_hour <= 24:
+        return "Invalid booking time."
+    start_minute = hour_to_minute(start_hour)
+    end_minute = hour_to_minute(end_hour)
+    room = get_room(room_id)
     if room is None:
         return "Room not found."
+    observe_since("book_room_room_lookup_seconds", stage)
+
+    # Check if the user has the necessary permissions
+    if not session_has_permission(session_token, "book"):
+        return "Permission denied. You do not have the necessary permissions."
+
+    booking_duration = end_hour - start_hour
+    organization = get_organization(user['Organization ID'])
+
+    # Generate a unique booking ID
+    booking_id = uuid.uuid4()
+    slot = (room_id, date_obj.date(), start_minute, end_minute, booking_id.int)
+    # Check if the room is available during the requested time slot and hold it; only this room is locked
+    # so bookings for other rooms can proceed in parallel
+    if room_engine["reserve_slots"]([slot]):
+        increment("conflicts")
+        return "Room is not available at the requested time."
+
+    # Reserve the hours against the organization's monthly counter, the slot is given back if over the limit
+    stage = start_timer()
+    organization_monthly_booked_hours = try_reserve_usage(
+        organization['Organization ID'], date_obj.year, date_obj.month, booking_duration, MONTHLY_BOOKING_LIMIT
+    )
+    observe_since("book_room_quota_seconds", stage)
+    if organization_monthly_booked_hours is None:
+        room_engine["release_slots"]([slot])
+        increment("quota_rejections")
+        return "Organization has exceeded the monthly booking limit."
+
+    # If all checks pass, add the booking
+    add_booking(user, {
+        "Booking ID": str(booking_id),
+        "User ID": user["User ID"],
+        "Date": date_obj.date().isoformat(),
+        "Room ID": room_id,
+        "Start Hour": start_hour,
+        "End Hour": end_hour
+    })
 
-    # Lock the 'building' data structure to prevent concurrent access
-    with building_lock:
-        room_availability = room["Availability"]
-
-        # Check if the room is available during the requested time slot
-        for hour in range(start_hour, end_hour):
-            if room_availability[hour] != 0:
-                return "Room is not available at the requested time."
-
-        # Check if the user has the necessary permissions
-        if "book" not in user["Permissions"]:
-            return "Permission denied. You do not have the necessary permissions."
-
-        booking_duration = end_hour - start_hour
-
-        for org in organizations:
-            if org['Organization ID'] == user['Organization ID']:
-                organization = org
-                break
-        # Calculate the organization's total monthly booked hours
-        organization_monthly_booked_hours = sum(
-            booking["End Hour"] - booking["Start Hour"]
-            for user_id in organization.get("Users", [])
-            for user in users if user['User ID'] == user_id
-            for booking in user.get("Bookings", [])
-            if booking.get("Month") == date_obj.month
-        )
+    increment("confirmed")
+    stage = start_timer()
+    notify_monthly_limit(organization, organization_monthly_booked_hours, (date_obj.year, date_obj.month))
+    observe_since("book_room_notification_seconds", stage)
+    return "Booking confirmed."
 
-        # Calculate the remaining monthly limit for the organization
-        remaining_monthly_limit = 30 - organization_monthly_booked_hours
 
-        if booking_duration >= remaining_monthly_limit:
-            return "Organization has exceeded the monthly booking limit."
+# Function to notify the organization admins if a month is approaching/exceeding the limit
+def notify_monthly_limit(organization, organization_monthly_booked_hours, month):
+    # Calculate the remaining monthly limit for the organization
+    remaining_monthly_limit = MONTHLY_BOOKING_LIMIT - organization_monthly_booked_hours
 
-        # If all checks pass, update the room availability and add the booking
-        # Generate a unique booking ID
-        booking_id = str(uuid.uuid4())
-        for hour in range(start_hour, end_hour):
-            room_availability[hour] = 1
+    if remaining_monthly_limit <= 0:
+        admin_emails = get_admin_emails(organization['Name'])
+        notify_admins_limit_exceeding(
+            organization['Name'], admin_emails, organization_monthly_booked_hours
+        )
+    elif remaining_monthly_limit <= 10:
+        admin_emails = get_admin_emails(organization['Name'])
+        notify_admins_limit_approaching(
+            organization['Name'], admin_emails, organization_monthly_booked_hours, remaining_monthly_limit, month
+        )
 
-        user["Bookings"].append({
-            "Booking ID": booking_id,
-            "Date": date,
+
+# Function to book several rooms/slots at once, either every request is booked or none is
+# Each request is a dict with the book_room arguments: room_id, start_hour, end_hour and date
+@timed("book_rooms_batch_seconds")
+def book_rooms_batch(session_token, requests):
+    # Check the session and permissions once for the whole batch
+    user = is_logged_in(session_token)
+    if not user:
+        return "User is not logged in."
+    if not session_has_permission(session_token, "book"):
+        return "Permission denied. You do not have the necessary permissions."
+    organization = get_organization(user['Organization ID'])
+
+    results = [{"Status": None, "Booking ID": None} for _ in requests]
+    parsed_requests = []
+    for index, request in enumerate(requests):
+        start_hour, end_hour = request["start_hour"], request["end_hour"]
+        try:
+            date_obj = dt.strptime(request["date"], "%Y-%m-%d")
+        except ValueError:
+            results[index]["Status"] = "Invalid date."
+            continue
+        if not 0 <= start_hour < end_hour <= 24:
+            results[index]["Status"] = "Invalid booking time."
+        elif get_room(request["room_id"]) is None:
+            results[index]["Status"] = "Room not found."
+        else:
+            parsed_requests.append((
+                index, request["room_id"], date_obj, hour_to_minute(start_hour), hour_to_minute(end_hour),
+                start_hour, end_hour
+            ))
+
+    # Requests of the same batch must not overlap each other
+    parsed_requests.sort(key=lambda item: (item[1], item[2], item[3]))
+    for previous, current in zip(parsed_requests, parsed_requests[1:]):
+        if previous[1:3] == current[1:3] and current[3] < previous[4]:
+            results[current[0]]["Status"] = "Overlaps another request in the batch."
+
+    hours_by_month = {}
+    for _, _, date_obj, _, _, start_hour, end_hour in parsed_requests:
+        month = (date_obj.year, date_obj.month)
+        hours_by_month[month] = hours_by_month.get(month, 0) + end_hour - start_hour
+
+    # Hold every slot at once, the slots are only held if all of them are free
+    booking_ids = [uuid.uuid4() for _ in parsed_requests]
+    slots = [
+        (room_id, date_obj.date(), start_minute, end_minute, booking_id.int)
+        for (_, room_id, date_obj, start_minute, end_minute, _, _), booking_id in zip(parsed_requests, booking_ids)
+    ]
+    booked_hours_by_month = None
+    if all(result["Status"] is None for result in results):
+        for position in room_engine["reserve_slots"](slots):
+            results[parsed_requests[position][0]]["Status"] = "Room is not available at the requested time."
+            increment("conflicts")
+
+    if all(result["Status"] is None for result in results):
+        booked_hours_by_month = try_reserve_usage_batch(
+            organization['Organization ID'], hours_by_month, MONTHLY_BOOKING_LIMIT
+        )
+        if booked_hours_by_month is None:
+            room_engine["release_slots"](slots)
+            increment("quota_rejections")
+            for result in results:
+                result["Status"] = "Organization has exceeded the monthly booking limit."
+
+    # Commit every booking only if no request failed
+    if booked_hours_by_month is None:
+        for result in results:
+            result["Status"] = result["Status"] or "Not booked: another request in the batch failed."
+        return results
+
+    for (index, room_id, date_obj, _, _, start_hour, end_hour), booking_id in zip(parsed_requests, booking_ids):
+        add_booking(user, {
+            "Booking ID": str(booking_id),
+            "User ID": user["User ID"],
+            "Date": date_obj.date().isoformat(),
             "Room ID": room_id,
             "Start Hour": start_hour,
             "End Hour": end_hour
         })
-        admin_emails = get_admin_emails(organization['Name'])
-        # Notify the organization if approaching/exceeding the monthly limit
-        if remaining_monthly_limit <= 0:
-            notify_admins_limit_exceeding(
-                organization['Name'], admin_emails, organization_monthly_booked_hours
-            )
-        elif remaining_monthly_limit <= 10:
-            notify_admins_limit_approaching(
-                organization['Name'], admin_emails, organization_monthly_booked_hours, remaining_monthly_limit
-            )
+        results[index] = {"Status": "Booking confirmed.", "Booking ID": str(booking_id)}
+    increment("confirmed", len(parsed_requests))
+
+    for month, booked_hours in booked_hours_by_month.items():
+        notify_monthly_limit(organization, booked_hours, month)
+    return results
+
+
+# Function to book a room on a recurring schedule, e.g. every Tuesday 10-11 until further notice
+# The series is stored as a rule and its occurrences are expanded only when queried
+@timed("book_recurring_room_seconds")
+def book_recurring_room(session_token, room_id, start_hour, end_hour, start_date, frequency="WEEKLY", interval=1,
+                        until=None):
+    # Check if the user is logged in
+    user = is_logged_in(session_token)
+    if not user:
+        return "User is not logged in."
+    if not session_has_permission(session_token, "book"):
+        return "Permission denied. You do not have the necessary permissions."
+
+    start_date_obj = dt.strptime(start_date, "%Y-%m-%d").date()
+    until_obj = dt.strptime(until, "%Y-%m-%d").date() if until else None
+    if not 0 <= start_hour < end_hour <= 24:
+        return "Invalid booking time."
+    if frequency not in FREQUENCY_DAYS or interval < 1:
+        return "Invalid recurrence."
+    if until_obj and until_obj < start_date_obj:
+        return "Invalid recurrence."
+    if get_room(room_id) is None:
+        return "Room not found."
 
-        return "Booking confirmed."
+    series_id = str(uuid.uuid4())
+    series = {
+        "Series ID": series_id,
+        "User ID": user["User ID"],
+        "Organization ID": user["Organization ID"],
+        "Room ID": room_id,
+        "Frequency": frequency,
+        "Interval": interval,
+        "Start Date": start_date_obj.isoformat(),
+        "Until": until_obj.isoformat() if until_obj else None,
+        "Start Hour": start_hour,
+        "End Hour": end_hour,
+        "Exceptions": []
+    }
+
+    with get_room_lock(room_id):
+        # Only dates with existing bookings and one cycle of the other series are checked
+        if has_series_conflict(series, start_date_obj, until_obj) or has_recurring_conflict(series):
+            increment("conflicts")
+            return "Room is not available at the requested time."
+
+        # Check the monthly limit over the first months of the series, later months are
+        # counted lazily by the quota check of every new booking
+        with get_usage_lock(user["Organization ID"]):
+            year, month = start_date_obj.year, start_date_obj.month
+            for _ in range(RECURRING_QUOTA_HORIZON_MONTHS):
+                series_hours = series_hours_in_month(series, year, month)
+                booked_hours = get_monthly_usage(user["Organization ID"], year, month)
+                if series_hours and series_hours >= MONTHLY_BOOKING_LIMIT - booked_hours:
+                    increment("quota_rejections")
+                    return "Organization has exceeded the monthly booking limit."
+                year, month = year + month // 12, month % 12 + 1
+            add_series(series)
+
+    return f"Recurring booking confirmed with Series ID: {series_id}."
+
+
+# Function to end a recurring series, occurrences before today are kept as history
+def cancel_booking_series(session_token, series_id):
+    # Check if the user is logged in
+    user = is_logged_in(session_token)
+    if not user:
+        return "User is not logged in."
+
+    series = get_series(series_id)
+    if not series or series["User ID"] != user["User ID"]:
+        return "Booking series not found."
+
+    today = dt.now().date()
+    with get_room_lock(series["Room ID"]):
+        if date.fromisoformat(series["Start Date"]) >= today:
+            remove_series(series_id)
+        else:
+            update_series(series_id, {"Until": (today - timedelta(days=1)).isoformat()})
+
+    return "Booking series cancelled successfully."
+
+
+# Function to skip a single occurrence of a recurring series
+def skip_series_occurrence(session_token, series_id, occurrence_date):
+    # Check if the user is logged in
+    user = is_logged_in(session_token)
+    if not user:
+        return "User is not logged in."
+
+    series = get_series(series_id)
+    if not series or series["User ID"] != user["User ID"]:
+        return "Booking series not found."
+
+    occurrence_date_obj = dt.strptime(occurrence_date, "%Y-%m-%d").date()
+    if not occurs_on(series, occurrence_date_obj):
+        return "Booking not found."
+
+    with get_room_lock(series["Room ID"]):
+        update_series(series_id, {"Exceptions": series["Exceptions"] + [occurrence_date_obj.isoformat()]})
+
+    return "Booking cancelled successfully."
 
 
 # Function to check if a booking can be canceled (e.g., based on time difference)
 def can_cancel_booking(booking):
     # Implement your criteria for cancellation, e.g., notice period
     current_time = dt.now()
-    booking_start_time = current_time.replace(hour=booking["Start Hour"], minute=0, second=0, microsecond=0)
+    booking_date = dt.strptime(booking["Date"], "%Y-%m-%d")
+    booking_start_time = booking_date + timedelta(minutes=hour_to_minute(booking["Start Hour"]))
     time_difference = booking_start_time - current_time
     return time_difference.total_seconds() >= 900  # 900 seconds = 15 minutes
 
 
 # Function to cancel a booking with time-based checks
+# Users can cancel their own bookings, admins any booking of their organization
+@timed("cancel_booking_seconds")
 def cancel_booking(session_token, booking_id):
     # Check if the user is logged in
     logged_in_user = is_logged_in(session_token)
     if not logged_in_user:
         return "User is not logged in."
-    user = logged_in_user
-
-    org = is_organization_registered(user['Organization ID'])
 
-    # Find the booking by its booking ID
-    booking_to_cancel = None
-    for booking in user["Bookings"]:
-        if booking.get("Booking ID") == booking_id:
-            booking_to_cancel = booking
-            break
+    # Find the booking by its booking ID, and the user who made it
+    booking_to_cancel = get_booking(booking_id)
     if not booking_to_cancel:
         return "Booking not found."
+    user = get_user(booking_to_cancel.user_id)
+    if booking_to_cancel.user_id != logged_in_user["User ID"] and not (
+            is_session_admin(session_token) and user
+            and user["Organization ID"] == logged_in_user["Organization ID"]):
+        return "Booking not found."
 
     # Check if the booking can be canceled (based on time difference or other criteria)
     if not can_cancel_booking(booking_to_cancel):
         return "Booking cannot be canceled."
 
     # Update room availability and remove the booking
-    floor_name = booking_to_cancel.get("Floor")
-    room_name = booking_to_cancel.get("Room")
-    start_hour = booking_to_cancel.get("Start Hour")
-    end_hour = booking_to_cancel.get("End Hour")
+    booking_date = dt.strptime(booking_to_cancel["Date"], "%Y-%m-%d").date()
+    start_minute = hour_to_minute(booking_to_cancel["Start Hour"])
+    # Only one of two concurrent cancellations removes the booking, the other one stops here
+    if not remove_booking(booking_id):
+        return "Booking not found."
+    room_engine["release_slots"]([(
+        booking_to_cancel["Room ID"], booking_date, start_minute, hour_to_minute(booking_to_cancel["End Hour"]),
+        booking_to_cancel.key
+    )])
+    remove_usage(
+        user['Organization ID'], booking_date.year, booking_date.month,
+        booking_to_cancel["End Hour"] - booking_to_cancel["Start Hour"]
+    )
+
+    increment("cancelled")
+    return "Booking cancelled successfully."
 
-    room_availability = building["Floors"][floor_name][room_name]["Availability"]
-    for hour in range(start_hour, end_hour):
-        room_availability[hour] = 0
-    user["Bookings"].remove(booking_to_cancel)
 
-    # Update the organization's monthly booking hours accordingly
-    org["Monthly Booked Hours"] -= (end_hour - start_hour)
+# Function to turn the position of a booking in a user's bookings into the cursor handed out with a page
+def encode_booking_cursor(start, key):
+    return f"{start}:{key:x}"
 
-    return "Booking cancelled successfully."
+
+# Function to read a cursor handed out with a page, None if it is not one
+def decode_booking_cursor(cursor):
+    try:
+        start, key = cursor.split(":")
+        return int(start), int(key, 16)
+    except (AttributeError, ValueError):
+        return None
+
+
+# Function to get one page of a user's upcoming or past bookings from a cursor
+# Returns the bookings and the cursor of the next page, None when this page is the last one
+def get_user_bookings_page(user_id, now, upcoming, cursor, page_size):
+    bookings = list(itertools.islice(iter_user_bookings(user_id, now, upcoming, cursor), page_size + 1))
+    if len(bookings) <= page_size:
+        return [booking for booking, _, _ in bookings], None
+    last_booking, last_start, _ = bookings[page_size - 1]
+    return [booking for booking, _, _ in bookings[:page_size]], encode_booking_cursor(last_start, last_booking.key)
 
 
-# Function to view a user's current and past bookings
-def view_user_bookings(session_token):
+# Function to view a user's current and past bookings, a page of each
+# Upcoming bookings are listed earliest first and past ones latest first. To get the following page of either,
+# pass back the "Next Current Cursor" or "Next Past Cursor" of the previous page; they are None after the last page.
+@timed("view_user_bookings_seconds")
+def view_user_bookings(session_token, page_size=20, current_cursor=None, past_cursor=None):
     # Check if the user is logged in
     logged_in_user = is_logged_in(session_token)
     if not logged_in_user:
         return "User is not logged in."
 
     user = logged_in_user
-
-    # Retrieve the user's booking history
-    user_bookings = user.get("Bookings", [])
-
-    # Separate bookings into current and past based on the current time
-    current_time = dt.now()
-    current_date = current_time.date()
-
-    current_bookings = []
-    past_bookings = []
-    for booking in user_bookings:
-        booking_date = dt.strptime(booking['date'], "%Y-%m-%d")
-        booking_start_time = current_time.replace(hour=booking["Start Hour"], minute=0, second=0, microsecond=0)
-        if booking_date > current_date and booking_start_time > current_time:
-            current_bookings.append(booking)
-        else:
-            past_bookings.append(booking)
+    cursors = []
+    for cursor in (current_cursor, past_cursor):
+        decoded_cursor = decode_booking_cursor(cursor) if cursor is not None else None
+        if cursor is not None and decoded_cursor is None:
+            return "Invalid cursor."
+        cursors.append(decoded_cursor)
+
+    # Separate bookings into current and past based on the current time, bookings keep their start time
+    # as a timestamp so only the bookings of the requested pages are looked at
+    now = minute_timestamp(dt.now())
+    current_bookings, next_current_cursor = get_user_bookings_page(user["User ID"], now, True, cursors[0], page_size)
+    past_bookings, next_past_cursor = get_user_bookings_page(user["User ID"], now, False, cursors[1], page_size)
 
     return {
         "Current Bookings": current_bookings,
-        "Past Bookings": past_bookings
+        "Next Current Cursor": next_current_cursor,
+        "Past Bookings": past_bookings,
+        "Next Past Cursor": next_past_cursor,
+        "Booking Series": [series for series in get_organization_series(user["Organization ID"])
+                           if series["User ID"] == user["User ID"]]
     }
 
 
 # Function to list all organization bookings in a date range
+@timed("list_organization_bookings_seconds")
 def list_organization_bookings_in_date_range(session_token, start_date, end_date):
     # Check if the user is logged in
     logged_in_user = is_logged_in(session_token)
@@ -243,43 +494,201 @@ def list_organization_bookings_in_date_range(session_token, start_date, end_date
         return "User is not logged in."
 
     user = logged_in_user
-    # Retrieve the user's organization name
+    # Retrieve the user's organization
     organization_id = user.get("Organization ID")
-    for org in organizations:
-        if org['Organization ID'] == organization_id:
-            organization = org
-            break
-    # Create a list to store relevant bookings
-    relevant_bookings = []
-
-    org_users = [user for user in users if user['Organization ID'] == organization_id]
-    # Iterate through all users of the organization
-    for user in org_users:
-        user_bookings = user.get("Bookings", [])
-        for booking in user_bookings:
-            date_obj = dt.strptime(booking['Date'], "%Y-%m-%d")
-            start_date = dt.strptime(start_date, "%Y-%m-%d")
-            end_date = dt.strptime(end_date, "%Y-%m-%d")
-            if start_date <= date_obj <= end_date:
-                relevant_bookings.append(booking)
+
+    start_date = dt.strptime(start_date, "%Y-%m-%d").date()
+    end_date = dt.strptime(end_date, "%Y-%m-%d").date()
+    # The organization's bookings are indexed by date, so the range is a bisect plus a slice
+    relevant_bookings = get_organization_bookings(organization_id, start_date, end_date)
+
+    # Expand the organization's recurring series over the requested range only
+    occurrences = [
+        occurrence_as_booking(series, occurrence_date)
+        for series in get_organization_series(organization_id)
+        for occurrence_date in iter_occurrences(series, start_date, end_date)
+    ]
+    if occurrences:
+        relevant_bookings = sorted(relevant_bookings + occurrences, key=booking_sort_key)
 
     return relevant_bookings
 
 
-def search_suitable_rooms(session_token, capacity, start_hour, end_hour):
+# Function to page through all organization bookings in a date range without building the whole list
+# Returns a generator of lists of at most page_size bookings, sorted by date
+def iter_organization_bookings_in_date_range(session_token, start_date, end_date, page_size=100):
+    # Check if the user is logged in
+    logged_in_user = is_logged_in(session_token)
+    if not logged_in_user:
+        return "User is not logged in."
+
+    organization_id = logged_in_user.get("Organization ID")
+    start_date = dt.strptime(start_date, "%Y-%m-%d").date()
+    end_date = dt.strptime(end_date, "%Y-%m-%d").date()
+
+    # Merge the indexed bookings with the lazily expanded series occurrences
+    bookings = heapq.merge(
+        iter_organization_bookings(organization_id, start_date, end_date),
+        *(
+            (occurrence_as_booking(series, occurrence_date)
+             for occurrence_date in iter_occurrences(series, start_date, end_date))
+            for series in get_organization_series(organization_id)
+        ),
+        key=booking_sort_key
+    )
+
+    def pages():
+        page = []
+        for booking in bookings:
+            page.append(booking)
+            if len(page) == page_size:
+                yield page
+                page = []
+        if page:
+            yield page
+
+    return pages()
+
+
+# Reports over the one-off bookings, aggregated by the columnar booking table in analytics.py
+# The building-wide reports are for admins only, the peak hours report covers the user's own organization
+REPORTS_NEED_NUMPY = "Reports require NumPy. Install it with: pip install numpy"
+
+
+# Function to get the utilization of every floor per week between two dates
+@timed("report_seconds")
+def report_floor_utilization(session_token, start_date, end_date):
+    # Check if the user is logged in
+    if not is_logged_in(session_token):
+        return "User is not logged in."
+    if not is_session_admin(session_token):
+        return "Permission denied. You are not an admin."
+    start_date = dt.strptime(start_date, "%Y-%m-%d").date()
+    end_date = dt.strptime(end_date, "%Y-%m-%d").date()
+    try:
+        return get_floor_utilization(start_date, end_date)
+    except ModuleNotFoundError:
+        return REPORTS_NEED_NUMPY
+
+
+# Function to get the booked hours of every organization per month between two dates
+@timed("report_seconds")
+def report_organization_monthly_hours(session_token, start_date, end_date):
+    # Check if the user is logged in
+    if not is_logged_in(session_token):
+        return "User is not logged in."
+    if not is_session_admin(session_token):
+        return "Permission denied. You are not an admin."
+    start_date = dt.strptime(start_date, "%Y-%m-%d").date()
+    end_date = dt.strptime(end_date, "%Y-%m-%d").date()
+    try:
+        return get_organization_monthly_hours(start_date, end_date)
+    except ModuleNotFoundError:
+        return REPORTS_NEED_NUMPY
+
+
+# Function to get the organizations with the most booked hours between two dates
+@timed("report_seconds")
+def report_top_organizations(session_token, start_date, end_date, limit=10):
+    # Check if the user is logged in
+    if not is_logged_in(session_token):
+        return "User is not logged in."
+    if not is_session_admin(session_token):
+        return "Permission denied. You are not an admin."
+    start_date = dt.strptime(start_date, "%Y-%m-%d").date()
+    end_date = dt.strptime(end_date, "%Y-%m-%d").date()
+    try:
+        return get_top_organizations(start_date, end_date, limit)
+    except ModuleNotFoundError:
+        return REPORTS_NEED_NUMPY
+
+
+# Function to get the booked hours of the user's organization per hour of the day between two dates
+@timed("report_seconds")
+def report_peak_hours(session_token, start_date, end_date):
     # Check if the user is logged in
     logged_in_user = is_logged_in(session_token)
     if not logged_in_user:
         return "User is not logged in."
+    start_date = dt.strptime(start_date, "%Y-%m-%d").date()
+    end_date = dt.strptime(end_date, "%Y-%m-%d").date()
+    try:
+        return get_peak_hours(start_date, end_date, logged_in_user["Organization ID"])
+    except ModuleNotFoundError:
+        return REPORTS_NEED_NUMPY
+
 
-    suitable_rooms = []
+# Function to get the key bookings are sorted by in listings
+def booking_sort_key(booking):
+    return booking["Date"], booking["Start Hour"]
 
-    for floor_name, floor in building["Floors"].items():
-        for room_name, room in floor["Rooms"].items():
-            room_capacity = room["Capacity"]
-            availability = room["Availability"][start_hour:end_hour]
 
-            if room_capacity >= capacity and all(availability):
-                suitable_rooms.append((floor_name, room_name))
+# Function to search the free rooms with enough capacity and the requested amenities, best fit first
+@timed("search_suitable_rooms_seconds")
+def search_suitable_rooms(session_token, capacity, start_hour, end_hour, date, amenities=None):
+    # Check if the user is logged in
+    logged_in_user = is_logged_in(session_token)
+    if not logged_in_user:
+        return "User is not logged in."
+
+    date_obj = dt.strptime(date, "%Y-%m-%d").date()
+    start_minute = hour_to_minute(start_hour)
+    end_minute = hour_to_minute(end_hour)
+    return [row for _, _, _, row in room_engine["find_room_rows"](capacity, start_minute, end_minute, date_obj,
+                                                                   amenities)]
+
+
+# Function to find every room free for `duration_hours` in a row on a date, with the earliest time it is free
+# from, e.g. for suggestions while the user is typing. Only starts between earliest_hour and
+# latest_hour - duration_hours are considered. Returns (floor number, room name, Room ID, start hour) tuples.
+@timed("search_free_rooms_seconds")
+def search_free_rooms(session_token, date, duration_hours, capacity=1, earliest_hour=0, latest_hour=24,
+                      amenities=None):
+    # Check if the user is logged in
+    logged_in_user = is_logged_in(session_token)
+    if not logged_in_user:
+        return "User is not logged in."
+    if not 0 <= earliest_hour < latest_hour <= 24 or duration_hours <= 0:
+        return "Invalid booking time."
+
+    date_obj = dt.strptime(date, "%Y-%m-%d").date()
+    free_rooms = []
+    for room_id, start_minute, _ in find_free_rooms(
+            date_obj, hour_to_minute(duration_hours), capacity, hour_to_minute(earliest_hour),
+            hour_to_minute(latest_hour), amenities):
+        room = get_room(room_id)
+        floor = get_floor(room["Floor ID"])
+        free_rooms.append((floor["Floor Number"], room["Room Name"], room_id, start_minute / 60))
+
+    return free_rooms
+
+
+# Function to suggest other slots when a room is taken at the requested time: the same room earlier or later, or
+# other rooms with enough seats and the requested amenities, preferably on the same floor and close in time.
+# Starts are kept between earliest_hour and latest_hour - (end_hour - start_hour).
+# Returns up to `limit` (floor number, room name, Room ID, start hour, end hour) tuples, best first.
+@timed("suggest_alternative_slots_seconds")
+def suggest_alternative_slots(session_token, date, start_hour, end_hour, capacity=1, room_id=None, floor_number=None,
+                              earliest_hour=0, latest_hour=24, amenities=None, limit=5):
+    # Check if the user is logged in
+    logged_in_user = is_logged_in(session_token)
+    if not logged_in_user:
+        return "User is not logged in."
+    if not 0 <= start_hour < end_hour <= 24 or not 0 <= earliest_hour < latest_hour <= 24:
+        return "Invalid booking time."
+    if room_id is not None and not get_room(room_id):
+        return "Room not found."
 
-    return suitable_rooms
+    date_obj = dt.strptime(date, "%Y-%m-%d").date()
+    start_minute = hour_to_minute(start_hour)
+    duration = hour_to_minute(end_hour) - start_minute
+    alternatives = []
+    for _, alternative_room_id, alternative_start in suggest_alternatives(
+            date_obj, start_minute, duration, capacity, room_id, floor_number, hour_to_minute(earliest_hour),
+            hour_to_minute(latest_hour), amenities, limit):
+        room = get_room(alternative_room_id)
+        floor = get_floor(room["Floor ID"])
+        alternatives.append((floor["Floor Number"], room["Room Name"], alternative_room_id, alternative_start / 60,
+                             (alternative_start + duration) / 60))
+
+    return alternatives
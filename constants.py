@@ -4,6 +4,8 @@ SMTP_HOST = 'smtp.gmail.com'
 SMTP_LOGIN_EMAIL = 'aartij1998@gmail.com'
 SMTP_PASSWORD = ''
 SENDER_EMAIL = 'aartij1998@gmail.com'
+# set to False to send through a local SMTP server without STARTTLS/login
+SMTP_USE_TLS = True
 
 # default values
 DEFAULT_ORG_ID = '2c01999c-b161-4c81-a092-2c47288502ec'
@@ -11,3 +13,35 @@ DEFAULT_ORG_NAME = 'Varaha Booking System'
 DEFAULT_USER_ID = 'a3b9241a-f9af-4c62-b72b-db07f5aed28a'
 DEFAULT_USER_NAME = 'varaha user'
 DEFAULT_USER_EMAIL = 'aartij1998@gmail.com'
+
+# storage
+# the state is always kept in memory; 'journal' persists it with an append-only journal, 'sqlite' mirrors it to
+# SQLite
+STORAGE_BACKEND = 'journal'
+JOURNAL_DIRECTORY = 'booking_data'
+SQLITE_DATABASE_PATH = 'booking_data.sqlite3'
+
+# passwords
+# bcrypt cost factor for new hashes; stored hashes made with another cost are rehashed on the next login
+BCRYPT_ROUNDS = 12
+
+# metrics
+# set to True to record latencies and counters, see metrics.py
+METRICS_ENABLED = False
+
+# service
+SERVICE_HOST = '127.0.0.1'
+SERVICE_PORT = 8765
+# number of worker processes the rooms are split across by floor, see sharding.py; 0 books in one process
+# only availability checks and room searches run in the shards, booking throughput does not grow with them
+SHARD_COUNT = 0
+
+# availability calendar
+# set to a file path to keep the booked minutes of every room in a memory-mapped file, see calendar_file.py
+AVAILABILITY_CALENDAR_PATH = None
+# number of days from startup the calendar file covers, bookings on other dates are kept in memory
+AVAILABILITY_CALENDAR_DAYS = 2 * 366
+
+# booking limits
+MONTHLY_BOOKING_LIMIT = 30
+RECURRING_QUOTA_HORIZON_MONTHS = 12
@@ -1,3 +1,5 @@
+from collections import OrderedDict
+
 from constants import (DEFAULT_ORG_ID, DEFAULT_USER_ID, DEFAULT_USER_NAME, DEFAULT_ORG_NAME, DEFAULT_USER_EMAIL)
 
 # Data Structures to represent the conference room booking system
@@ -12,7 +14,7 @@ organizations = [
         'Name': DEFAULT_ORG_NAME,
         'Contact Information': {},
         'Address': {},
-        'Users': []
+        'Users': [DEFAULT_USER_ID]
     }
 ]
 users = [
@@ -31,8 +33,14 @@ users = [
 
 bookings = []
 
+# Data structure to store recurring booking series (see recurrence.py for the rule format)
+booking_series = []
+
 monthly_limits = {}
 
+# Data structure to store booked hours per (Organization ID, year, month)
+monthly_usage = {}
+
 # Data structure to store global room-related settings
 global_room_settings = {
     "Projector": True,
@@ -40,5 +48,14 @@ global_room_settings = {
     "Available Amenities": ["Whiteboard", "Audio System", "Video Conferencing"],
 }
 
+# Data structure to store booked intervals per (Room ID, date)
+room_availability = {}
+
+# Data structure to store a bitmap of booked minutes per (Room ID, date), bit n is minute n of the day
+room_busy_bitmaps = {}
+
+# Data structure to store the sorted dates on which each room has bookings
+room_booked_dates = {}
+
 # Data structure to store user sessions
-user_sessions = {}
+user_sessions = OrderedDict()
@@ -0,0 +1,119 @@
+import itertools
+import threading
+from collections import OrderedDict
+
+from analytics import load_numpy
+from availability import MINUTES_PER_DAY, availability_versions, get_busy_bitmap, minutes_bitmap
+from repository import add_mutation_listener, get_room
+from room_search import amenity_bits, get_amenities_bitset, room_amenities
+
+# Building-wide availability of a date as a rooms x minutes matrix, used to find every room that has a free
+# run of a given length in one pass over the matrix instead of looking at the rooms one by one.
+# The matrix keeps, for every room, the number of busy minutes before every minute of the day, so the busy
+# minutes of any window of any room are one subtraction. NumPy is imported on first use; without it the same
+# search runs on the busy bitmaps of the rooms.
+# Number of dates whose matrix is kept, the least recently used one is dropped beyond that
+MATRIX_CACHE_SIZE = 64
+
+matrix_cache = OrderedDict()
+matrix_cache_lock = threading.Lock()
+# Changed by every mutation of the rooms or series, which may change any date's matrix
+building_versions = itertools.count(1)
+building_state = {"version": next(building_versions)}
+
+
+# Mutation listener: rooms and series change the matrix of every date, one-off bookings are
+# tracked per date by availability_versions
+def record_mutation(operation, record):
+    if operation in ("add_room", "remove_room", "add_series", "update_series", "remove_series"):
+        building_state["version"] = next(building_versions)
+
+
+# Function to get the matrix of a date, built again only when a booking, room or series changed since
+def get_availability_matrix(numpy, date):
+    key = (availability_versions.get(date), building_state["version"], len(room_amenities))
+    with matrix_cache_lock:
+        cached = matrix_cache.get(date)
+        if cached and cached["key"] == key:
+            matrix_cache.move_to_end(date)
+            return cached
+
+    rooms = list(room_amenities.items())
+    room_ids = [room_id for room_id, _ in rooms]
+    # The busy bitmaps of every room as one block of bytes, unpacked into one row of minutes per room
+    bytes_per_room = MINUTES_PER_DAY // 8
+    busy_bytes = b"".join(get_busy_bitmap(room_id, date).to_bytes(bytes_per_room, "little") for room_id in room_ids)
+    busy = numpy.unpackbits(
+        numpy.frombuffer(busy_bytes, dtype=numpy.uint8).reshape(len(room_ids), bytes_per_room), axis=1,
+        bitorder="little"
+    )
+    busy_before = numpy.zeros((len(room_ids), MINUTES_PER_DAY + 1), dtype=numpy.int16)
+    numpy.cumsum(busy, axis=1, out=busy_before[:, 1:])
+    matrix = {
+        "key": key,
+        "room_ids": room_ids,
+        "capacities": numpy.array([get_room(room_id)["Capacity"] for room_id in room_ids], dtype=numpy.int64),
+        # Bitsets wider than 63 bits do not fit an int64, they are kept as Python ints
+        "amenities": numpy.array([bitset for _, bitset in rooms],
+                                 dtype=numpy.int64 if len(amenity_bits) < 63 else object),
+        "busy_before": busy_before,
+    }
+    with matrix_cache_lock:
+        matrix_cache[date] = matrix
+        while len(matrix_cache) > MATRIX_CACHE_SIZE:
+            matrix_cache.popitem(last=False)
+    return matrix
+
+
+# Function to find every room with at least `capacity` seats and the requested amenities that is free for
+# `duration` minutes in a row on a date, starting between window_start and window_end - duration.
+# Returns (Room ID, earliest start minute, capacity) tuples, earliest start first, then the best fit.
+def find_free_rooms(date, duration, capacity=1, window_start=0, window_end=MINUTES_PER_DAY, amenities=None):
+    required = get_amenities_bitset(amenities)
+    if required is None or duration <= 0 or window_end - window_start < duration:
+        return []
+    try:
+        numpy = load_numpy()
+    except ModuleNotFoundError:
+        return find_free_rooms_in_bitmaps(date, duration, capacity, window_start, window_end, required)
+
+    matrix = get_availability_matrix(numpy, date)
+    busy_before = matrix["busy_before"]
+    # Busy minutes of every room in every window of `duration` minutes starting within the range
+    busy_in_window = (busy_before[:, window_start + duration:window_end + 1]
+                      - busy_before[:, window_start:window_end - duration + 1])
+    free_windows = busy_in_window == 0
+    suitable = (
+        (matrix["capacities"] >= capacity) & ((matrix["amenities"] & required) == required) & free_windows.any(axis=1)
+    )
+    room_indexes = numpy.flatnonzero(suitable)
+    earliest_starts = free_windows[room_indexes].argmax(axis=1) + window_start
+    capacities = matrix["capacities"][room_indexes]
+    order = numpy.lexsort((capacities, earliest_starts))
+    room_ids = matrix["room_ids"]
+    return [(room_ids[room_indexes[index]], int(earliest_starts[index]), int(capacities[index])) for index in order]
+
+
+# Function to run find_free_rooms on the rooms' busy bitmaps, when NumPy is not installed
+def find_free_rooms_in_bitmaps(date, duration, capacity, window_start, window_end, required):
+    window = minutes_bitmap(window_start, window_end)
+    results = []
+    for room_id, bitset in list(room_amenities.items()):
+        room_capacity = get_room(room_id)["Capacity"]
+        if room_capacity < capacity or bitset & required != required:
+            continue
+        # Bit m of `runs` stays set while minutes m to m + length - 1 are all free, the run length is doubled
+        # at every step so a run of `duration` minutes takes log2(duration) steps
+        runs = ~get_busy_bitmap(room_id, date) & window
+        length = 1
+        while length < duration and runs:
+            shift = min(length, duration - length)
+            runs &= runs >> shift
+            length += shift
+        if runs:
+            results.append((room_id, (runs & -runs).bit_length() - 1, room_capacity))
+    results.sort(key=lambda result: (result[1], result[2]))
+    return results
+
+
+add_mutation_listener(record_mutation)
@@ -0,0 +1,279 @@
+import json
+import os
+import pickle
+import threading
+
+import analytics
+import availability
+import room_search
+import usage
+from data_structures import booking_series, building, organizations, users
+from records import record_to_dict
+from repository import (
+    add_booking, add_floor, add_mutation_listener, add_organization, add_room, add_series, add_user, get_booking,
+    get_floor, get_organization, get_room, get_series, get_user, rebuild_indexes, remove_booking, remove_floor,
+    remove_mutation_listener, remove_organization, remove_room, remove_series, remove_user, repository_lock,
+    update_series, update_user
+)
+
+# Append-only journal of every mutation plus periodic snapshots of the whole state.
+# Mutations are queued in memory and written by a background thread in groups, with one
+# fsync per group, so recording a booking never waits for the disk.
+# Snapshots are pickled (protocol 5), bookings included as Booking records, so loading one is a single
+# C-level pass instead of decoding JSON and converting every booking. Like the journal, a snapshot is
+# only meant to be read back by this application, never loaded from an untrusted source.
+SNAPSHOT_FILE_NAME = "snapshot.pickle"
+# Snapshot format of earlier versions, still read when there is no pickled snapshot
+JSON_SNAPSHOT_FILE_NAME = "snapshot.json"
+JOURNAL_FILE_NAME = "journal.log"
+# Longest time a recorded mutation waits before its group is written and fsynced
+GROUP_COMMIT_INTERVAL = 0.01
+# A group is written right away once this many mutations are waiting
+GROUP_COMMIT_SIZE = 512
+# A snapshot is written, and the journal truncated, after this many journaled mutations
+SNAPSHOT_EVERY = 50000
+
+journal_state = {
+    "directory": None,
+    "file": None,
+    "pending": [],
+    "records_since_snapshot": 0,
+    "flusher": None,
+    "closing": False,
+}
+# Guards the pending queue
+journal_lock = threading.Condition()
+# Guards the journal and snapshot files
+journal_io_lock = threading.Lock()
+
+
+# Function to queue a mutation for the journal, called by the repository for every add/remove
+def record(operation, payload):
+    line = json.dumps([operation, payload], separators=(",", ":"), default=record_to_dict)
+    with journal_lock:
+        journal_state["pending"].append(line)
+        if len(journal_state["pending"]) >= GROUP_COMMIT_SIZE:
+            journal_lock.notify()
+
+
+# Function to write the queued mutations to the journal with a single fsync
+def flush():
+    with journal_io_lock:
+        with journal_lock:
+            lines, journal_state["pending"] = journal_state["pending"], []
+        if lines and journal_state["file"]:
+            journal_file = journal_state["file"]
+            journal_file.write("\n".join(lines) + "\n")
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+            journal_state["records_since_snapshot"] += len(lines)
+    if journal_state["records_since_snapshot"] >= SNAPSHOT_EVERY:
+        write_snapshot()
+
+
+def _flush_periodically():
+    while True:
+        with journal_lock:
+            if not journal_state["pending"] and not journal_state["closing"]:
+                journal_lock.wait(GROUP_COMMIT_INTERVAL)
+            closing = journal_state["closing"]
+        flush()
+        if closing:
+            return
+
+
+# Function to get the whole booking state as plain data
+def get_state():
+    return {
+        "organizations": organizations,
+        "users": users,
+        "floors": building["Floors"],
+        "rooms": building["Rooms"],
+        "booking_series": booking_series,
+    }
+
+
+# Function to copy the state for a snapshot, taken under repository_lock and serialized after it is released
+# Records are only changed by the repository, which replaces their fields and changes the lists they hold in
+# place, so each record is copied with its lists. The bookings themselves are shared: their pickled fields
+# never change once made. Copying takes milliseconds where pickling takes seconds on a large state.
+def copy_state():
+    return {
+        name: [{field: list(value) if isinstance(value, list) else value for field, value in record.items()}
+               for record in records]
+        for name, records in get_state().items()
+    }
+
+
+# Function to write a snapshot of the whole state and start a new, empty journal
+def write_snapshot():
+    with journal_io_lock:
+        directory = journal_state["directory"]
+        if directory is None:
+            return
+        # Mutations queued after this point are replayed on top of the snapshot, replay skips
+        # the ones the snapshot already contains
+        with journal_lock:
+            lines, journal_state["pending"] = journal_state["pending"], []
+        journal_file = journal_state["file"]
+        if lines:
+            journal_file.write("\n".join(lines) + "\n")
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+
+        with repository_lock:
+            state = copy_state()
+        snapshot = pickle.dumps(state, protocol=5)
+        snapshot_path = os.path.join(directory, SNAPSHOT_FILE_NAME)
+        with open(snapshot_path + ".tmp", "wb") as snapshot_file:
+            snapshot_file.write(snapshot)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(snapshot_path + ".tmp", snapshot_path)
+        json_snapshot_path = os.path.join(directory, JSON_SNAPSHOT_FILE_NAME)
+        if os.path.exists(json_snapshot_path):
+            os.remove(json_snapshot_path)
+
+        journal_file.seek(0)
+        journal_file.truncate()
+        journal_file.flush()
+        os.fsync(journal_file.fileno())
+        journal_state["records_since_snapshot"] = 0
+
+
+# Function to replace the in-memory state and rebuild every index derived from it
+def load_state(state):
+    with repository_lock:
+        organizations[:] = state["organizations"]
+        users[:] = state["users"]
+        building["Floors"][:] = state["floors"]
+        building["Rooms"][:] = state["rooms"]
+        booking_series[:] = state["booking_series"]
+        rebuild_indexes()
+
+
+# Function to rebuild the availability, usage counters, search index and report table after a recovery
+def rebuild_derived_state():
+    availability.rebuild_availability(users)
+    usage.rebuild_monthly_usage(users)
+    room_search.rebuild_search_index()
+    analytics.rebuild_booking_table()
+
+
+# Function to apply one journaled mutation. Mutations that are already applied are skipped,
+# so replaying a journal over a snapshot that already contains part of it is safe.
+def apply_mutation(operation, payload):
+    if operation == "add_organization":
+        if not get_organization(payload["Organization ID"]):
+            add_organization(payload)
+    elif operation == "remove_organization":
+        remove_organization(payload)
+    elif operation == "add_user":
+        if not get_user(payload["User ID"]):
+            add_user(payload)
+    elif operation == "update_user":
+        changes = dict(payload)
+        update_user(changes.pop("User ID"), changes)
+    elif operation == "remove_user":
+        remove_user(payload)
+    elif operation == "add_floor":
+        if not get_floor(payload["Floor ID"]):
+            add_floor(payload)
+    elif operation == "remove_floor":
+        remove_floor(payload)
+    elif operation == "add_room":
+        if not get_room(payload["Room ID"]):
+            add_room(get_floor(payload["Floor ID"]), payload)
+    elif operation == "remove_room":
+        remove_room(payload)
+    elif operation == "add_booking":
+        user = get_user(payload["User ID"])
+        if user and not get_booking(payload["Booking ID"]):
+            add_booking(user, payload)
+    elif operation == "remove_booking":
+        remove_booking(payload)
+    elif operation == "add_series":
+        if not get_series(payload["Series ID"]):
+            add_series(payload)
+    elif operation == "update_series":
+        changes = dict(payload)
+        update_series(changes.pop("Series ID"), changes)
+    elif operation == "remove_series":
+        remove_series(payload)
+
+
+# Function to recover the state from a directory: load the snapshot, then replay the journal tail
+# Returns the number of replayed mutations
+def recover(directory):
+    snapshot_path = os.path.join(directory, SNAPSHOT_FILE_NAME)
+    json_snapshot_path = os.path.join(directory, JSON_SNAPSHOT_FILE_NAME)
+    if os.path.exists(snapshot_path):
+        with open(snapshot_path, "rb") as snapshot_file:
+            load_state(pickle.load(snapshot_file))
+    elif os.path.exists(json_snapshot_path):
+        with open(json_snapshot_path) as snapshot_file:
+            load_state(json.load(snapshot_file))
+
+    replayed = 0
+    journal_path = os.path.join(directory, JOURNAL_FILE_NAME)
+    if os.path.exists(journal_path):
+        # Byte offset after the last complete line
+        intact_size = 0
+        with open(journal_path, "rb") as journal_file:
+            for line in journal_file:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("Incomplete journal line.")
+                    operation, payload = json.loads(line)
+                except ValueError:
+                    # A torn write at the end of the journal, everything before it is intact
+                    break
+                apply_mutation(operation, payload)
+                replayed += 1
+                intact_size = journal_file.tell()
+            torn = journal_file.seek(0, os.SEEK_END) > intact_size
+        # Cut the torn write off, mutations journaled after this recovery would otherwise follow it
+        # and be skipped by the next one
+        if torn:
+            with open(journal_path, "r+b") as journal_file:
+                journal_file.truncate(intact_size)
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+
+    rebuild_derived_state()
+    return replayed
+
+
+# Function to recover the state from a directory and start journaling every mutation to it
+def open_journal(directory):
+    os.makedirs(directory, exist_ok=True)
+    replayed = recover(directory)
+    start_journal(directory, replayed)
+    return replayed
+
+
+# Function to start journaling every mutation to a directory the state was recovered from
+# `replayed` is the number of journaled mutations recover() replayed, counted towards the next snapshot
+def start_journal(directory, replayed=0):
+    journal_state["directory"] = directory
+    journal_state["file"] = open(os.path.join(directory, JOURNAL_FILE_NAME), "a")
+    journal_state["records_since_snapshot"] = replayed
+    journal_state["closing"] = False
+    add_mutation_listener(record)
+    journal_state["flusher"] = threading.Thread(target=_flush_periodically, daemon=True)
+    journal_state["flusher"].start()
+
+
+# Function to write every queued mutation and stop journaling
+def close_journal():
+    if journal_state["file"] is None:
+        return
+    remove_mutation_listener(record)
+    with journal_lock:
+        journal_state["closing"] = True
+        journal_lock.notify()
+    journal_state["flusher"].join()
+    with journal_io_lock:
+        journal_state["file"].close()
+        journal_state["file"] = None
+        journal_state["directory"] = None
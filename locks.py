@@ -0,0 +1,25 @@
+import threading
+
+from metrics import timed_lock
+
+# Number of lock stripes shared by all rooms. Rooms hashing to different stripes
+# can be booked in parallel, a single stripe behaves like one building-wide lock.
+ROOM_LOCK_STRIPES = 256
+
+room_locks = [threading.Lock() for _ in range(ROOM_LOCK_STRIPES)]
+
+
+# Function to get the lock guarding a room's availability
+def get_room_lock(room_id):
+    return timed_lock(room_locks[hash(room_id) % len(room_locks)], "room_lock")
+
+
+# Function to get the locks of several rooms in a fixed order so they can be taken without deadlocks
+def get_room_locks(room_ids):
+    stripes = sorted({hash(room_id) % len(room_locks) for room_id in room_ids})
+    return [timed_lock(room_locks[stripe], "room_lock") for stripe in stripes]
+
+
+# Function to change the number of lock stripes, only call this while no booking is in progress
+def configure_room_locks(stripes):
+    room_locks[:] = [threading.Lock() for _ in range(stripes)]
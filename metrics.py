@@ -0,0 +1,165 @@
+import functools
+import threading
+import time
+
+from constants import METRICS_ENABLED
+
+# In-process metrics: latency histograms, counters and gauges, readable with get_metrics() or as
+# Prometheus text with render_prometheus(). While metrics are disabled every hook returns right after
+# checking the flag: nothing is timed, nothing is locked and locks are handed out unwrapped.
+METRIC_PREFIX = "booking_"
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0)
+
+metrics_state = {"enabled": METRICS_ENABLED}
+metrics_lock = threading.Lock()
+# Name -> {"buckets": [count per bucket, the last one for values above every bound], "sum": ..., "count": ...}
+histograms = {}
+# Name -> count
+counters = {}
+# Name -> (metric type, function returning the current value), read only when the metrics are collected
+collectors = {}
+
+
+def enable_metrics():
+    metrics_state["enabled"] = True
+
+
+def disable_metrics():
+    metrics_state["enabled"] = False
+
+
+# Function to drop every recorded value, the registered collectors are kept
+def reset_metrics():
+    with metrics_lock:
+        histograms.clear()
+        counters.clear()
+
+
+def increment(name, amount=1):
+    if not metrics_state["enabled"]:
+        return
+    with metrics_lock:
+        counters[name] = counters.get(name, 0) + amount
+
+
+# Function to record a duration, in seconds, in a histogram
+def observe(name, seconds):
+    if not metrics_state["enabled"]:
+        return
+    index = 0
+    while index < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[index]:
+        index += 1
+    with metrics_lock:
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = {"buckets": [0] * (len(LATENCY_BUCKETS) + 1), "sum": 0.0, "count": 0}
+        histogram["buckets"][index] += 1
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+
+
+# Function to start timing a stage, None while metrics are disabled
+def start_timer():
+    return time.perf_counter() if metrics_state["enabled"] else None
+
+
+# Function to record the time since `started` and return the current time, so consecutive stages can be chained:
+#   stage = start_timer(); ...; stage = observe_since("a_seconds", stage); ...; observe_since("b_seconds", stage)
+def observe_since(name, started):
+    if started is None:
+        return None
+    now = time.perf_counter()
+    observe(name, now - started)
+    return now
+
+
+# Decorator recording the latency of every call of a function in the histogram `name`
+def timed(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not metrics_state["enabled"]:
+                return function(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+# Lock wrapper recording how long the lock was waited for and held
+class TimedLock:
+    def __init__(self, lock, name):
+        self.lock = lock
+        self.name = name
+        self.acquired_at = None
+
+    def acquire(self, *args, **kwargs):
+        started = time.perf_counter()
+        acquired = self.lock.acquire(*args, **kwargs)
+        self.acquired_at = time.perf_counter()
+        observe(f"{self.name}_wait_seconds", self.acquired_at - started)
+        return acquired
+
+    def release(self):
+        observe(f"{self.name}_hold_seconds", time.perf_counter() - self.acquired_at)
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+# Function to get a lock that records its wait and hold times, the lock itself while metrics are disabled
+def timed_lock(lock, name):
+    if not metrics_state["enabled"]:
+        return lock
+    return TimedLock(lock, name)
+
+
+# Function to register a value read when the metrics are collected, e.g. a queue depth
+# metric_type is "gauge" for values that go up and down or "counter" for totals kept elsewhere
+def register_collector(name, function, metric_type="gauge"):
+    collectors[name] = (metric_type, function)
+
+
+# Function to get a copy of every metric
+def get_metrics():
+    with metrics_lock:
+        snapshot = {
+            "counters": dict(counters),
+            "histograms": {
+                name: {"buckets": list(histogram["buckets"]), "sum": histogram["sum"], "count": histogram["count"]}
+                for name, histogram in histograms.items()
+            },
+        }
+    snapshot["gauges"] = {name: function() for name, (_, function) in collectors.items()}
+    return snapshot
+
+
+# Function to render every metric in the Prometheus text exposition format
+def render_prometheus():
+    snapshot = get_metrics()
+    lines = []
+    for name, value in sorted(snapshot["counters"].items()):
+        lines.append(f"# TYPE {METRIC_PREFIX}{name}_total counter")
+        lines.append(f"{METRIC_PREFIX}{name}_total {value}")
+    for name, value in sorted(snapshot["gauges"].items()):
+        lines.append(f"# TYPE {METRIC_PREFIX}{name} {collectors[name][0]}")
+        lines.append(f"{METRIC_PREFIX}{name} {value}")
+    for name, histogram in sorted(snapshot["histograms"].items()):
+        lines.append(f"# TYPE {METRIC_PREFIX}{name} histogram")
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), histogram["buckets"]):
+            cumulative += count
+            lines.append(f'{METRIC_PREFIX}{name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"{METRIC_PREFIX}{name}_sum {histogram['sum']}")
+        lines.append(f"{METRIC_PREFIX}{name}_count {histogram['count']}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,143 @@
+import logging
+import queue
+import threading
+import time
+from datetime import date
+
+from constants import SENDER_EMAIL
+from metrics import increment, observe_since, register_collector, start_timer
+from utilities import build_email, open_smtp_connection
+
+# Notifications are queued and sent by a fixed pool of workers. Every worker keeps its SMTP
+# connection open between messages, so a burst of bookings opens at most NOTIFICATION_WORKERS
+# connections instead of one thread and one connection per notification.
+logger = logging.getLogger(__name__)
+
+NOTIFICATION_QUEUE_SIZE = 1000
+NOTIFICATION_WORKERS = 2
+MAX_DELIVERY_ATTEMPTS = 4
+# Delay before the first retry, doubled after every failed attempt
+RETRY_BACKOFF = 1.0
+
+notification_queue = queue.Queue(maxsize=NOTIFICATION_QUEUE_SIZE)
+notification_workers = []
+notification_workers_lock = threading.Lock()
+# (year, month) -> keys of the notifications about that month already queued, used to send each deduplicated
+# alert once; the keys of a month are dropped once it has passed
+sent_notification_keys = {}
+sent_notification_keys_lock = threading.Lock()
+notification_stats = {"queued": 0, "sent": 0, "failed": 0, "dropped": 0, "deduplicated": 0, "retrying": 0}
+
+register_collector("notification_queue_depth", notification_queue.qsize)
+register_collector("notifications_retrying", lambda: notification_stats["retrying"])
+register_collector("notifications_sent_total", lambda: notification_stats["sent"], "counter")
+register_collector("notifications_failed_total", lambda: notification_stats["failed"], "counter")
+register_collector("notifications_dropped_total", lambda: notification_stats["dropped"], "counter")
+
+
+# Function to queue an email for every recipient. With a dedup_key, e.g. (organization, alert), and the
+# (year, month) the notification is about, only the first notification with that key in that month is sent.
+# Returns False if the notification was not queued.
+def queue_notification(recipient_emails, subject, message, dedup_key=None, month=None):
+    if not recipient_emails:
+        return False
+    start_notification_workers()
+    if dedup_key is None or month is None:
+        return put_notification(recipient_emails, subject, message)
+    # The key is only recorded once the notification is queued, an alert that was dropped is sent next time.
+    # The lock is held while queueing, which never blocks, so two bookings cannot both send the alert.
+    with sent_notification_keys_lock:
+        current_month = (date.today().year, date.today().month)
+        forget_past_notification_keys(current_month)
+        if dedup_key in sent_notification_keys.get(month, ()):
+            notification_stats["deduplicated"] += 1
+            return False
+        queued = put_notification(recipient_emails, subject, message)
+        # Notifications about a month that has passed are not deduplicated, their keys would be dropped next time
+        if queued and month >= current_month:
+            sent_notification_keys.setdefault(month, set()).add(dedup_key)
+        return queued
+
+
+# Function to drop the keys of the months before the current one, called with sent_notification_keys_lock held
+def forget_past_notification_keys(current_month):
+    for month in [month for month in sent_notification_keys if month < current_month]:
+        del sent_notification_keys[month]
+
+
+# Function to queue an email for every recipient without waiting, returns False if none was queued
+def put_notification(recipient_emails, subject, message):
+    queued = False
+    for recipient_email in recipient_emails:
+        try:
+            notification_queue.put_nowait((recipient_email, subject, message, 1))
+            notification_stats["queued"] += 1
+            queued = True
+        except queue.Full:
+            # Never block a booking on email, drop the notification instead
+            notification_stats["dropped"] += 1
+    return queued
+
+
+# Function to start the worker pool, once
+def start_notification_workers():
+    if notification_workers:
+        return
+    with notification_workers_lock:
+        while len(notification_workers) < NOTIFICATION_WORKERS:
+            worker = threading.Thread(target=deliver_notifications, daemon=True)
+            worker.start()
+            notification_workers.append(worker)
+
+
+# Worker loop: send queued notifications over a persistent connection, retrying with exponential backoff
+# Any error only fails the message it happened on, the worker carries on with the next one
+def deliver_notifications():
+    server = None
+    while True:
+        recipient_email, subject, message, attempt = notification_queue.get()
+        started = start_timer()
+        try:
+            if server is None:
+                server = open_smtp_connection()
+            server.sendmail(SENDER_EMAIL, recipient_email, build_email(recipient_email, subject, message).as_string())
+            notification_stats["sent"] += 1
+            observe_since("notification_delivery_seconds", started)
+        except Exception:
+            logger.exception("Could not send a notification to %s (attempt %d).", recipient_email, attempt)
+            # The connection may be broken, open a new one for the next message
+            if server is not None:
+                try:
+                    server.close()
+                except Exception:
+                    pass
+            server = None
+            increment("notification_delivery_errors")
+            if attempt < MAX_DELIVERY_ATTEMPTS:
+                retry = (recipient_email, subject, message, attempt + 1)
+                timer = threading.Timer(RETRY_BACKOFF * 2 ** (attempt - 1), requeue_notification, args=(retry,))
+                timer.daemon = True
+                notification_stats["retrying"] += 1
+                timer.start()
+            else:
+                notification_stats["failed"] += 1
+        finally:
+            notification_queue.task_done()
+
+
+def requeue_notification(notification):
+    try:
+        notification_queue.put_nowait(notification)
+    except queue.Full:
+        notification_stats["dropped"] += 1
+    notification_stats["retrying"] -= 1
+
+
+# Function to wait until every queued notification has been sent or given up on
+def wait_for_notifications(timeout=None):
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while notification_queue.unfinished_tasks or notification_stats["retrying"]:
+        if deadline is not None and time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
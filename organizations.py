@@ -1,9 +1,8 @@
 import uuid
-import threading
 
-from data_structures import organizations
-from utilities import send_email
-from validations import is_admin, is_organization_registered, is_logged_in
+from repository import add_organization
+from notifications import queue_notification
+from validations import is_logged_in, is_organization_registered, is_session_admin
 
 
 # Function to register a new organization
@@ -12,9 +11,8 @@ def register_organization(session_token, org_name, contact_info=None, address=No
     user = is_logged_in(session_token)
     if not user:
         return 'User is not logged in.'
-    user_id = user['User ID']
     # Check if the user is an admin
-    if not is_admin(user_id):
+    if not is_session_admin(session_token):
         return "Permission denied. You are not an admin."
     # Check if the organization name is unique
     if is_organization_registered(org_name):
@@ -24,13 +22,13 @@ def register_organization(session_token, org_name, contact_info=None, address=No
     # Additional organization details
     org_details = {
         "Organization ID": org_id,
-        "Organization Name": org_name,
+        "Name": org_name,
         "Contact Information": contact_info or {},
         "Address": address or {},
         "Users": []
     }
 
-    organizations.append(org_details)
+    add_organization(org_details)
     return "Organization registered successfully."
 
 
@@ -39,16 +37,16 @@ def notify_admins_limit_exceeding(organization_name, admin_emails, total_booked_
     message = f"Dear Admin,\n\nThe organization '{organization_name}' has exceeded its monthly booking limit.\n" \
               f"Total booked hours for this month: {total_booked_hours} hours."
 
-    email_thread = threading.Thread(target=send_email, args=(admin_emails, subject, message))
-    email_thread.start()
+    queue_notification(admin_emails, subject, message)
 
 
 # Function to notify the organization admin when the monthly limit is approaching
-def notify_admins_limit_approaching(organization_name, admin_emails, total_booked_hours, remaining_limit):
+# Pass the (year, month) of the booking to send this alert only once per organization and month
+def notify_admins_limit_approaching(organization_name, admin_emails, total_booked_hours, remaining_limit,
+                                    month=None):
     subject = f"Monthly Booking Limit Approaching for {organization_name}"
     message = f"Dear Admin,\n\nThe organization '{organization_name}' is approaching its monthly booking limit.\n" \
               f"Total booked hours for this month: {total_booked_hours} hours.\n" \
               f"Remaining limit: {remaining_limit} hours."
 
-    email_thread = threading.Thread(target=send_email, args=(admin_emails, subject, message))
-    email_thread.start()
+    queue_notification(admin_emails, subject, message, dedup_key=(organization_name, "limit approaching"), month=month)
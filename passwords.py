@@ -0,0 +1,89 @@
+import threading
+
+from constants import BCRYPT_ROUNDS
+from metrics import register_collector
+
+# bcrypt is deliberately slow (~250ms at cost 12) and holds the GIL while it runs, so hashing and
+# checking passwords is done on a small pool of worker processes instead of on the calling thread.
+PASSWORD_WORKERS = 2
+# Most logins checked at once; further attempts wait up to LOGIN_ADMISSION_TIMEOUT seconds for a slot
+# and are then turned away, so a flood of logins cannot take every thread serving bookings
+MAX_CONCURRENT_LOGINS = 8
+LOGIN_ADMISSION_TIMEOUT = 2.0
+
+password_pool_state = {"executor": None}
+password_pool_lock = threading.Lock()
+login_slots = threading.BoundedSemaphore(MAX_CONCURRENT_LOGINS)
+login_stats = {"admitted": 0, "rejected": 0}
+
+register_collector("logins_admitted_total", lambda: login_stats["admitted"], "counter")
+register_collector("logins_rejected_total", lambda: login_stats["rejected"], "counter")
+
+
+# Runs in a worker process. bcrypt, like the process pool in get_password_executor, is imported on first
+# use, so sessions that never log in do not load them.
+def _hash(password, rounds):
+    import bcrypt
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+# Runs in a worker process
+def _check(hashed_password, input_password):
+    import bcrypt
+    return bcrypt.checkpw(input_password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+
+# Function to get the worker pool, started on first use
+def get_password_executor():
+    if password_pool_state["executor"] is None:
+        with password_pool_lock:
+            if password_pool_state["executor"] is None:
+                from concurrent.futures import ProcessPoolExecutor
+                password_pool_state["executor"] = ProcessPoolExecutor(max_workers=PASSWORD_WORKERS)
+    return password_pool_state["executor"]
+
+
+def shutdown_password_executor():
+    with password_pool_lock:
+        executor, password_pool_state["executor"] = password_pool_state["executor"], None
+    if executor is not None:
+        executor.shutdown()
+
+
+def hash_password(password, rounds=None):
+    return get_password_executor().submit(_hash, password, rounds or BCRYPT_ROUNDS).result()
+
+
+def verify_password(hashed_password, input_password):
+    return get_password_executor().submit(_check, hashed_password, input_password).result()
+
+
+# Function to get the cost factor a bcrypt hash was made with, e.g. 12 for '$2b$12$...'
+def get_hash_rounds(hashed_password):
+    try:
+        return int(hashed_password.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+# Function to check if a hash was made with a different cost factor than the configured one
+def needs_rehash(hashed_password):
+    return get_hash_rounds(hashed_password) != BCRYPT_ROUNDS
+
+
+# Function to take a login slot, False if none frees up within the admission timeout
+def admit_login(timeout=LOGIN_ADMISSION_TIMEOUT):
+    if login_slots.acquire(timeout=timeout):
+        login_stats["admitted"] += 1
+        return True
+    login_stats["rejected"] += 1
+    return False
+
+
+def release_login():
+    login_slots.release()
+
+
+# Function to count a login turned away before it asked for a slot, e.g. by the service
+def reject_login():
+    login_stats["rejected"] += 1
@@ -0,0 +1,97 @@
+import sys
+import uuid
+from collections.abc import Mapping
+from datetime import date
+
+# Bookings are by far the most numerous records, so they are stored as compact __slots__ objects instead
+# of dicts. A Booking still reads like the dict it replaces, booking["Date"], booking.get("Room ID") and
+# dict(booking) keep working, so the code reading bookings does not need to know the difference.
+#
+# Per booking, instead of a dict and a 36 character Booking ID string:
+#   - the Booking ID is kept as its 128-bit integer, turned back into the usual string when read
+#   - the User ID, Room ID and Date strings are interned, every booking of a room or a day shares one string
+# The position of the booking in its user's "Bookings" list is kept by the repository, so that removing a
+# booking from the list does not need to search it.
+
+# Booking field -> attribute
+BOOKING_FIELDS = {
+    "Booking ID": "key",
+    "User ID": "user_id",
+    "Date": "date",
+    "Room ID": "room_id",
+    "Start Hour": "start_hour",
+    "End Hour": "end_hour",
+}
+
+
+class Booking(Mapping):
+    __slots__ = ("key", "user_id", "date", "room_id", "start_hour", "end_hour", "position")
+
+    def __init__(self, key, user_id, date, room_id, start_hour, end_hour):
+        self.key = key
+        self.user_id = sys.intern(user_id)
+        self.date = sys.intern(date)
+        self.room_id = sys.intern(room_id)
+        self.start_hour = start_hour
+        self.end_hour = end_hour
+        self.position = None
+
+    def __getitem__(self, field):
+        if field == "Booking ID":
+            return str(uuid.UUID(int=self.key))
+        return getattr(self, BOOKING_FIELDS[field])
+
+    def __iter__(self):
+        return iter(BOOKING_FIELDS)
+
+    def __len__(self):
+        return len(BOOKING_FIELDS)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    # Pickled as its fields, e.g. in snapshots
+    def __reduce__(self):
+        return Booking, (self.key, self.user_id, self.date, self.room_id, self.start_hour, self.end_hour)
+
+    # Bookings are compared by identity, like the dicts they replace are when removed from a user's list
+    __eq__ = object.__eq__
+    __hash__ = object.__hash__
+
+
+# Function to get the integer key of a Booking ID, None if it is not a valid ID
+def booking_key(booking_id):
+    if isinstance(booking_id, int):
+        return booking_id
+    try:
+        return uuid.UUID(booking_id).int
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+# Function to get a booking as a Booking record, bookings that already are one are returned as they are
+def as_booking(booking):
+    if isinstance(booking, Booking):
+        return booking
+    return Booking(
+        booking_key(booking["Booking ID"]), booking["User ID"], booking["Date"], booking["Room ID"],
+        booking["Start Hour"], booking["End Hour"]
+    )
+
+
+# Function to get the start and end of a booking as minutes since 0001-01-01, comparable across dates
+def booking_times(booking):
+    day_start = date.fromisoformat(booking.date).toordinal() * 24 * 60
+    return day_start + int(round(booking.start_hour * 60)), day_start + int(round(booking.end_hour * 60))
+
+
+# Function to get a datetime as minutes since 0001-01-01, comparable with booking_times
+def minute_timestamp(moment):
+    return moment.toordinal() * 24 * 60 + moment.hour * 60 + moment.minute
+
+
+# json.dumps default: encodes records as the dicts they stand for
+def record_to_dict(value):
+    if isinstance(value, Booking):
+        return dict(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
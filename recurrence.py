@@ -0,0 +1,79 @@
+from datetime import date, timedelta
+from math import lcm
+
+# Recurring bookings are stored as a rule, RRULE style, and never materialized:
+# {
+#     "Series ID", "User ID", "Organization ID", "Room ID",
+#     "Frequency": "DAILY" or "WEEKLY", "Interval": every n days/weeks,
+#     "Start Date": "YYYY-MM-DD", "Until": "YYYY-MM-DD" or None for an open-ended series,
+#     "Start Hour", "End Hour", "Exceptions": dates ("YYYY-MM-DD") that were skipped
+# }
+FREQUENCY_DAYS = {"DAILY": 1, "WEEKLY": 7}
+
+
+# Function to get the number of days between two occurrences of a series
+def series_period(series):
+    return FREQUENCY_DAYS[series["Frequency"]] * series["Interval"]
+
+
+# Function to get the last date of a series, None if it is open-ended
+def series_until(series):
+    return date.fromisoformat(series["Until"]) if series["Until"] else None
+
+
+# Function to check if a series has an occurrence on a date
+def occurs_on(series, day):
+    start = date.fromisoformat(series["Start Date"])
+    if day < start or (series["Until"] and day > date.fromisoformat(series["Until"])):
+        return False
+    if (day - start).days % series_period(series):
+        return False
+    return day.isoformat() not in series["Exceptions"]
+
+
+# Generator yielding the occurrence dates of a series between window_start and window_end (both inclusive)
+# Only the requested window is expanded, so this is safe on open-ended series
+def iter_occurrences(series, window_start, window_end):
+    start = date.fromisoformat(series["Start Date"])
+    until = series_until(series)
+    if until and until < window_end:
+        window_end = until
+    period = series_period(series)
+    if window_start <= start:
+        day = start
+    else:
+        day = start + timedelta(days=-(-(window_start - start).days // period) * period)
+    step = timedelta(days=period)
+    while day <= window_end:
+        if day.isoformat() not in series["Exceptions"]:
+            yield day
+        day += step
+
+
+# Function to check if two series ever occur on the same date
+# Occurrence patterns repeat every lcm(period) days, so checking one cycle is enough
+def series_share_a_date(series, other_series):
+    window_start = max(date.fromisoformat(series["Start Date"]), date.fromisoformat(other_series["Start Date"]))
+    window_end = window_start + timedelta(days=lcm(series_period(series), series_period(other_series)) - 1)
+    return any(occurs_on(other_series, day) for day in iter_occurrences(series, window_start, window_end))
+
+
+# Function to render an occurrence of a series like a regular booking
+def occurrence_as_booking(series, day):
+    return {
+        "Booking ID": None,
+        "Series ID": series["Series ID"],
+        "User ID": series["User ID"],
+        "Date": day.isoformat(),
+        "Room ID": series["Room ID"],
+        "Start Hour": series["Start Hour"],
+        "End Hour": series["End Hour"]
+    }
+
+
+# Function to get the hours a series books in a given month
+def series_hours_in_month(series, year, month):
+    month_start = date(year, month, 1)
+    month_end = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    occurrences = sum(1 for _ in iter_occurrences(series, month_start, month_end))
+    return occurrences * (series["End Hour"] - series["Start Hour"])
@@ -0,0 +1,428 @@
+import threading
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from datetime import date
+
+from data_structures import booking_series, building, organizations, users
+from records import as_booking, booking_key, booking_times
+
+# Hash indexes over the lists in data_structures. The lists stay the source of truth,
+# every add/remove below updates the list and the matching indexes together.
+users_by_id = {}
+users_by_name = {}
+organizations_by_id = {}
+organizations_by_name = {}
+floors_by_id = {}
+floors_by_number = {}
+rooms_by_id = {}
+rooms_by_name = {}
+# Integer key of the Booking ID -> Booking record
+bookings_by_id = {}
+series_by_id = {}
+series_by_room = {}
+series_by_organization = {}
+# Organization ID -> sorted list of (date ordinal, start hour, integer key of the Booking ID)
+organization_booking_index = {}
+# User ID -> the user's bookings sorted by start time then integer key, with their start and end times as
+# minutes since 0001-01-01 in arrays next to them: {"starts": array, "ends": array, "bookings": list}
+user_booking_index = {}
+
+# Create a lock so that a record and its indexes are always updated together
+repository_lock = threading.RLock()
+
+# Functions called with (operation, record) after every add/remove, e.g. the journal
+mutation_listeners = []
+
+
+# Function to register a function to call after every add/remove
+def add_mutation_listener(listener):
+    mutation_listeners.append(listener)
+
+
+# Function to unregister a mutation listener
+def remove_mutation_listener(listener):
+    if listener in mutation_listeners:
+        mutation_listeners.remove(listener)
+
+
+def _notify(operation, record):
+    for listener in mutation_listeners:
+        listener(operation, record)
+
+
+# Function to rebuild every index from the lists in data_structures
+def rebuild_indexes():
+    with repository_lock:
+        for index in (users_by_id, users_by_name, organizations_by_id, organizations_by_name,
+                      floors_by_id, floors_by_number, rooms_by_id, rooms_by_name, bookings_by_id,
+                      series_by_id, series_by_room, series_by_organization, organization_booking_index,
+                      user_booking_index):
+            index.clear()
+        for org in organizations:
+            _index_organization(org)
+        for user in users:
+            _index_user(user, rebuilding=True)
+        # The organizations' date indexes are sorted once instead of inserting the bookings one by one
+        for index in organization_booking_index.values():
+            index.sort()
+        for floor in building["Floors"]:
+            _index_floor(floor)
+        for room in building["Rooms"]:
+            _index_room(room)
+        for series in booking_series:
+            _index_series(series)
+
+
+def _index_organization(org):
+    organizations_by_id[org["Organization ID"]] = org
+    organizations_by_name[org["Name"]] = org
+
+
+# While rebuilding every index, the derived state (availability, reports...) is rebuilt afterwards as well,
+# so the listeners are not told about every booking
+def _index_user(user, rebuilding=False):
+    users_by_id[user["User ID"]] = user
+    users_by_name[user["User Name"]] = user
+    # Bookings loaded from a snapshot or a database are plain dicts, they are stored as Booking records
+    user_bookings = user.get("Bookings", [])
+    user_bookings[:] = [as_booking(booking) for booking in user_bookings]
+    for position, booking in enumerate(user_bookings):
+        booking.position = position
+        bookings_by_id[booking.key] = booking
+        if rebuilding:
+            organization_booking_index.setdefault(user["Organization ID"], []).append(
+                _organization_booking_key(booking)
+            )
+        else:
+            _index_organization_booking(user["Organization ID"], booking)
+            _notify("add_booking", booking)
+    # The user's time index is built sorted in one go instead of inserting the bookings one by one
+    timed_bookings = sorted((booking_times(booking), booking.key, booking) for booking in user_bookings)
+    user_booking_index[user["User ID"]] = {
+        "starts": array("q", [times[0] for times, _, _ in timed_bookings]),
+        "ends": array("q", [times[1] for times, _, _ in timed_bookings]),
+        "bookings": [booking for _, _, booking in timed_bookings],
+    }
+
+
+def _organization_booking_key(booking):
+    return date.fromisoformat(booking.date).toordinal(), booking.start_hour, booking.key
+
+
+def _index_organization_booking(org_id, booking):
+    insort(organization_booking_index.setdefault(org_id, []), _organization_booking_key(booking))
+
+
+def _unindex_organization_booking(org_id, booking):
+    index = organization_booking_index.get(org_id, [])
+    position = bisect_left(index, _organization_booking_key(booking))
+    if position < len(index) and index[position][2] == booking.key:
+        del index[position]
+
+
+# Function to get the position of the first booking of a user's time index after (start, key), or at it
+# when `inclusive` is True
+def _user_booking_position(index, start, key, inclusive=False):
+    starts, bookings = index["starts"], index["bookings"]
+    position = bisect_left(starts, start)
+    while position < len(starts) and starts[position] == start and (
+            bookings[position].key < key if inclusive else bookings[position].key <= key):
+        position += 1
+    return position
+
+
+def _index_user_booking(user_id, booking):
+    index = user_booking_index.setdefault(user_id, {"starts": array("q"), "ends": array("q"), "bookings": []})
+    start, end = booking_times(booking)
+    position = _user_booking_position(index, start, booking.key)
+    index["starts"].insert(position, start)
+    index["ends"].insert(position, end)
+    index["bookings"].insert(position, booking)
+
+
+def _unindex_user_booking(user_id, booking):
+    index = user_booking_index.get(user_id)
+    if not index:
+        return
+    position = _user_booking_position(index, booking_times(booking)[0], booking.key, inclusive=True)
+    if position < len(index["bookings"]) and index["bookings"][position] is booking:
+        del index["starts"][position]
+        del index["ends"][position]
+        del index["bookings"][position]
+
+
+def _index_floor(floor):
+    floors_by_id[floor["Floor ID"]] = floor
+    floors_by_number[floor["Floor Number"]] = floor
+
+
+def _index_room(room):
+    rooms_by_id[room["Room ID"]] = room
+    rooms_by_name[room["Room Name"]] = room
+
+
+def _index_series(series):
+    series_by_id[series["Series ID"]] = series
+    series_by_room.setdefault(series["Room ID"], []).append(series)
+    series_by_organization.setdefault(series["Organization ID"], []).append(series)
+
+
+# Organizations
+def get_organization(org_id):
+    return organizations_by_id.get(org_id)
+
+
+def get_organization_by_name(org_name):
+    return organizations_by_name.get(org_name)
+
+
+def add_organization(org):
+    with repository_lock:
+        organizations.append(org)
+        _index_organization(org)
+        _notify("add_organization", org)
+
+
+def remove_organization(org_id):
+    with repository_lock:
+        org = organizations_by_id.pop(org_id, None)
+        if org:
+            organizations_by_name.pop(org["Name"], None)
+            organizations.remove(org)
+            _notify("remove_organization", org_id)
+        return org
+
+
+# Users
+def get_user(user_id):
+    return users_by_id.get(user_id)
+
+
+def get_user_by_name(user_name):
+    return users_by_name.get(user_name)
+
+
+def add_user(user):
+    with repository_lock:
+        users.append(user)
+        _index_user(user)
+        org = organizations_by_id.get(user["Organization ID"])
+        if org and user["User ID"] not in org["Users"]:
+            org["Users"].append(user["User ID"])
+        _notify("add_user", user)
+
+
+# Function to change fields of a user that are not indexed, e.g. its Password
+def update_user(user_id, changes):
+    with repository_lock:
+        user = users_by_id.get(user_id)
+        if user:
+            user.update(changes)
+            _notify("update_user", {"User ID": user_id, **changes})
+        return user
+
+
+def remove_user(user_id):
+    with repository_lock:
+        user = users_by_id.pop(user_id, None)
+        if user:
+            users_by_name.pop(user["User Name"], None)
+            user_booking_index.pop(user_id, None)
+            for booking in user.get("Bookings", []):
+                bookings_by_id.pop(booking.key, None)
+                _unindex_organization_booking(user["Organization ID"], booking)
+            org = organizations_by_id.get(user["Organization ID"])
+            if org and user_id in org["Users"]:
+                org["Users"].remove(user_id)
+            users.remove(user)
+            _notify("remove_user", user_id)
+        return user
+
+
+# Floors
+def get_floor(floor_id):
+    return floors_by_id.get(floor_id)
+
+
+def get_floor_by_number(floor_number):
+    return floors_by_number.get(floor_number)
+
+
+def add_floor(floor):
+    with repository_lock:
+        building["Floors"].append(floor)
+        _index_floor(floor)
+        _notify("add_floor", floor)
+
+
+def remove_floor(floor_id):
+    with repository_lock:
+        floor = floors_by_id.pop(floor_id, None)
+        if floor:
+            floors_by_number.pop(floor["Floor Number"], None)
+            building["Floors"].remove(floor)
+            _notify("remove_floor", floor_id)
+        return floor
+
+
+# Rooms
+def get_room(room_id):
+    return rooms_by_id.get(room_id)
+
+
+def get_room_by_name(room_name):
+    return rooms_by_name.get(room_name)
+
+
+def add_room(floor, room):
+    with repository_lock:
+        building["Rooms"].append(room)
+        floor["Room IDs"].append(room["Room ID"])
+        _index_room(room)
+        _notify("add_room", room)
+
+
+def remove_room(room_id):
+    with repository_lock:
+        room = rooms_by_id.pop(room_id, None)
+        if room:
+            rooms_by_name.pop(room["Room Name"], None)
+            building["Rooms"].remove(room)
+            for floor in building["Floors"]:
+                if room_id in floor["Room IDs"]:
+                    floor["Room IDs"].remove(room_id)
+            _notify("remove_room", room_id)
+        return room
+
+
+# Bookings
+# Function to get a booking by its Booking ID, either the usual string or its integer key
+def get_booking(booking_id):
+    return bookings_by_id.get(booking_key(booking_id))
+
+
+# Function to add a booking to a user, the booking is stored as a Booking record which is returned
+def add_booking(user, booking):
+    with repository_lock:
+        booking = as_booking(booking)
+        booking.position = len(user["Bookings"])
+        user["Bookings"].append(booking)
+        bookings_by_id[booking.key] = booking
+        _index_organization_booking(user["Organization ID"], booking)
+        _index_user_booking(user["User ID"], booking)
+        _notify("add_booking", booking)
+        return booking
+
+
+def remove_booking(booking_id):
+    with repository_lock:
+        booking = bookings_by_id.pop(booking_key(booking_id), None)
+        if booking:
+            user = users_by_id.get(booking.user_id)
+            if user:
+                # The last booking of the user takes the place of the removed one
+                user_bookings = user["Bookings"]
+                last_booking = user_bookings.pop()
+                if last_booking is not booking:
+                    user_bookings[booking.position] = last_booking
+                    last_booking.position = booking.position
+                _unindex_organization_booking(user["Organization ID"], booking)
+                _unindex_user_booking(user["User ID"], booking)
+            _notify("remove_booking", booking["Booking ID"])
+        return booking
+
+
+# Function to get an organization's bookings between two dates (both inclusive), sorted by date
+def get_organization_bookings(org_id, start_date, end_date):
+    # The bookings are looked up under the lock as well, a cancellation may remove them right after
+    with repository_lock:
+        index = organization_booking_index.get(org_id, [])
+        keys = index[bisect_left(index, (start_date.toordinal(),)):
+                     bisect_right(index, (end_date.toordinal(), float("inf")))]
+        return [bookings_by_id[key[2]] for key in keys]
+
+
+# Generator yielding an organization's bookings between two dates (both inclusive), sorted by date
+# The position is looked up again after every booking, so bookings may be added or removed while paging
+def iter_organization_bookings(org_id, start_date, end_date):
+    end_ordinal = end_date.toordinal()
+    key = (start_date.toordinal(),)
+    while True:
+        with repository_lock:
+            index = organization_booking_index.get(org_id, [])
+            position = bisect_right(index, key)
+            if position == len(index) or index[position][0] > end_ordinal:
+                return
+            key = index[position]
+            booking = bookings_by_id[key[2]]
+        yield booking
+
+
+# Generator yielding a user's bookings with their (start, end) times, as minutes since 0001-01-01, from a cursor:
+# the upcoming bookings (starting after `now`) earliest first, or the past ones latest first.
+# The cursor is the (start, integer key) of the last booking already seen, None to start from `now`.
+# Like iter_organization_bookings, the position is looked up again after every booking.
+def iter_user_bookings(user_id, now, upcoming=True, cursor=None):
+    while True:
+        with repository_lock:
+            index = user_booking_index.get(user_id)
+            if not index:
+                return
+            if upcoming:
+                position = (bisect_right(index["starts"], now) if cursor is None
+                            else _user_booking_position(index, *cursor))
+                if position == len(index["bookings"]):
+                    return
+            else:
+                position = (bisect_right(index["starts"], now) if cursor is None
+                            else _user_booking_position(index, *cursor, inclusive=True)) - 1
+                if position < 0:
+                    return
+            booking = index["bookings"][position]
+            start, end = index["starts"][position], index["ends"][position]
+        cursor = (start, booking.key)
+        yield booking, start, end
+
+
+# Recurring booking series
+def get_series(series_id):
+    return series_by_id.get(series_id)
+
+
+def get_room_series(room_id):
+    return series_by_room.get(room_id, [])
+
+
+def get_organization_series(org_id):
+    return series_by_organization.get(org_id, [])
+
+
+def add_series(series):
+    with repository_lock:
+        booking_series.append(series)
+        _index_series(series)
+        _notify("add_series", series)
+
+
+# Function to change fields of a series, e.g. its Until date or Exceptions
+def update_series(series_id, changes):
+    with repository_lock:
+        series = series_by_id.get(series_id)
+        if series:
+            series.update(changes)
+            _notify("update_series", {"Series ID": series_id, **changes})
+        return series
+
+
+def remove_series(series_id):
+    with repository_lock:
+        series = series_by_id.pop(series_id, None)
+        if series:
+            series_by_room[series["Room ID"]].remove(series)
+            series_by_organization[series["Organization ID"]].remove(series)
+            booking_series.remove(series)
+            _notify("remove_series", series_id)
+        return series
+
+
+rebuild_indexes()
@@ -0,0 +1,110 @@
+import threading
+from bisect import bisect_left, insort
+
+from availability import get_busy_bitmap, minutes_bitmap
+from data_structures import building, global_room_settings
+from repository import get_floor, get_room
+
+# Bit assigned to every amenity name, new amenities get the next free bit
+amenity_bits = {}
+# Amenity bitset of every room
+room_amenities = {}
+# Amenity bitset -> sorted list of (capacity, Room ID) for the rooms having exactly those amenities.
+# Rooms are grouped by bitset so that a query only visits groups having every requested amenity
+# and, inside a group, only the rooms that are big enough.
+capacity_index = {}
+
+# Create a lock for updates of the search index
+search_index_lock = threading.Lock()
+
+
+# Function to get the bit of an amenity, registering it if it was never seen
+def get_amenity_bit(amenity):
+    bit = amenity_bits.get(amenity)
+    if bit is None:
+        bit = amenity_bits[amenity] = 1 << len(amenity_bits)
+    return bit
+
+
+# Function to get the amenity names of a room from its room settings
+def get_room_amenity_names(room):
+    room_settings = room.get("Room Settings") or global_room_settings
+    if isinstance(room_settings, str):
+        return [amenity.strip() for amenity in room_settings.split(",") if amenity.strip()]
+    amenity_names = list(room_settings.get("Available Amenities", []))
+    if room_settings.get("Projector"):
+        amenity_names.append("Projector")
+    return amenity_names
+
+
+# Function to get the bitset of a list of amenity names, None if an amenity is unknown to every room
+def get_amenities_bitset(amenity_names):
+    bitset = 0
+    for amenity in amenity_names or []:
+        bit = amenity_bits.get(amenity)
+        if bit is None:
+            return None
+        bitset |= bit
+    return bitset
+
+
+# Function to add a room to the search index
+def index_room(room):
+    with search_index_lock:
+        bitset = 0
+        for amenity in get_room_amenity_names(room):
+            bitset |= get_amenity_bit(amenity)
+        room_amenities[room["Room ID"]] = bitset
+        insort(capacity_index.setdefault(bitset, []), (room["Capacity"], room["Room ID"]))
+
+
+# Function to remove a room from the search index
+def unindex_room(room):
+    with search_index_lock:
+        bitset = room_amenities.pop(room["Room ID"], None)
+        if bitset is None:
+            return
+        rooms = capacity_index[bitset]
+        del rooms[bisect_left(rooms, (room["Capacity"], room["Room ID"]))]
+        if not rooms:
+            del capacity_index[bitset]
+
+
+# Function to rebuild the search index from the rooms in the building
+def rebuild_search_index():
+    with search_index_lock:
+        room_amenities.clear()
+        capacity_index.clear()
+    for room in building["Rooms"]:
+        index_room(room)
+
+
+# Function to find the rooms with at least `capacity` seats, every requested amenity and free between
+# start_minute and end_minute on a date, best fit first: the fewest spare seats, then the fewest amenities that
+# were not asked for. Returns (spare seats, extra amenities, Room ID, (floor number, room name, Room ID)) tuples,
+# sorted, so that the rooms found in several sets of rooms (e.g. shards) can be merged without sorting again.
+def find_room_rows(capacity, start_minute, end_minute, date, amenities=None):
+    required = get_amenities_bitset(amenities)
+    if required is None:
+        return []
+    requested_minutes = minutes_bitmap(start_minute, end_minute)
+
+    candidates = []
+    for bitset, rooms in list(capacity_index.items()):
+        if bitset & required != required:
+            continue
+        extra_amenities = bin(bitset & ~required).count("1")
+        for room_capacity, room_id in rooms[bisect_left(rooms, (capacity,)):]:
+            if not get_busy_bitmap(room_id, date) & requested_minutes:
+                candidates.append((room_capacity - capacity, extra_amenities, room_id))
+
+    candidates.sort()
+    rows = []
+    for spare_seats, extra_amenities, room_id in candidates:
+        room = get_room(room_id)
+        rows.append((spare_seats, extra_amenities, room_id,
+                     (get_floor(room["Floor ID"])["Floor Number"], room["Room Name"], room_id)))
+    return rows
+
+
+rebuild_search_index()
@@ -4,6 +4,7 @@ from conference_rooms import (
     search_suitable_rooms
 )
 from organizations import register_organization
+from storage import close_configured_storage, open_configured_storage
 from users import login, register_user, logout
 
 
@@ -101,15 +102,19 @@ def input_to_search_room(session_token):
     capacity = int(get_user_input('Enter the desired capacity: '))
     start_hour = int(get_user_input('Enter the start time (in 24 hour format): '))
     end_hour = int(get_user_input('Enter the end time (in 24 hour format): '))
+    date = get_user_input('Enter the date(Follow the format YYYY-MM-DD): ')
+    amenities = get_user_input('Enter required amenities (Separated by comma). Press Enter to skip: ')
 
     return search_suitable_rooms(
         session_token=session_token, capacity=capacity,
-        start_hour=start_hour, end_hour=end_hour
+        start_hour=start_hour, end_hour=end_hour, date=date,
+        amenities=[amenity.strip() for amenity in amenities.split(',') if amenity.strip()]
     )
 
 
 def input_to_logout(session_token):
     logout(session_token)
+    close_configured_storage()
     print("Exiting the program. Goodbye!")
     raise SystemExit
 
@@ -147,6 +152,8 @@ menu_options = {
 }
 
 if __name__ == "__main__":
+    # Restore the state saved by previous runs and persist every change from now on
+    open_configured_storage()
     session_token = login()
 
     if session_token:
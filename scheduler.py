@@ -0,0 +1,106 @@
+import heapq
+from bisect import bisect_left
+
+from availability import MINUTES_PER_DAY, get_free_intervals
+from data_structures import building
+from repository import get_room
+from room_search import capacity_index, get_amenities_bitset
+
+# Alternatives for a booking request whose slot is taken: the same room earlier or later, and other rooms at
+# the same or another time, ranked by a cost over how far each one is from the request.
+# What a room costs before moving in time (being another room, on another floor, with spare seats) is a lower
+# bound of the cost of all its slots, so rooms are visited cheapest first and the search stops as soon as no
+# room left can beat the alternatives already found. Only those rooms have their calendar looked at.
+# Cost of every minute between the requested start and the alternative's start
+COST_PER_MINUTE_MOVED = 1
+# Cost of an alternative in another room than the requested one
+COST_OTHER_ROOM = 60
+# Cost of every floor between the requested floor and the alternative's floor
+COST_PER_FLOOR = 15
+# Cost of every seat more than needed
+COST_PER_SPARE_SEAT = 2
+
+
+# Function to get the number of floors between two floor numbers
+# Floor numbers are whatever was typed when the floor was added (run.py keeps them as strings), floors whose
+# numbers are not numeric are one floor apart unless they are the same
+def get_floor_distance(floor_number, other_floor_number):
+    try:
+        distance = abs(float(floor_number) - float(other_floor_number))
+        return int(distance) if distance.is_integer() else distance
+    except (TypeError, ValueError):
+        return 0 if str(floor_number) == str(other_floor_number) else 1
+
+
+# Function to get the cost of a room other than the requested one before moving in time
+def get_room_cost(room_capacity, floor_number, capacity, room_requested, preferred_floor_number):
+    cost = max(room_capacity - capacity, 0) * COST_PER_SPARE_SEAT
+    if room_requested:
+        cost += COST_OTHER_ROOM
+    if preferred_floor_number is not None and floor_number is not None:
+        cost += get_floor_distance(floor_number, preferred_floor_number) * COST_PER_FLOOR
+    return cost
+
+
+# Function to get the slots of `duration` minutes of a room closest to start_minute, one per free gap
+# Returns (start minute, minutes moved) tuples
+def get_nearest_starts(room_id, date, start_minute, duration, window_start, window_end):
+    nearest_starts = []
+    for gap_start, gap_end in get_free_intervals(room_id, date, window_start, window_end):
+        if gap_end - gap_start >= duration:
+            start = min(max(start_minute, gap_start), gap_end - duration)
+            nearest_starts.append((start, abs(start - start_minute)))
+    return nearest_starts
+
+
+# Function to suggest the `limit` cheapest slots for a booking of `duration` minutes from start_minute on a
+# date, for at least `capacity` people with the requested amenities, starting between window_start and
+# window_end - duration. room_id and floor_number are the preferred room and floor, the preferred floor is
+# the room's floor when only a room is given; the preferred room is always considered.
+# Returns (cost, Room ID, start minute) tuples, cheapest first
+def suggest_alternatives(date, start_minute, duration, capacity=1, room_id=None, floor_number=None,
+                         window_start=0, window_end=MINUTES_PER_DAY, amenities=None, limit=5):
+    required = get_amenities_bitset(amenities)
+    if required is None or duration <= 0 or limit <= 0:
+        return []
+    floor_numbers = {floor["Floor ID"]: floor["Floor Number"] for floor in building["Floors"]}
+    preferred_room = get_room(room_id) if room_id is not None else None
+    if floor_number is None and preferred_room:
+        floor_number = floor_numbers.get(preferred_room["Floor ID"])
+
+    # Candidate rooms as a heap of (cost before moving in time, Room ID)
+    rooms = []
+    for bitset, indexed_rooms in list(capacity_index.items()):
+        if bitset & required != required:
+            continue
+        for room_capacity, candidate_id in indexed_rooms[bisect_left(indexed_rooms, (capacity,)):]:
+            if candidate_id == room_id:
+                continue
+            candidate = get_room(candidate_id)
+            if candidate is None:
+                continue
+            rooms.append((get_room_cost(
+                room_capacity, floor_numbers.get(candidate["Floor ID"]), capacity, preferred_room is not None,
+                floor_number
+            ), candidate_id))
+    # The requested room only costs the time it is moved by
+    if preferred_room:
+        rooms.append((0, room_id))
+    heapq.heapify(rooms)
+
+    # The cheapest alternatives found so far as a max-heap of (-cost, -order found, Room ID, start minute)
+    best = []
+    found = 0
+    while rooms and (len(best) < limit or rooms[0][0] < -best[0][0]):
+        room_cost, candidate_id = heapq.heappop(rooms)
+        for start, minutes_moved in get_nearest_starts(
+                candidate_id, date, start_minute, duration, window_start, window_end):
+            cost = room_cost + minutes_moved * COST_PER_MINUTE_MOVED
+            alternative = (-cost, -found, candidate_id, start)
+            found += 1
+            if len(best) < limit:
+                heapq.heappush(best, alternative)
+            elif cost < -best[0][0]:
+                heapq.heapreplace(best, alternative)
+
+    return [(-cost, candidate_id, start) for cost, _, candidate_id, start in sorted(best, reverse=True)]
@@ -0,0 +1,254 @@
+import asyncio
+import functools
+import json
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack, asynccontextmanager
+
+import conference_rooms
+import users
+from constants import SERVICE_HOST, SERVICE_PORT, SHARD_COUNT
+from metrics import render_prometheus
+from passwords import MAX_CONCURRENT_LOGINS, reject_login
+from records import Booking, record_to_dict
+from repository import get_booking
+from sessions import start_session_sweeper
+from sharding import start_shards, stop_shards
+from storage import close_configured_storage, load_configured_storage, start_configured_storage
+
+# asyncio service over the booking functions, speaking line-delimited JSON over TCP:
+#   request:  {"id": 1, "method": "book_room", "params": {"session_token": "...", "room_id": "...", ...}}
+#   response: {"id": 1, "result": "Booking confirmed."}  or  {"id": 1, "error": "..."}
+# Requests on one connection may be pipelined, responses carry the id of their request.
+#
+# The booking functions are blocking, they run on a thread pool so the event loop never waits on them.
+# Password hashing runs on a separate small pool so a burst of logins cannot take every booking thread.
+# Logins beyond MAX_PENDING_LOGINS, running or waiting for a password thread, are turned away at once:
+# attempts queued inside the executor would never reach the admission limit of passwords.py.
+BOOKING_WORKERS = 16
+PASSWORD_WORKERS = 4
+MAX_PENDING_LOGINS = MAX_CONCURRENT_LOGINS
+
+booking_executor = ThreadPoolExecutor(max_workers=BOOKING_WORKERS, thread_name_prefix="booking")
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_WORKERS, thread_name_prefix="password")
+
+# Room ID -> {"lock": asyncio.Lock, "users": requests holding or waiting for it}. The lock is FIFO, so
+# requests for the same room are applied in the order they arrived while requests for different rooms run
+# concurrently. A room's entry is dropped once no request uses it, so only rooms with requests in flight
+# have one, whatever Room IDs the clients send.
+room_order_locks = {}
+# Logins submitted to password_executor and not answered yet, only changed on the event loop
+login_state = {"pending": 0}
+
+
+@asynccontextmanager
+async def get_room_order_lock(room_id):
+    entry = room_order_locks.get(room_id)
+    if entry is None:
+        entry = room_order_locks[room_id] = {"lock": asyncio.Lock(), "users": 0}
+    entry["users"] += 1
+    try:
+        async with entry["lock"]:
+            yield
+    finally:
+        entry["users"] -= 1
+        if not entry["users"]:
+            del room_order_locks[room_id]
+
+
+# Run a blocking function on an executor and wait for its result
+async def run_blocking(executor, function, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(function, *args, **kwargs))
+
+
+async def login(username, password):
+    if login_state["pending"] >= MAX_PENDING_LOGINS:
+        reject_login()
+        return None
+    login_state["pending"] += 1
+    try:
+        return await run_blocking(password_executor, users.authenticate, username, password)
+    finally:
+        login_state["pending"] -= 1
+
+
+async def logout(session_token):
+    users.logout(session_token)
+    return "Logged out."
+
+
+async def book_room(session_token, room_id, start_hour, end_hour, date):
+    async with get_room_order_lock(room_id):
+        return await run_blocking(
+            booking_executor, conference_rooms.book_room, session_token, room_id, start_hour, end_hour, date
+        )
+
+
+async def book_rooms_batch(session_token, requests):
+    async with AsyncExitStack() as stack:
+        # Take the room locks in a fixed order so two batches can never wait on each other
+        for room_id in sorted({request["room_id"] for request in requests}):
+            await stack.enter_async_context(get_room_order_lock(room_id))
+        return await run_blocking(booking_executor, conference_rooms.book_rooms_batch, session_token, requests)
+
+
+async def cancel_booking(session_token, booking_id):
+    booking = get_booking(booking_id)
+    if booking is None:
+        return await run_blocking(booking_executor, conference_rooms.cancel_booking, session_token, booking_id)
+    async with get_room_order_lock(booking["Room ID"]):
+        return await run_blocking(booking_executor, conference_rooms.cancel_booking, session_token, booking_id)
+
+
+async def search_suitable_rooms(session_token, capacity, start_hour, end_hour, date, amenities=None):
+    return await run_blocking(
+        booking_executor, conference_rooms.search_suitable_rooms, session_token, capacity, start_hour, end_hour,
+        date, amenities
+    )
+
+
+async def search_free_rooms(session_token, date, duration_hours, capacity=1, earliest_hour=0, latest_hour=24,
+                            amenities=None):
+    return await run_blocking(
+        booking_executor, conference_rooms.search_free_rooms, session_token, date, duration_hours, capacity,
+        earliest_hour, latest_hour, amenities
+    )
+
+
+async def suggest_alternative_slots(session_token, date, start_hour, end_hour, capacity=1, room_id=None,
+                                    floor_number=None, earliest_hour=0, latest_hour=24, amenities=None, limit=5):
+    return await run_blocking(
+        booking_executor, conference_rooms.suggest_alternative_slots, session_token, date, start_hour, end_hour,
+        capacity, room_id, floor_number, earliest_hour, latest_hour, amenities, limit
+    )
+
+
+async def view_user_bookings(session_token, page_size=20, current_cursor=None, past_cursor=None):
+    return await run_blocking(
+        booking_executor, conference_rooms.view_user_bookings, session_token, page_size, current_cursor, past_cursor
+    )
+
+
+async def list_organization_bookings_in_date_range(session_token, start_date, end_date):
+    return await run_blocking(
+        booking_executor, conference_rooms.list_organization_bookings_in_date_range, session_token, start_date,
+        end_date
+    )
+
+
+async def report_floor_utilization(session_token, start_date, end_date):
+    return await run_blocking(
+        booking_executor, conference_rooms.report_floor_utilization, session_token, start_date, end_date
+    )
+
+
+async def report_organization_monthly_hours(session_token, start_date, end_date):
+    return await run_blocking(
+        booking_executor, conference_rooms.report_organization_monthly_hours, session_token, start_date, end_date
+    )
+
+
+async def report_top_organizations(session_token, start_date, end_date, limit=10):
+    return await run_blocking(
+        booking_executor, conference_rooms.report_top_organizations, session_token, start_date, end_date, limit
+    )
+
+
+async def report_peak_hours(session_token, start_date, end_date):
+    return await run_blocking(booking_executor, conference_rooms.report_peak_hours, session_token, start_date, end_date)
+
+
+async def metrics():
+    return render_prometheus()
+
+
+service_methods = {
+    "login": login,
+    "logout": logout,
+    "book_room": book_room,
+    "book_rooms_batch": book_rooms_batch,
+    "cancel_booking": cancel_booking,
+    "search_suitable_rooms": search_suitable_rooms,
+    "search_free_rooms": search_free_rooms,
+    "suggest_alternative_slots": suggest_alternative_slots,
+    "view_user_bookings": view_user_bookings,
+    "list_organization_bookings_in_date_range": list_organization_bookings_in_date_range,
+    "report_floor_utilization": report_floor_utilization,
+    "report_organization_monthly_hours": report_organization_monthly_hours,
+    "report_top_organizations": report_top_organizations,
+    "report_peak_hours": report_peak_hours,
+    "metrics": metrics,
+}
+
+
+# Function to run one decoded request and build its response
+async def handle_request(request):
+    request_id = request.get("id") if isinstance(request, dict) else None
+    method = service_methods.get(request.get("method")) if isinstance(request, dict) else None
+    if method is None:
+        return {"id": request_id, "error": "Unknown method."}
+    try:
+        return {"id": request_id, "result": await method(**request.get("params", {}))}
+    except (TypeError, ValueError, KeyError) as e:
+        return {"id": request_id, "error": f"Invalid request. Error: {str(e)}"}
+    except Exception as e:
+        # Every request gets a response, e.g. when a shard stopped while serving it
+        return {"id": request_id, "error": f"Request failed. Error: {str(e)}"}
+
+
+# json.dumps default for results: bookings as dicts, anything else, e.g. a date, as its string
+def encode_value(value):
+    return record_to_dict(value) if isinstance(value, Booking) else str(value)
+
+
+async def handle_connection(reader, writer):
+    pending = set()
+
+    async def respond(request):
+        response = await handle_request(request)
+        writer.write(json.dumps(response, default=encode_value).encode("utf-8") + b"\n")
+        await writer.drain()
+
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+            except ValueError:
+                writer.write(json.dumps({"id": None, "error": "Invalid JSON."}).encode("utf-8") + b"\n")
+                continue
+            task = asyncio.create_task(respond(request))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.gather(*pending)
+    finally:
+        writer.close()
+
+
+# Function to start the service, returns the asyncio server
+async def start_service(host=SERVICE_HOST, port=SERVICE_PORT):
+    return await asyncio.start_server(handle_connection, host, port)
+
+
+async def serve(host=SERVICE_HOST, port=SERVICE_PORT):
+    server = await start_service(host, port)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    # Restore the state saved by previous runs. The shards are forked from it before any thread is started,
+    # the journal or SQLite writer included, then every change is persisted from now on
+    loaded = load_configured_storage()
+    start_shards(SHARD_COUNT)
+    start_configured_storage(loaded)
+    # Sessions abandoned without logging out expire even when nobody logs in
+    start_session_sweeper()
+    try:
+        asyncio.run(serve())
+    finally:
+        stop_shards()
+        close_configured_storage()
@@ -0,0 +1,108 @@
+import heapq
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from data_structures import user_sessions
+from metrics import register_collector
+
+# Session timeout duration (e.g., 30 minutes), every access pushes the expiry back (sliding expiration)
+session_timeout = timedelta(minutes=30)
+# Most sessions kept at once, the least recently used session is evicted beyond that
+MAX_SESSIONS = 100000
+
+# Heap of (expires_at, session_token). A session has a single entry; when its expiry moved since
+# the entry was pushed, the entry is pushed again with the new expiry instead of expiring the session.
+session_expiry_heap = []
+session_lock = threading.Lock()
+session_stats = {"created": 0, "expired": 0, "evicted": 0}
+
+register_collector("sessions_active", user_sessions.__len__)
+register_collector("sessions_created_total", lambda: session_stats["created"], "counter")
+register_collector("sessions_expired_total", lambda: session_stats["expired"], "counter")
+register_collector("sessions_evicted_total", lambda: session_stats["evicted"], "counter")
+
+
+# Function to create a session for a user, with the user's role and permissions resolved once
+def create_session(user):
+    session_token = str(uuid.uuid4())
+    now = time.monotonic()
+    session_data = {
+        "user": user,
+        "session_start_time": datetime.now(),
+        "expires_at": now + session_timeout.total_seconds(),
+        "Role": user["Role"],
+        "Is Admin": user["Role"] == "admin",
+        "Permissions": frozenset(user["Permissions"]),
+    }
+    with session_lock:
+        sweep_expired_sessions(now)
+        while len(user_sessions) >= MAX_SESSIONS:
+            user_sessions.popitem(last=False)
+            session_stats["evicted"] += 1
+        user_sessions[session_token] = session_data
+        heapq.heappush(session_expiry_heap, (session_data["expires_at"], session_token))
+        session_stats["created"] += 1
+    return session_token
+
+
+# Function to get a live session and extend it, None if it does not exist or has expired
+def get_session(session_token):
+    session_data = user_sessions.get(session_token)
+    if session_data is None:
+        return None
+    now = time.monotonic()
+    if session_data["expires_at"] < now:
+        with session_lock:
+            if user_sessions.pop(session_token, None) is not None:
+                session_stats["expired"] += 1
+        return None
+    session_data["expires_at"] = now + session_timeout.total_seconds()
+    try:
+        user_sessions.move_to_end(session_token)
+    except KeyError:
+        # Evicted or logged out by another thread in the meantime
+        return None
+    return session_data
+
+
+# Function to remove a session
+def end_session(session_token):
+    with session_lock:
+        user_sessions.pop(session_token, None)
+
+
+# Function to remove every session whose expiry has passed, costs O(log n) per expired session
+# Must be called with session_lock held
+def sweep_expired_sessions(now=None):
+    now = time.monotonic() if now is None else now
+    expired = 0
+    while session_expiry_heap and session_expiry_heap[0][0] < now:
+        _, session_token = heapq.heappop(session_expiry_heap)
+        session_data = user_sessions.get(session_token)
+        if session_data is None:
+            continue
+        if session_data["expires_at"] < now:
+            del user_sessions[session_token]
+            expired += 1
+        else:
+            heapq.heappush(session_expiry_heap, (session_data["expires_at"], session_token))
+    # Drop the entries of sessions that were logged out or evicted once they make up most of the heap
+    if len(session_expiry_heap) > 2 * len(user_sessions) + 64:
+        session_expiry_heap[:] = [(data["expires_at"], token) for token, data in user_sessions.items()]
+        heapq.heapify(session_expiry_heap)
+    session_stats["expired"] += expired
+    return expired
+
+
+# Function to sweep expired sessions from a timer, every `interval` seconds
+def start_session_sweeper(interval=60):
+    def sweep():
+        with session_lock:
+            sweep_expired_sessions()
+        timer = threading.Timer(interval, sweep)
+        timer.daemon = True
+        timer.start()
+
+    sweep()
@@ -0,0 +1,272 @@
+import heapq
+import itertools
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future
+
+import availability
+import conference_rooms
+from constants import SHARD_COUNT
+from data_structures import building
+from journal import apply_mutation
+from locks import get_room_locks
+from repository import add_mutation_listener, get_room, mutation_listeners, remove_mutation_listener
+from room_search import find_room_rows, index_room, unindex_room
+
+# Sharded booking engine: the rooms are split by floor across worker processes, each owning the availability
+# of its rooms, so availability checks and room searches on different floors run on different cores.
+# This process is the router. It keeps every record, the organizations' quota counters and a copy of the
+# availability (read by the free slot search, the scheduler and recurring bookings), and sends the steps of
+# conference_rooms.room_engine to the shards over pipes:
+#   - reserve_slots / release_slots go to the shards owning the rooms, all-or-nothing across shards
+#   - find_room_rows is asked of every shard at once and their sorted answers are merged
+# The monthly quota is reserved here once the shards hold the slots, so it is shared by every shard.
+# Only those steps leave the router: sessions, the quota, add_booking with its indexes, the journal, the
+# analytics table and the mutation listeners still run here, one thread at a time under the GIL, and each
+# call pays a round trip over a pipe. Booking throughput does not grow with the number of shards and its
+# latency is higher than in one process; sharding only spreads the CPU of searches over large buildings.
+# Workers are forked from the router once the state is loaded (fork is not available on Windows) and before
+# any other thread is started, which could hold a lock at the time of the fork and leave it locked forever in
+# the workers: load the state with storage.load_configured_storage, start the shards, then start persisting
+# changes and serving. Later changes to floors, rooms and series are forwarded to the shards.
+shard_state = {"shards": [], "floor_shards": {}}
+request_ids = itertools.count()
+
+# Mutations forwarded to every shard, applied there with journal.apply_mutation
+FORWARDED_MUTATIONS = (
+    "add_floor", "remove_floor", "add_room", "remove_room", "add_series", "update_series", "remove_series"
+)
+
+
+# Worker side
+
+# Function to apply a forwarded mutation in a shard, the rooms owned by the shard are kept in its search index
+def apply_shard_mutation(operation, payload, owned):
+    removed_room = get_room(payload) if operation == "remove_room" else None
+    apply_mutation(operation, payload)
+    if operation == "add_room" and owned:
+        index_room(get_room(payload["Room ID"]))
+    elif removed_room:
+        unindex_room(removed_room)
+
+
+shard_operations = {
+    "reserve_slots": availability.reserve_slots,
+    "release_slots": availability.release_slots,
+    "find_room_rows": find_room_rows,
+    "apply_mutation": apply_shard_mutation,
+    "cpu_time": time.process_time,
+}
+
+
+# Worker loop: answer the router's requests one at a time until it sends None or closes the pipe
+def run_shard(connection, floor_ids):
+    # The router keeps the journal, reports and caches up to date, a shard only keeps its own availability,
+    # in memory: the availability calendar file is the router's
+    del mutation_listeners[:]
+    availability.detach_availability_calendar()
+    for room in list(building["Rooms"]):
+        if room["Floor ID"] not in floor_ids:
+            unindex_room(room)
+
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+        request_id, operation, args = message
+        try:
+            connection.send((request_id, True, shard_operations[operation](*args)))
+        except Exception as e:
+            # Sent back to the router and raised there, a failed request never stops the shard
+            connection.send((request_id, False, e))
+
+
+# Router side
+
+# Function to send a request to a shard, returns a Future of its result
+def call_shard(shard, operation, *args):
+    future = Future()
+    request_id = next(request_ids)
+    with shard["send_lock"]:
+        shard["pending"][request_id] = future
+        shard["connection"].send((request_id, operation, args))
+    return future
+
+
+# Reader thread of a shard: resolve the Future of every answer
+def read_shard_results(shard):
+    while True:
+        try:
+            request_id, succeeded, value = shard["connection"].recv()
+        except (EOFError, OSError):
+            break
+        future = shard["pending"].pop(request_id, None)
+        if future is None:
+            continue
+        if succeeded:
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+    for future in shard["pending"].values():
+        future.set_exception(RuntimeError("Shard stopped."))
+
+
+# Function to group the positions of slots by the index of the shard owning their room
+def group_slots_by_shard(slots):
+    groups = {}
+    for position, slot in enumerate(slots):
+        groups.setdefault(shard_state["floor_shards"][get_room(slot[0])["Floor ID"]], []).append(position)
+    return groups
+
+
+# Function to get the CPU time every shard has used so far, in seconds
+def get_shard_cpu_times():
+    futures = [call_shard(shard, "cpu_time") for shard in shard_state["shards"]]
+    return [future.result() for future in futures]
+
+
+# room_engine["reserve_slots"] of the router, see availability.reserve_slots
+def reserve_slots_on_shards(slots):
+    shards = shard_state["shards"]
+    room_locks = get_room_locks({slot[0] for slot in slots})
+    for lock in room_locks:
+        lock.acquire()
+    try:
+        groups = group_slots_by_shard(slots)
+        futures = {
+            index: call_shard(shards[index], "reserve_slots", [slots[position] for position in positions])
+            for index, positions in groups.items()
+        }
+        taken = []
+        reserved = []
+        for index, positions in groups.items():
+            shard_taken = futures[index].result()
+            if shard_taken:
+                taken.extend(positions[position] for position in shard_taken)
+            else:
+                reserved.append(index)
+        if taken:
+            # Either every slot is reserved or none is: the shards that held theirs give them back
+            for index in reserved:
+                call_shard(shards[index], "release_slots", [slots[position] for position in groups[index]]).result()
+            return sorted(taken)
+        # Keep this process's copy of the availability in line with the shards, the shards already checked
+        # the slots so they are recorded as they are
+        for slot in slots:
+            availability.record_slot(*slot)
+        return []
+    finally:
+        for lock in reversed(room_locks):
+            lock.release()
+
+
+# room_engine["release_slots"] of the router, see availability.release_slots
+def release_slots_on_shards(slots):
+    shards = shard_state["shards"]
+    room_locks = get_room_locks({slot[0] for slot in slots})
+    for lock in room_locks:
+        lock.acquire()
+    try:
+        # Slots of rooms removed since they were booked only exist in this process
+        slots = [slot for slot in slots if get_room(slot[0])]
+        groups = group_slots_by_shard(slots)
+        futures = [call_shard(shards[index], "release_slots", [slots[position] for position in positions])
+                   for index, positions in groups.items()]
+        for future in futures:
+            future.result()
+        for room_id, date, start_minute, _, booking_id in slots:
+            availability.release_slot(room_id, date, start_minute, booking_id)
+    finally:
+        for lock in reversed(room_locks):
+            lock.release()
+
+
+# room_engine["find_room_rows"] of the router, see room_search.find_room_rows
+# Every shard sorts and describes its own rooms, so the answers only need to be merged
+def find_room_rows_on_shards(capacity, start_minute, end_minute, date, amenities=None):
+    futures = [call_shard(shard, "find_room_rows", capacity, start_minute, end_minute, date, amenities)
+               for shard in shard_state["shards"]]
+    return list(heapq.merge(*[future.result() for future in futures]))
+
+
+# Mutation listener of the router: forward the changes of floors, rooms and series to the shards
+def forward_mutation(operation, record):
+    if operation not in FORWARDED_MUTATIONS:
+        return
+    shards = shard_state["shards"]
+    floor_shards = shard_state["floor_shards"]
+    if operation == "add_floor":
+        # A new floor goes to the shard with the fewest floors
+        floor_counts = [0] * len(shards)
+        for index in floor_shards.values():
+            floor_counts[index] += 1
+        floor_shards[record["Floor ID"]] = floor_counts.index(min(floor_counts))
+    owner = floor_shards.get(record["Floor ID"]) if operation == "add_room" else None
+    for index, shard in enumerate(shards):
+        call_shard(shard, "apply_mutation", operation, record, index == owner)
+
+
+# Function to split the rooms across `shard_count` worker processes and route the room engine to them
+def start_shards(shard_count=SHARD_COUNT):
+    if shard_state["shards"] or shard_count < 1:
+        return
+    if threading.active_count() > 1:
+        raise RuntimeError("Start the shards before any other thread.")
+    context = multiprocessing.get_context("fork")
+    floor_shards = shard_state["floor_shards"]
+
+    # The floors with the most rooms are placed first, each on the shard with the fewest rooms so far
+    floor_groups = [set() for _ in range(shard_count)]
+    room_counts = [0] * shard_count
+    for floor in sorted(building["Floors"], key=lambda floor: len(floor["Room IDs"]), reverse=True):
+        index = room_counts.index(min(room_counts))
+        floor_groups[index].add(floor["Floor ID"])
+        room_counts[index] += len(floor["Room IDs"])
+        floor_shards[floor["Floor ID"]] = index
+
+    for floor_ids in floor_groups:
+        router_connection, worker_connection = context.Pipe()
+        process = context.Process(target=run_shard, args=(worker_connection, floor_ids), daemon=True)
+        process.start()
+        worker_connection.close()
+        shard_state["shards"].append({
+            "process": process,
+            "connection": router_connection,
+            "send_lock": threading.Lock(),
+            "pending": {},
+        })
+    # Reader threads are started once every worker is forked, so no worker inherits one
+    for shard in shard_state["shards"]:
+        shard["reader"] = threading.Thread(target=read_shard_results, args=(shard,), daemon=True)
+        shard["reader"].start()
+
+    add_mutation_listener(forward_mutation)
+    conference_rooms.room_engine.update({
+        "reserve_slots": reserve_slots_on_shards,
+        "release_slots": release_slots_on_shards,
+        "find_room_rows": find_room_rows_on_shards,
+    })
+
+
+# Function to stop the shards and go back to booking in this process, whose availability is up to date
+def stop_shards():
+    if not shard_state["shards"]:
+        return
+    conference_rooms.room_engine.update({
+        "reserve_slots": availability.reserve_slots,
+        "release_slots": availability.release_slots,
+        "find_room_rows": find_room_rows,
+    })
+    remove_mutation_listener(forward_mutation)
+    for shard in shard_state["shards"]:
+        with shard["send_lock"]:
+            shard["connection"].send(None)
+        shard["process"].join()
+        shard["connection"].close()
+        shard["reader"].join()
+    shard_state["shards"].clear()
+    shard_state["floor_shards"].clear()
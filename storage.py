@@ -0,0 +1,327 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from availability import hour_to_minute
+from calendar_file import close_availability_calendar, open_availability_calendar
+from constants import AVAILABILITY_CALENDAR_PATH, JOURNAL_DIRECTORY, SQLITE_DATABASE_PATH, STORAGE_BACKEND
+from journal import close_journal, get_state, load_state, rebuild_derived_state, recover, start_journal
+from metrics import increment, register_collector
+from records import record_to_dict
+from repository import add_mutation_listener, get_series, get_user, remove_mutation_listener
+
+# SQLite storage backend: a write-behind mirror of the in-memory state. Every add/remove done through the
+# repository is written to a local SQLite database, so bookings survive restarts, and the state is loaded
+# back from it on startup. Reads, the conflict check and the monthly usage check included, are always served
+# from memory, so the whole state has to fit in memory; the database is not queried while the service runs.
+# Mutations are encoded when they happen and queued, a writer thread applies whatever is queued in one
+# transaction, so a booking never waits for SQLite while holding the repository lock.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS organizations (org_id TEXT PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY, org_id TEXT NOT NULL, user_name TEXT NOT NULL, data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_org_id ON users (org_id);
+CREATE TABLE IF NOT EXISTS floors (floor_id TEXT PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS rooms (room_id TEXT PRIMARY KEY, floor_id TEXT NOT NULL, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS bookings (
+    booking_id TEXT PRIMARY KEY, user_id TEXT NOT NULL, org_id TEXT NOT NULL, room_id TEXT NOT NULL,
+    date TEXT NOT NULL, month TEXT NOT NULL, start_minute INTEGER NOT NULL, end_minute INTEGER NOT NULL,
+    hours REAL NOT NULL, data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bookings_room_date ON bookings (room_id, date, start_minute);
+CREATE INDEX IF NOT EXISTS bookings_org_month ON bookings (org_id, month);
+CREATE INDEX IF NOT EXISTS bookings_user_id ON bookings (user_id);
+CREATE TABLE IF NOT EXISTS booking_series (
+    series_id TEXT PRIMARY KEY, room_id TEXT NOT NULL, org_id TEXT NOT NULL, data TEXT NOT NULL
+);
+"""
+
+# The SQL of every statement is a constant so that sqlite3's per-connection statement cache
+# prepares each one once and reuses it afterwards
+INSERT_ORGANIZATION = "INSERT OR REPLACE INTO organizations (org_id, data) VALUES (?, ?)"
+DELETE_ORGANIZATION = "DELETE FROM organizations WHERE org_id = ?"
+INSERT_USER = "INSERT OR REPLACE INTO users (user_id, org_id, user_name, data) VALUES (?, ?, ?, ?)"
+DELETE_USER = "DELETE FROM users WHERE user_id = ?"
+DELETE_USER_BOOKINGS = "DELETE FROM bookings WHERE user_id = ?"
+INSERT_FLOOR = "INSERT OR REPLACE INTO floors (floor_id, data) VALUES (?, ?)"
+DELETE_FLOOR = "DELETE FROM floors WHERE floor_id = ?"
+INSERT_ROOM = "INSERT OR REPLACE INTO rooms (room_id, floor_id, data) VALUES (?, ?, ?)"
+DELETE_ROOM = "DELETE FROM rooms WHERE room_id = ?"
+INSERT_BOOKING = (
+    "INSERT OR REPLACE INTO bookings "
+    "(booking_id, user_id, org_id, room_id, date, month, start_minute, end_minute, hours, data) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+DELETE_BOOKING = "DELETE FROM bookings WHERE booking_id = ?"
+INSERT_SERIES = "INSERT OR REPLACE INTO booking_series (series_id, room_id, org_id, data) VALUES (?, ?, ?, ?)"
+DELETE_SERIES = "DELETE FROM booking_series WHERE series_id = ?"
+
+# Number of prepared statements each pooled connection keeps
+STATEMENT_CACHE_SIZE = 64
+# Delay before a batch that failed is written again, doubled after every failure up to WRITE_RETRY_MAX_DELAY
+WRITE_RETRY_DELAY = 0.05
+WRITE_RETRY_MAX_DELAY = 5.0
+# Attempts left to a failing batch once the backend is closing, the writes still queued after them are lost
+WRITE_ATTEMPTS_ON_CLOSE = 5
+
+
+class SQLiteBackend:
+    def __init__(self, path, pool_size=8):
+        self.path = path
+        self.pool = queue.Queue()
+        for _ in range(pool_size):
+            self.pool.put(self._connect())
+        with self.connection() as connection:
+            connection.executescript(SCHEMA)
+        # (statement, parameters) of the mutations not written yet, in the order they happened
+        self.pending = []
+        self.pending_lock = threading.Condition()
+        self.closing = False
+        # Failed batch writes in a row and in total, and the error of the last one
+        self.write_failures = 0
+        self.write_errors = 0
+        self.write_error = None
+        # SQLite allows a single writer, every write is done by this thread, started by start()
+        self.writer = threading.Thread(target=self._write_pending, daemon=True)
+
+    # Function to start writing the queued mutations
+    def start(self):
+        self.writer.start()
+
+    def _connect(self):
+        connection = sqlite3.connect(
+            self.path, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE, isolation_level=None
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    # Borrow a connection from the pool for the duration of a with block
+    @contextmanager
+    def connection(self):
+        connection = self.pool.get()
+        try:
+            yield connection
+        finally:
+            self.pool.put(connection)
+
+    # Function to apply writes in one transaction, either all of them are written or none
+    def _write(self, writes):
+        with self.connection() as connection:
+            connection.execute("BEGIN")
+            try:
+                for statement, parameters in writes:
+                    connection.execute(statement, parameters)
+                connection.execute("COMMIT")
+            except sqlite3.Error:
+                if connection.in_transaction:
+                    connection.execute("ROLLBACK")
+                raise
+
+    # Writer thread: apply the queued writes, one transaction per batch, until closed and drained
+    # A batch that fails (e.g. database locked, disk full) is rolled back and written again after a backoff,
+    # ahead of the writes queued since, so the database never misses a mutation or gets them out of order
+    def _write_pending(self):
+        while True:
+            with self.pending_lock:
+                while not self.pending and not self.closing:
+                    self.pending_lock.wait()
+                if not self.pending or (self.closing and self.write_failures >= WRITE_ATTEMPTS_ON_CLOSE):
+                    return
+                writes, self.pending = self.pending, []
+            try:
+                self._write(writes)
+            except sqlite3.Error as error:
+                increment("storage_write_errors")
+                with self.pending_lock:
+                    self.pending[:0] = writes
+                    self.write_failures += 1
+                    self.write_errors += 1
+                    self.write_error = error
+                    self.pending_lock.wait(min(WRITE_RETRY_DELAY * 2 ** (self.write_failures - 1),
+                                               WRITE_RETRY_MAX_DELAY))
+            else:
+                with self.pending_lock:
+                    self.write_failures = 0
+                    self.write_error = None
+
+    # Function to get the writes of a repository mutation, as (statement, parameters) tuples
+    # Called under the repository lock, so updated users and series are encoded whole as they are now
+    def encode(self, operation, record):
+        if operation == "add_organization":
+            return [(INSERT_ORGANIZATION, (record["Organization ID"], json.dumps(record)))]
+        if operation == "remove_organization":
+            return [(DELETE_ORGANIZATION, (record,))]
+        if operation in ("add_user", "update_user"):
+            user = get_user(record["User ID"]) if operation == "update_user" else record
+            if user is None:
+                return []
+            data = {key: value for key, value in user.items() if key != "Bookings"}
+            writes = [(INSERT_USER, (user["User ID"], user["Organization ID"], user["User Name"], json.dumps(data)))]
+            if operation == "add_user":
+                for booking in user.get("Bookings", []):
+                    writes.extend(self.encode("add_booking", booking))
+            return writes
+        if operation == "remove_user":
+            return [(DELETE_USER_BOOKINGS, (record,)), (DELETE_USER, (record,))]
+        if operation == "add_floor":
+            return [(INSERT_FLOOR, (record["Floor ID"], json.dumps(record)))]
+        if operation == "remove_floor":
+            return [(DELETE_FLOOR, (record,))]
+        if operation == "add_room":
+            return [(INSERT_ROOM, (record["Room ID"], record["Floor ID"], json.dumps(record)))]
+        if operation == "remove_room":
+            return [(DELETE_ROOM, (record,))]
+        if operation == "add_booking":
+            user = get_user(record["User ID"])
+            return [(INSERT_BOOKING, (
+                record["Booking ID"], record["User ID"], user["Organization ID"], record["Room ID"], record["Date"],
+                record["Date"][:7], hour_to_minute(record["Start Hour"]), hour_to_minute(record["End Hour"]),
+                record["End Hour"] - record["Start Hour"], json.dumps(record, default=record_to_dict)
+            ))]
+        if operation == "remove_booking":
+            return [(DELETE_BOOKING, (record,))]
+        if operation in ("add_series", "update_series"):
+            series = get_series(record["Series ID"]) if operation == "update_series" else record
+            if series is None:
+                return []
+            return [(INSERT_SERIES, (series["Series ID"], series["Room ID"], series["Organization ID"],
+                                     json.dumps(series)))]
+        if operation == "remove_series":
+            return [(DELETE_SERIES, (record,))]
+        return []
+
+    # Mutation listener: queue every repository add/remove for the writer thread
+    def save(self, operation, record):
+        writes = self.encode(operation, record)
+        if writes:
+            with self.pending_lock:
+                self.pending.extend(writes)
+                self.pending_lock.notify()
+
+    # Function to read the whole stored state in the format used by journal.load_state
+    def load_state(self):
+        with self.connection() as connection:
+            organizations = [json.loads(row[0]) for row in connection.execute("SELECT data FROM organizations")]
+            users = [json.loads(row[0]) for row in connection.execute("SELECT data FROM users")]
+            bookings_by_user = {}
+            for user_id, data in connection.execute(
+                    "SELECT user_id, data FROM bookings ORDER BY date, start_minute"):
+                bookings_by_user.setdefault(user_id, []).append(json.loads(data))
+            floors = [json.loads(row[0]) for row in connection.execute("SELECT data FROM floors")]
+            rooms = [json.loads(row[0]) for row in connection.execute("SELECT data FROM rooms")]
+            booking_series = [json.loads(row[0]) for row in connection.execute("SELECT data FROM booking_series")]
+        # Organization user lists are derived from the users table instead of being rewritten on every new user
+        users_by_organization = {}
+        for user in users:
+            user["Bookings"] = bookings_by_user.get(user["User ID"], [])
+            users_by_organization.setdefault(user["Organization ID"], []).append(user["User ID"])
+        for organization in organizations:
+            organization["Users"] = users_by_organization.get(organization["Organization ID"], [])
+        return {
+            "organizations": organizations,
+            "users": users,
+            "floors": floors,
+            "rooms": rooms,
+            "booking_series": booking_series,
+        }
+
+    # Function to write everything queued and close the connections
+    # Raises the last write error when writes could not be written before closing
+    def close(self):
+        with self.pending_lock:
+            self.closing = True
+            self.write_failures = 0
+            self.pending_lock.notify()
+        if self.writer.is_alive():
+            self.writer.join()
+        while not self.pool.empty():
+            self.pool.get().close()
+        if self.pending:
+            raise self.write_error
+
+
+# The backend every mutation is currently written to, None when the state only lives in memory
+storage_state = {"backend": None}
+
+
+# Function to open a SQLite database and restore the state stored in it, nothing is written to it before
+# start_sqlite_storage. A new database is seeded with the current in-memory state (e.g. the default organization
+# and user)
+def load_sqlite_storage(path, pool_size=8):
+    backend = SQLiteBackend(path, pool_size)
+    state = backend.load_state()
+    if state["organizations"] or state["users"]:
+        load_state(state)
+        rebuild_derived_state()
+    else:
+        state = get_state()
+        for operation, key in (("add_organization", "organizations"), ("add_user", "users"),
+                               ("add_floor", "floors"), ("add_room", "rooms"), ("add_series", "booking_series")):
+            for record in state[key]:
+                backend.save(operation, record)
+    return backend
+
+
+# Function to start mirroring every change to a backend returned by load_sqlite_storage
+def start_sqlite_storage(backend):
+    backend.start()
+    storage_state["backend"] = backend
+    register_collector("storage_pending_writes", lambda: len(backend.pending))
+    register_collector("storage_write_errors_total", lambda: backend.write_errors, "counter")
+    add_mutation_listener(backend.save)
+    return backend
+
+
+# Function to open a SQLite database, restore the state stored in it and mirror every change to it
+def open_sqlite_storage(path, pool_size=8):
+    return start_sqlite_storage(load_sqlite_storage(path, pool_size))
+
+
+# Function to stop writing changes to the storage backend and close it
+def close_storage():
+    backend = storage_state["backend"]
+    if backend is None:
+        return
+    remove_mutation_listener(backend.save)
+    storage_state["backend"] = None
+    backend.close()
+
+
+# Function to restore the saved state and persist every change from now on, with the backend set in constants
+def open_configured_storage():
+    start_configured_storage(load_configured_storage())
+
+
+# Function to restore the saved state with the backend set in constants, without starting any thread, so that
+# worker processes can be forked from it (see sharding.start_shards). Returns what start_configured_storage
+# needs to persist every change from then on.
+def load_configured_storage():
+    # The availability calendar is filled by the rebuild that follows loading the state
+    if AVAILABILITY_CALENDAR_PATH:
+        open_availability_calendar(AVAILABILITY_CALENDAR_PATH)
+    if STORAGE_BACKEND == 'sqlite':
+        return load_sqlite_storage(SQLITE_DATABASE_PATH)
+    os.makedirs(JOURNAL_DIRECTORY, exist_ok=True)
+    return recover(JOURNAL_DIRECTORY)
+
+
+# Function to start persisting every change, with what load_configured_storage returned
+def start_configured_storage(loaded):
+    if STORAGE_BACKEND == 'sqlite':
+        start_sqlite_storage(loaded)
+    else:
+        start_journal(JOURNAL_DIRECTORY, loaded)
+
+
+# Function to flush and close whichever persistence is open
+def close_configured_storage():
+    close_journal()
+    try:
+        close_storage()
+    finally:
+        close_availability_calendar()
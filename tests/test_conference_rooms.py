@@ -0,0 +1,17 @@
+from conference_rooms import add_floor, add_room
+from data_structures import building, users
+from repository import get_floor_by_number
+from sessions import create_session
+
+
+def test_add_room_answers_a_capacity_that_is_not_a_number():
+    session_token = create_session(users[0])
+    add_floor(session_token, 9201)
+    floor_id = get_floor_by_number(9201)["Floor ID"]
+    rooms = len(building["Rooms"])
+
+    assert add_room(session_token, floor_id, "Capacity Check", "ten") == "Invalid capacity."
+    assert add_room(session_token, floor_id, "Capacity Check", "0") == "Invalid capacity."
+    assert len(building["Rooms"]) == rooms
+    assert add_room(session_token, floor_id, "Capacity Check", "10").startswith("Room 'Capacity Check' added")
+    assert building["Rooms"][-1]["Capacity"] == 10
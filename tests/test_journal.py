@@ -0,0 +1,50 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import journal
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Every run is a separate process, like a restart of the application: it recovers the journal directory,
+# runs `body` and closes the journal
+RUN = """
+import sys
+import journal
+from conference_rooms import add_floor, add_room, book_room
+from data_structures import building, users
+from sessions import create_session
+
+journal.open_journal(sys.argv[1])
+session_token = create_session(users[0])
+{body}
+journal.close_journal()
+"""
+
+
+def run(directory, body):
+    script = RUN.format(body=textwrap.dedent(body))
+    result = subprocess.run([sys.executable, "-c", script, str(directory)], cwd=REPOSITORY_DIRECTORY,
+                            capture_output=True, text=True, check=True)
+    return result.stdout.strip()
+
+
+def test_bookings_after_a_torn_write_survive_the_next_recovery(tmp_path):
+    print_room = """
+    room = next(room for room in building["Rooms"] if room["Room Name"] == "Torn")
+    print(sorted(booking["Start Hour"] for booking in users[0]["Bookings"] if booking["Room ID"] == room["Room ID"]))
+    """
+    run(tmp_path, """
+    add_floor(session_token, 1)
+    add_room(session_token, building["Floors"][0]["Floor ID"], "Torn", 10)
+    print(book_room(session_token, building["Rooms"][0]["Room ID"], 9, 10, "2030-01-07"))
+    """)
+    # A write cut short by a crash
+    with open(os.path.join(tmp_path, journal.JOURNAL_FILE_NAME), "a") as journal_file:
+        journal_file.write('["add_booking",{"Booking ID":"')
+
+    assert run(tmp_path, print_room + """
+    print(book_room(session_token, room["Room ID"], 10, 11, "2030-01-07"))
+    """) == "[9]\nBooking confirmed."
+    assert run(tmp_path, print_room) == "[9, 10]"
@@ -0,0 +1,131 @@
+import socketserver
+import threading
+from datetime import date
+
+import pytest
+
+import notifications
+import utilities
+from notifications import notification_stats, queue_notification, sent_notification_keys, wait_for_notifications
+
+
+# Local SMTP stand-in: accepts every message and keeps it, after refusing the first `refusals` senders
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SMTPStandInHandler)
+        self.messages = []
+        self.refusals = 0
+        self.lock = threading.Lock()
+
+
+class SMTPStandInHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.reply("220 stand-in ESMTP")
+        recipients = []
+        for line in self.rfile:
+            command = line.decode().strip()
+            verb = command[:4].upper()
+            if verb == "MAIL":
+                with self.server.lock:
+                    refused = self.server.refusals > 0
+                    self.server.refusals -= refused
+                self.reply("451 Try again later" if refused else "250 OK")
+                recipients = []
+            elif verb == "RCPT":
+                recipients.append(command.split(":", 1)[1].strip("<> "))
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                for data_line in self.rfile:
+                    if data_line.rstrip(b"\r\n") == b".":
+                        break
+                    data.append(data_line.decode())
+                with self.server.lock:
+                    self.server.messages.append((recipients, "".join(data)))
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 stand-in")
+
+
+@pytest.fixture(scope="module")
+def smtp_server():
+    server = SMTPStandIn()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    settings = (utilities.SMTP_HOST, utilities.SMTP_PORT, utilities.SMTP_USE_TLS)
+    utilities.SMTP_HOST, utilities.SMTP_PORT = server.server_address
+    utilities.SMTP_USE_TLS = False
+    yield server
+    utilities.SMTP_HOST, utilities.SMTP_PORT, utilities.SMTP_USE_TLS = settings
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def smtp(smtp_server, monkeypatch):
+    monkeypatch.setattr(notifications, "RETRY_BACKOFF", 0.01)
+    assert wait_for_notifications(timeout=5)
+    smtp_server.messages.clear()
+    smtp_server.refusals = 0
+    return smtp_server
+
+
+def test_every_recipient_gets_a_message_of_its_own(smtp):
+    assert queue_notification(["a@example.com", "b@example.com"], "Subject", "Body")
+    assert wait_for_notifications(timeout=5)
+
+    assert sorted(recipients for recipients, _ in smtp.messages) == [["a@example.com"], ["b@example.com"]]
+    for recipients, data in smtp.messages:
+        assert f"To: {recipients[0]}" in data
+        assert data.count("Body") == 1
+
+
+def test_a_refused_message_is_retried(smtp):
+    smtp.refusals = 2
+    failed = notification_stats["failed"]
+
+    assert queue_notification(["retry@example.com"], "Subject", "Body")
+    assert wait_for_notifications(timeout=5)
+
+    assert [recipients for recipients, _ in smtp.messages] == [["retry@example.com"]]
+    assert smtp.refusals == 0
+    assert notification_stats["failed"] == failed
+
+
+def test_an_alert_is_sent_once_per_key_and_month(smtp):
+    this_month = (date.today().year, date.today().month)
+    key = ("Deduplicated Organization", "limit approaching")
+
+    # Not queued without recipients, so it is not marked as sent either
+    assert not queue_notification([], "Subject", "Body", dedup_key=key, month=this_month)
+    assert queue_notification(["dedup@example.com"], "Subject", "Body", dedup_key=key, month=this_month)
+    assert not queue_notification(["dedup@example.com"], "Subject", "Body", dedup_key=key, month=this_month)
+    assert queue_notification(["dedup@example.com"], "Subject", "Body", dedup_key=key, month=(9999, 1))
+    assert wait_for_notifications(timeout=5)
+
+    assert len(smtp.messages) == 2
+
+
+def test_the_keys_of_past_months_are_forgotten(smtp):
+    key = ("Forgotten Organization", "limit approaching")
+    this_month = (date.today().year, date.today().month)
+    # Recorded while January 2000 was the current month
+    sent_notification_keys[(2000, 1)] = {key}
+
+    assert queue_notification(["past@example.com"], "Subject", "Body", dedup_key=key, month=this_month)
+    assert (2000, 1) not in sent_notification_keys
+    # Alerts about a month that has passed are sent every time
+    assert queue_notification(["past@example.com"], "Subject", "Body", dedup_key=key, month=(2000, 1))
+    assert queue_notification(["past@example.com"], "Subject", "Body", dedup_key=key, month=(2000, 1))
+    assert wait_for_notifications(timeout=5)
+
+    assert len(smtp.messages) == 3
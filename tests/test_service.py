@@ -0,0 +1,31 @@
+import asyncio
+import threading
+
+import service
+import users
+from passwords import login_stats
+
+
+def test_logins_beyond_the_password_backlog_are_turned_away(monkeypatch):
+    release = threading.Event()
+
+    def authenticate(username, password):
+        release.wait(5)
+        return "session"
+    monkeypatch.setattr(users, "authenticate", authenticate)
+
+    async def flood():
+        attempts = [asyncio.ensure_future(service.login("user", "password"))
+                    for _ in range(service.MAX_PENDING_LOGINS + 5)]
+        # The attempts over the limit are answered before any password is checked
+        rejected = await asyncio.wait_for(asyncio.gather(*attempts[service.MAX_PENDING_LOGINS:]), 1)
+        release.set()
+        return await asyncio.gather(*attempts[:service.MAX_PENDING_LOGINS]), rejected
+
+    rejected_before = login_stats["rejected"]
+    admitted, rejected = asyncio.run(flood())
+
+    assert admitted == ["session"] * service.MAX_PENDING_LOGINS
+    assert rejected == [None] * 5
+    assert login_stats["rejected"] == rejected_before + 5
+    assert service.login_state["pending"] == 0
@@ -0,0 +1,31 @@
+import json
+import sqlite3
+import time
+
+from conference_rooms import add_floor
+from data_structures import users
+from sessions import create_session
+from storage import SCHEMA, close_storage, open_sqlite_storage
+
+
+def test_a_failed_batch_is_rolled_back_and_written_again(tmp_path):
+    path = str(tmp_path / "bookings.sqlite3")
+    backend = open_sqlite_storage(path)
+    try:
+        with sqlite3.connect(path) as connection:
+            connection.execute("DROP TABLE floors")
+        add_floor(create_session(users[0]), 9101)
+        deadline = time.monotonic() + 5
+        while not backend.write_errors and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert backend.write_errors
+        assert backend.writer.is_alive()
+        with sqlite3.connect(path) as connection:
+            connection.executescript(SCHEMA)
+    finally:
+        close_storage()
+
+    with sqlite3.connect(path) as connection:
+        floor_numbers = [json.loads(data)["Floor Number"] for data, in connection.execute("SELECT data FROM floors")]
+    assert 9101 in floor_numbers
+    assert backend.write_error is None
@@ -0,0 +1,97 @@
+import threading
+from datetime import date
+
+from data_structures import monthly_usage
+from recurrence import series_hours_in_month
+from repository import get_organization_series
+
+# Number of lock stripes for the counters. Counters have their own locks, separate from
+# the room locks, and each one is only held for a single dict read and write.
+USAGE_LOCK_STRIPES = 64
+
+usage_locks = [threading.Lock() for _ in range(USAGE_LOCK_STRIPES)]
+
+
+# Function to get the lock guarding an organization's counters
+def get_usage_lock(org_id):
+    return usage_locks[hash(org_id) % USAGE_LOCK_STRIPES]
+
+
+# Function to get the hours booked by an organization's recurring series in a month
+# Series are not counted in the counters, only the requested month is expanded
+def get_recurring_usage(org_id, year, month):
+    return sum(series_hours_in_month(series, year, month) for series in get_organization_series(org_id))
+
+
+# Function to get the hours booked by an organization in a month
+def get_monthly_usage(org_id, year, month):
+    return monthly_usage.get((org_id, year, month), 0) + get_recurring_usage(org_id, year, month)
+
+
+# Function to add booked hours to an organization's monthly counter
+def add_usage(org_id, year, month, hours):
+    with get_usage_lock(org_id):
+        key = (org_id, year, month)
+        monthly_usage[key] = monthly_usage.get(key, 0) + hours
+
+
+# Function to remove booked hours from an organization's monthly counter
+def remove_usage(org_id, year, month, hours):
+    with get_usage_lock(org_id):
+        key = (org_id, year, month)
+        remaining = monthly_usage.get(key, 0) - hours
+        if remaining > 0:
+            monthly_usage[key] = remaining
+        else:
+            monthly_usage.pop(key, None)
+
+
+# Function to check the monthly limit and add the hours in one step
+# Returns the hours booked before this reservation, or None if the limit would be exceeded
+def try_reserve_usage(org_id, year, month, hours, limit):
+    with get_usage_lock(org_id):
+        key = (org_id, year, month)
+        booked_hours = monthly_usage.get(key, 0)
+        recurring_hours = get_recurring_usage(org_id, year, month)
+        if hours >= limit - booked_hours - recurring_hours:
+            return None
+        monthly_usage[key] = booked_hours + hours
+        return booked_hours + recurring_hours
+
+
+# Function to check and add the hours of several months at once, either all months are reserved or none
+# hours_by_month maps (year, month) to hours; returns the hours booked before per month, or None
+def try_reserve_usage_batch(org_id, hours_by_month, limit):
+    with get_usage_lock(org_id):
+        booked_hours_by_month = {
+            (year, month): monthly_usage.get((org_id, year, month), 0) for year, month in hours_by_month
+        }
+        recurring_hours_by_month = {
+            (year, month): get_recurring_usage(org_id, year, month) for year, month in hours_by_month
+        }
+        if any(hours >= limit - booked_hours_by_month[month] - recurring_hours_by_month[month]
+               for month, hours in hours_by_month.items()):
+            return None
+        for (year, month), hours in hours_by_month.items():
+            monthly_usage[(org_id, year, month)] = booked_hours_by_month[(year, month)] + hours
+        return {month: booked_hours_by_month[month] + recurring_hours_by_month[month] for month in hours_by_month}
+
+
+# Function to rebuild every monthly counter from the users' booking history in one pass
+def rebuild_monthly_usage(users):
+    counters = {}
+    for user in users:
+        org_id = user["Organization ID"]
+        for booking in user.get("Bookings", []):
+            booking_date = date.fromisoformat(booking.date)
+            key = (org_id, booking_date.year, booking_date.month)
+            counters[key] = counters.get(key, 0) + booking.end_hour - booking.start_hour
+    for lock in usage_locks:
+        lock.acquire()
+    try:
+        monthly_usage.clear()
+        monthly_usage.update(counters)
+    finally:
+        for lock in usage_locks:
+            lock.release()
+    return len(counters)
@@ -1,45 +1,41 @@
 import uuid
-from datetime import datetime
 
-import bcrypt
-
-from data_structures import users, organizations, user_sessions
-from validations import is_admin, is_user_registered, is_logged_in
-
-
-def hash_password(password):
-    salt = bcrypt.gensalt()
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), salt)
-    return hashed_password
-
-
-def verify_password(hashed_password, input_password):
-    return bcrypt.checkpw(input_password.encode('utf-8'), hashed_password.encode('utf-8'))
+from passwords import admit_login, hash_password, needs_rehash, release_login, verify_password
+from metrics import timed
+from repository import add_user, get_organization, get_user_by_name, update_user
+from sessions import create_session, end_session
+from validations import is_logged_in, is_session_admin, is_user_registered
 
 
 # Function to log in a user and create a session
 def login():
     username = input('Enter username: ')
     password = input('Enter password: ')
-    user = next((u for u in users if u["User Name"] == username), None)
-    if user and verify_password(user["Password"], password):
-        # Generate a unique session token
-        session_token = str(uuid.uuid4())
+    return authenticate(username, password)
+
 
-        # Store the session data including user-related information
-        session_data = {
-            "user": user,
-            "session_start_time": datetime.now()
-        }
-        user_sessions[session_token] = session_data
-        return session_token  # Return the session token on successful login
-    return None  # Invalid username or password
+# Function to check a user's credentials and create a session, without prompting
+@timed("login_seconds")
+def authenticate(username, password):
+    # Turn the attempt away when too many logins are already being checked
+    if not admit_login():
+        return None
+    try:
+        user = get_user_by_name(username)
+        if user and verify_password(user["Password"], password):
+            # The password is known here, so a hash made with an old cost factor can be replaced
+            if needs_rehash(user["Password"]):
+                update_user(user["User ID"], {"Password": hash_password(password)})
+            # Create a session with the user's role and permissions cached on it
+            return create_session(user)  # Return the session token on successful login
+        return None  # Invalid username or password
+    finally:
+        release_login()
 
 
 # Function to log out a user by removing their session
 def logout(session_token):
-    if session_token in user_sessions:
-        del user_sessions[session_token]
+    end_session(session_token)
 
 
 # Function to register a new user with additional details
@@ -47,24 +43,23 @@ def register_user(session_token, org_id, user_name, password, email, role, permi
     user = is_logged_in(session_token)
     if not user:
         return "User is not logged in."
-    user_id = user['User ID']
     # Check if the user is an admin
-    if not is_admin(user_id):
+    if not is_session_admin(session_token):
         return "Permission denied. You are not an admin."
-    # Hash the password
-    hashed_password = hash_password(password)
     # Check if the username is unique
     if is_user_registered(user_name):
         return "Username is not unique. Please choose a different username."
     # Check if the organization exists
-    org = next((org for org in organizations if org["Organization ID"] == org_id), None)
+    org = get_organization(org_id)
     if not org:
         return "Valid organization is required."
+    # Hash the password, only once the request is known to be valid
+    hashed_password = hash_password(password)
     user_id = str(uuid.uuid4())
     # Additional user details
     user_details = {
         "User ID": user_id,
-        "Organization ID": org,
+        "Organization ID": org_id,
         "User Name": user_name,
         "Email": email,
         "Role": role,
@@ -72,6 +67,5 @@ def register_user(session_token, org_id, user_name, password, email, role, permi
         "Password": hashed_password,  # Store the hashed password
         "Bookings": []
     }
-    users.append(user_details)
-    org['Users'].append(user_id)
+    add_user(user_details)
     return "User registered successfully."
@@ -1,47 +1,38 @@
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-
-from constants import SMTP_HOST, SMTP_PORT, SMTP_LOGIN_EMAIL, SMTP_PASSWORD, SENDER_EMAIL
-from data_structures import organizations
+from constants import SMTP_HOST, SMTP_PORT, SMTP_LOGIN_EMAIL, SMTP_PASSWORD, SENDER_EMAIL, SMTP_USE_TLS
+from metrics import timed
+from repository import get_organization_by_name, get_user
 
 
 def get_admin_emails(organization_name):
-    organization = next((org for org in organizations if org['Name'] == organization_name), None)
+    organization = get_organization_by_name(organization_name)
     if organization:
-        admin_emails = [user["Email"] for user in organization["Users"] if user.get("Role") == "Admin"]
+        org_users = (get_user(user_id) for user_id in organization["Users"])
+        # Admins without an email address cannot be notified
+        admin_emails = [
+            user["Email"] for user in org_users if user and user.get("Role") == "admin" and user.get("Email")
+        ]
         return admin_emails
     return "Organization not found."
 
 
-def send_email(recipient_emails, subject, message):
-    try:
-        # Create the email message
-        email = MIMEMultipart()
-        email['From'] = SENDER_EMAIL
-        email['Subject'] = subject
-        email.attach(MIMEText(message, 'plain'))
-
-        # Connect to the SMTP server (e.g., Gmail's SMTP server)
-        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT)
+# Function to open an authenticated connection to the SMTP server
+# smtplib (with ssl) and the email package are only imported once mail is sent, they take longer to
+# import than the rest of the application
+@timed("smtp_connect_seconds")
+def open_smtp_connection():
+    import smtplib
+    server = smtplib.SMTP(SMTP_HOST, SMTP_PORT)
+    if SMTP_USE_TLS:
         server.starttls()
         server.login(SMTP_LOGIN_EMAIL, SMTP_PASSWORD)
-
-        for recipient_email in recipient_emails:
-            email['To'] = recipient_email
-            email.attach(MIMEText(message, 'plain'))
-
-            # Send the email to the current recipient
-            server.sendmail(SENDER_EMAIL, recipient_email, email.as_string())
-
-            # Clear the recipient's email address for the next iteration
-            email.replace_header('To', '')
-
-        # Close the server connection
-        server.quit()
-
-        return "Emails sent successfully."
-    except Exception as e:
-        return f"Email could not be sent. Error: {str(e)}"
+    return server
 
 
+# Function to build the message for a single recipient
+def build_email(recipient_email, subject, message):
+    from email.mime.text import MIMEText
+    email = MIMEText(message, 'plain')
+    email['From'] = SENDER_EMAIL
+    email['To'] = recipient_email
+    email['Subject'] = subject
+    return email
@@ -1,42 +1,45 @@
-from datetime import datetime, timedelta
-
-from data_structures import users, organizations, user_sessions
-
-# Session timeout duration (e.g., 30 minutes)
-session_timeout = timedelta(minutes=30)
+from data_structures import user_sessions
+from repository import get_organization_by_name, get_user, get_user_by_name
+from sessions import get_session
 
 
 # generalised function to check admin users
 def is_admin(user_id):
-    user = next((user for user in users if user['User ID'] == user_id), None)
+    user = get_user(user_id)
     return user and user["Role"] == "admin"
 
 
 # Function to check if an organization is already registered
 def is_organization_registered(org_name):
-    return any(org["Name"] == org_name for org in organizations)
+    return get_organization_by_name(org_name) is not None
 
 
 # Function to check if a user is already registered
 def is_user_registered(user_name):
-    return any(user["User Name"] == user_name for user in users)
+    return get_user_by_name(user_name) is not None
 
 
 # Function to check if a user is logged in and return the user object
 def is_logged_in(session_token):
-    if session_token in user_sessions:
-        session_data = user_sessions[session_token]
-        session_start_time = session_data["session_start_time"]
-        current_time = datetime.now()
-
-        # Check if the session has timed out
-        if current_time - session_start_time <= session_timeout:
-            return session_data["user"]  # Return the user object if logged in
-        else:
-            del user_sessions[session_token]  # Remove the expired session
+    # Expired sessions are removed on lookup and by the expiry sweep in sessions.py
+    session_data = get_session(session_token)
+    if session_data:
+        return session_data["user"]  # Return the user object if logged in
     return None  # User is not logged in
 
 
+# Function to check if the user of a session is an admin, using the role cached on the session
+def is_session_admin(session_token):
+    session_data = user_sessions.get(session_token)
+    return bool(session_data and session_data["Is Admin"])
+
+
+# Function to check if the user of a session has a permission, using the permissions cached on the session
+def session_has_permission(session_token, permission):
+    session_data = user_sessions.get(session_token)
+    return bool(session_data and permission in session_data["Permissions"])
+
+
 def has_necessary_permissions(user, permission):
     if permission in user['Permissions']:
         return True